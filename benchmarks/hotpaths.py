@@ -0,0 +1,306 @@
+"""
+Offline benchmarks of megaphone hot paths.
+
+Blocks, histories and posts come from a seeded
+megaphone.synthetic.SyntheticChain served by a local
+megaphone.fakenode.FakeNode, so results only depend on the code and the
+machine. With --direct the chain is called in-process, which leaves out
+the websocket round trips and measures megaphone's own overhead.
+
+Results are printed as JSON and compared against a baseline stored with
+--save-baseline on the same machine; the script fails if a benchmark got
+slower than the tolerance allows, or if there is no baseline.
+
+    python benchmarks/hotpaths.py [--direct] [--latency S] [--only NAME]
+                                  [--baseline FILE] [--save-baseline]
+                                  [--tolerance 0.2] [--output FILE]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from megaphone.synthetic import PAYOUT_BLOCKS, SyntheticChain  # noqa: E402
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "baseline.json")
+
+# registered benchmarks: name -> (function, unit, higher is better)
+BENCHMARKS = {}
+
+
+def benchmark(unit, higher_is_better=True):
+    def register(func):
+        BENCHMARKS[func.__name__] = (func, unit, higher_is_better)
+        return func
+    return register
+
+
+class LocalChain(object):
+    """
+    Chain stand-in calling a source in-process.
+    """
+    def __init__(self, source):
+        self.rpc = source
+
+
+class Context(object):
+    def __init__(self, chaind, source, args):
+        self.chaind = chaind
+        self.source = source
+        self.args = args
+
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def _replay(ctx, **kwargs):
+    from megaphone.blockchain import Blockchain
+
+    blockchain = Blockchain(ctx.chaind)
+    start = PAYOUT_BLOCKS + 1
+    # replay prints a message when done
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds, count = _timed(lambda: sum(1 for _ in blockchain.replay(
+            start_block=start, end_block=start + ctx.args.blocks, **kwargs)))
+    return count / seconds
+
+
+@benchmark("ops/s")
+def replay(ctx):
+    return _replay(ctx)
+
+
+@benchmark("ops/s")
+def replay_filtered(ctx):
+    return _replay(ctx, filter_by=["transfer", "custom_json"])
+
+
+@benchmark("ops/s")
+def replay_virtual(ctx):
+    return _replay(ctx, filter_by="curation_reward")
+
+
+@benchmark("ops/s")
+def replay_where(ctx):
+    voters = set(ctx.source.account_name(i) for i in range(100))
+    return _replay(ctx, filter_by="vote", where={"voter": voters})
+
+
+@benchmark("items/s")
+def account_history(ctx):
+    from megaphone.account import Account
+
+    account = Account(_account_with_history(ctx), ctx.chaind)
+    seconds, count = _timed(lambda: sum(1 for _ in account.history()))
+    return count / seconds
+
+
+@benchmark("s", higher_is_better=False)
+def get_block_from_time(ctx):
+    from megaphone.blockchain import Blockchain
+
+    blockchain = Blockchain(ctx.chaind)
+    targets = [ctx.source.block_time(n) for n in
+               range(1000, ctx.source.head_block, ctx.source.head_block // 20)]
+    seconds, _ = _timed(lambda: [blockchain.get_block_from_time(t)
+                                 for t in targets])
+    return seconds / len(targets)
+
+
+@benchmark("s", higher_is_better=False)
+def time_to_whale(ctx):
+    from megaphone.account import Account
+
+    account = Account("user0000000", ctx.chaind)
+    # blog posts are fetched as plain dicts, piston is not involved
+    account._blog = [ctx.source.get_content("user0000000", "blog-%d" % k)
+                     for k in range(ctx.args.posts)]
+    seconds, _ = _timed(lambda: account.time_to_whale(
+        max_posts=ctx.args.posts, whale_power_threshold=1e3))
+    return seconds
+
+
+@benchmark("s", higher_is_better=False)
+def curation_stats(ctx):
+    from megaphone.account import Account
+
+    account = Account(_account_with_history(ctx), ctx.chaind)
+    seconds, _ = _timed(account.curation_stats)
+    return seconds
+
+
+@benchmark("assets/s")
+def read_asset(ctx):
+    from megaphone.helpers import read_asset
+
+    assets = ["%d.%03d STEEM" % (i, i % 1000) for i in range(ctx.args.items)]
+    seconds, _ = _timed(lambda: [read_asset(a) for a in assets])
+    return len(assets) / seconds
+
+
+@benchmark("timestamps/s")
+def parse_timestamp(ctx):
+    from megaphone.helpers import parse_timestamp
+
+    stamps = [ctx.source.block_time(i * 997) for i in range(ctx.args.items)]
+    seconds, _ = _timed(lambda: [parse_timestamp(s) for s in stamps])
+    return len(stamps) / seconds
+
+
+@benchmark("s", higher_is_better=False)
+def time_diff(ctx):
+    from megaphone.helpers import time_diff
+
+    stamps = [ctx.source.block_time(i * 997) for i in range(ctx.args.items)]
+    seconds, _ = _timed(lambda: [time_diff(a, b)
+                                 for a, b in zip(stamps, stamps[1:])])
+    return seconds
+
+
+@benchmark("s", higher_is_better=False)
+def import_account(ctx):
+    from import_time import measure
+
+    return measure("megaphone.account", repeat=3)["seconds"]
+
+
+def _account_with_history(ctx):
+    # the account whose history is closest to the requested length
+    source = ctx.source
+    i = 0
+    while source.history_length(i) > ctx.args.history:
+        i += 1
+    return source.account_name(i)
+
+
+@contextlib.contextmanager
+def connect(source, args):
+    if args.direct:
+        yield LocalChain(source)
+        return
+
+    from megaphone.fakenode import FakeNode
+    from megaphone.node import Node
+
+    with FakeNode(source=source, latency=args.latency, seed=0) as fake:
+        Node.pin([fake.url])
+        try:
+            yield Node().connect()
+        finally:
+            Node.pin(None)
+
+
+def run(args):
+    source = SyntheticChain(seed=args.seed,
+                            head_block=PAYOUT_BLOCKS + 10 * args.blocks)
+    names = args.only or sorted(BENCHMARKS)
+    results = {}
+    with connect(source, args) as chaind:
+        ctx = Context(chaind, source, args)
+        for name in names:
+            func, unit, higher_is_better = BENCHMARKS[name]
+            results[name] = {
+                "value": func(ctx),
+                "unit": unit,
+                "higher_is_better": higher_is_better,
+            }
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "transport": "direct" if args.direct else "websocket",
+            "latency": args.latency,
+            "seed": args.seed,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Return regressions of report against baseline, a benchmark regresses
+    when it is worse by more than tolerance (a fraction).
+    """
+    regressions = []
+    for name, result in sorted(report["results"].items()):
+        base = baseline["results"].get(name)
+        if not base or not base["value"]:
+            continue
+        ratio = result["value"] / base["value"]
+        if not result["higher_is_better"]:
+            ratio = 1 / ratio if ratio else float("inf")
+        result["baseline"] = base["value"]
+        result["ratio"] = ratio
+        if ratio < 1 - tolerance:
+            regressions.append("%s: %.4g %s vs baseline %.4g %s"
+                               % (name, result["value"], result["unit"],
+                                  base["value"], base["unit"]))
+    return regressions
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--direct", action="store_true",
+                            help="call the synthetic chain in-process")
+    arg_parser.add_argument("--latency", type=float, default=0.0,
+                            help="fake node response latency in seconds")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--blocks", type=int, default=1000,
+                            help="blocks replayed")
+    arg_parser.add_argument("--history", type=int, default=20000,
+                            help="account history length")
+    arg_parser.add_argument("--posts", type=int, default=50,
+                            help="posts analysed by time_to_whale")
+    arg_parser.add_argument("--items", type=int, default=100000,
+                            help="strings parsed by parser benchmarks")
+    arg_parser.add_argument("--only", action="append",
+                            choices=sorted(BENCHMARKS),
+                            help="run only this benchmark, repeatable")
+    arg_parser.add_argument("--baseline", default=BASELINE,
+                            help="baseline file, default %(default)s")
+    arg_parser.add_argument("--save-baseline", action="store_true",
+                            help="store results as the new baseline")
+    arg_parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="allowed slowdown as a fraction")
+    arg_parser.add_argument("--output", help="also write results to file")
+    args = arg_parser.parse_args()
+
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        print("No baseline %s, store one with --save-baseline first"
+              % args.baseline, file=sys.stderr)
+        return 2
+
+    report = run(args)
+    regressions = []
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+    report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    for regression in regressions:
+        print("REGRESSION %s" % regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Import time benchmark for megaphone modules.
+
+Every module is imported in a fresh interpreter. The script reports the
+import time and fails if a module exceeds its time budget or eagerly
+imports one of the heavy dependencies it should load lazily.
+
+    python benchmarks/import_time.py [--json] [--repeat N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY = ["numpy", "gevent", "grequests", "werkzeug", "dateutil", "piston",
+         "websocket"]
+
+# module: (time budget in seconds, heavy modules it may import)
+BUDGETS = {
+    "megaphone": (0.05, []),
+    "megaphone.helpers": (0.15, []),
+    "megaphone.asset": (0.15, []),
+    "megaphone.node": (0.15, []),
+    "megaphone.blockchain": (0.15, []),
+    "megaphone.converter": (0.15, []),
+    "megaphone.account": (0.15, []),
+    "megaphone.ticker": (0.15, []),
+    "megaphone.markets": (0.15, []),
+    "megaphone.rpc": (0.15, []),
+    "megaphone.throttle": (0.15, []),
+    "megaphone.pool": (0.15, []),
+    "megaphone.cli": (0.15, []),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed,
+                  "heavy": [m for m in %r if m in sys.modules]}))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(module, repeat=3):
+    """
+    Return the best import time of a module out of repeat runs and the
+    heavy modules it imported.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
+    best = None
+    for _ in range(repeat):
+        out = subprocess.check_output(
+            [sys.executable, "-c", PROBE % (module, HEAVY)], env=env)
+        result = json.loads(out.decode().strip().splitlines()[-1])
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+def run(repeat=3):
+    results = {}
+    for module in sorted(BUDGETS):
+        try:
+            results[module] = measure(module, repeat)
+        except subprocess.CalledProcessError:
+            results[module] = {"seconds": None, "heavy": [], "error": True}
+    return results
+
+
+def check(results):
+    failures = []
+    for module, result in sorted(results.items()):
+        budget, allowed = BUDGETS[module]
+        if result.get("error"):
+            failures.append("%s: import failed" % module)
+            continue
+        if result["seconds"] > budget:
+            failures.append("%s: %.3fs exceeds budget of %.3fs"
+                            % (module, result["seconds"], budget))
+        eager = sorted(set(result["heavy"]) - set(allowed))
+        if eager:
+            failures.append("%s: eagerly imports %s" % (module, ", ".join(eager)))
+    return failures
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--json", action="store_true",
+                            help="print results as JSON")
+    arg_parser.add_argument("--repeat", type=int, default=3,
+                            help="runs per module, the best one is reported")
+    args = arg_parser.parse_args()
+
+    results = run(args.repeat)
+    failures = check(results)
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2))
+    else:
+        for module, result in sorted(results.items()):
+            if result.get("error"):
+                print("%-24s failed" % module)
+            else:
+                print("%-24s %7.1f ms  %s" % (module, result["seconds"] * 1000,
+                                              " ".join(result["heavy"])))
+        for failure in failures:
+            print("FAIL %s" % failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
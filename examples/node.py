@@ -20,9 +20,9 @@ def benchmark_steem_vs_golos(max_repeats=10):
         for i in range(1, max_repeats+1):
             print("Node reconnect #%d" % i)
             with sw.timer('reconnect-steem'):
-                Node("steem").default()
+                Node("steem").connect()
             with sw.timer('reconnect-golos'):
-                Node("golos").default()
+                Node("golos").connect()
         for i in range(max_repeats):
             with sw.timer('account-access-steem'):
                 Account(account=account_name, chaind=chains["steem"])
@@ -1,10 +1,25 @@
 __all__ = [
     'account',
+    'aggregate',
+    'aio',
+    'asset',
     'blockchain',
+    'cli',
     'converter',
+    'export',
+    'fakenode',
     'helpers',
     'markets',
+    'metrics',
     'node',
+    'pool',
     'post',
-    'tickers'
+    'postframe',
+    'rpc',
+    'state',
+    'synthetic',
+    'tagindex',
+    'throttle',
+    'tickers',
+    'watcher',
 ]
@@ -2,12 +2,11 @@ import datetime
 import math
 import time
 from collections import namedtuple
-from dateutil import parser
-from piston.steem import Post as PistonPost
 
-import numpy as np
 from megaphone.converter import Converter
-from megaphone.helpers import parse_payout, time_diff
+from megaphone.helpers import compile_filter, compile_where, parse_payout, \
+    parse_timestamp, time_diff
+from megaphone.metrics import default_registry
 from megaphone.node import Node
 
 
@@ -152,6 +151,8 @@ class Account(object):
         :return:
         """
         if self._blog is None:
+            from piston.steem import Post as PistonPost
+
             def _get_blog(rpc, user):
                 state = rpc.get_state("/@%s/blog" % user)
                 posts = state["accounts"][user].get("blog", [])
@@ -247,6 +248,8 @@ class Account(object):
 
         if len(time_to_whale) == 0:
             return None
+
+        import numpy as np
         return np.mean(time_to_whale[:mean_of_recent])
 
     def check_if_already_voted(self, post):
@@ -282,7 +285,7 @@ class Account(object):
         reward_7d = 0.0
 
         for event in self.history2(filter_by="curation_reward", take=10000):
-            event_utc = parser.parse(event['timestamp'] + "UTC").timestamp()
+            event_utc = parse_timestamp(event['timestamp'])
             if event_utc > trailing_7d_t:
                 reward_7d += parse_payout(event['op']['reward'])
 
@@ -342,13 +345,41 @@ class Account(object):
         else:
             return last_item
 
-    def history(self, filter_by=None, start=0):
+    @staticmethod
+    def parse_history_item(item, ops=None, where=None):
+        """
+        Build an operation from a get_account_history item.
+
+        :param item: [index, operation object] pair
+        :param ops: accepted operation types, see
+            :py:func:`megaphone.helpers.compile_filter`
+        :param where: predicate of operation bodies, see
+            :py:func:`megaphone.helpers.compile_where`
+        :return: operation, None if filtered out
+        :rtype: dict
+        """
+        op_type, op = item[1]['op']
+        if ops is not None and op_type not in ops:
+            return None
+        if where is not None and not where(op):
+            return None
+        return {
+            "index": item[0],
+            "trx_id": item[1]['trx_id'],
+            "timestamp": item[1]['timestamp'],
+            "op_type": op_type,
+            "op": op,
+        }
+
+    def history(self, filter_by=None, start=0, where=None):
         """
         All elements from start to last from history, oldest first.
         Generator.
 
         :param filter_by: filter by field
         :param start: start item
+        :param where: field predicates, see
+            :py:func:`megaphone.helpers.compile_where`
 
         :return: yield operations
         :rtype: dict
@@ -358,6 +389,8 @@ class Account(object):
         if not max_index:
             return
 
+        ops = compile_filter(filter_by)
+        where = compile_where(where)
         start_index = start + batch_size
         i = start_index
         while True:
@@ -365,44 +398,27 @@ class Account(object):
                 limit = batch_size
             else:
                 limit = batch_size - 1
+            fetch_start = time.time()
             history = self.rpc.get_account_history(self.account, i, limit)
+            default_registry.emit("history.page", account=self.account,
+                                  index=i, items=len(history),
+                                  seconds=time.time() - fetch_start)
             for item in history:
-                index = item[0]
-                if index >= max_index:
+                if item[0] >= max_index:
                     return
-
-                op_type = item[1]['op'][0]
-                op = item[1]['op'][1]
-                timestamp = item[1]['timestamp']
-                trx_id = item[1]['trx_id']
-
-                def construct_op():
-                    return {
-                        "index": index,
-                        "trx_id": trx_id,
-                        "timestamp": timestamp,
-                        "op_type": op_type,
-                        "op": op,
-                    }
-
-                if filter_by is None:
-                    yield construct_op()
-                else:
-                    if type(filter_by) is list:
-                        if op_type in filter_by:
-                            yield construct_op()
-
-                    if type(filter_by) is str:
-                        if op_type == filter_by:
-                            yield construct_op()
+                operation = self.parse_history_item(item, ops, where)
+                if operation is not None:
+                    yield operation
             i += batch_size
 
-    def history2(self, filter_by=None, take=1000):
+    def history2(self, filter_by=None, take=1000, where=None):
         """
         Take X elements from most recent history, oldest first.
 
         :param filter_by: filter by field
         :param take: amount of elements to take
+        :param where: field predicates, see
+            :py:func:`megaphone.helpers.compile_where`
 
         :return: list of operations
         :rtype: dict
@@ -412,7 +428,7 @@ class Account(object):
         if start_index < 0:
             start_index = 0
 
-        return self.history(filter_by, start=start_index)
+        return self.history(filter_by, start=start_index, where=where)
 
     def get_account_votes(self):
         """
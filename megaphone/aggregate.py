@@ -0,0 +1,415 @@
+import hashlib
+import heapq
+import itertools
+import math
+from array import array
+from collections import deque, namedtuple
+
+from megaphone.helpers import compile_filter, parse_timestamp
+
+
+class AggregateError(RuntimeError):
+    pass
+
+
+def hash64(key):
+    """
+    Stable 64 bit hash of a key, unlike hash() it is the same in every
+    process.
+
+    :param key: str or any value with a stable repr
+    :rtype: int
+    """
+    data = key.encode() if isinstance(key, str) else repr(key).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class Count(object):
+    """
+    Exact number (or total weight) of events.
+    """
+    def __init__(self):
+        self.total = 0
+
+    def add(self, key=None, weight=1):
+        self.total += weight
+
+    def merge(self, other):
+        self.total += other.total
+
+    def result(self):
+        return self.total
+
+
+class CountBy(object):
+    """
+    Exact number (or total weight) of events per key. Memory grows with the
+    number of distinct keys in a window, use :py:class:`TopK` for keys of
+    unbounded cardinality.
+    """
+    def __init__(self):
+        self.counts = {}
+
+    def add(self, key, weight=1):
+        self.counts[key] = self.counts.get(key, 0) + weight
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def result(self):
+        return dict(self.counts)
+
+
+class HyperLogLog(object):
+    """
+    Distinct count estimate in 2 ** precision bytes, the standard error is
+    about 1.04 / sqrt(2 ** precision), 1.6% with the default precision.
+    """
+    def __init__(self, precision=12):
+        if not 4 <= precision <= 18:
+            raise AggregateError("Precision must be between 4 and 18!")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, key, weight=1):
+        h = hash64(key)
+        index = h >> (64 - self.precision)
+        bits = 64 - self.precision
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        import numpy as np
+
+        if other.precision != self.precision:
+            raise AggregateError("Cannot merge sketches of different precision!")
+        merged = np.maximum(np.frombuffer(self.registers, dtype=np.uint8),
+                            np.frombuffer(other.registers, dtype=np.uint8))
+        self.registers = bytearray(merged.tobytes())
+
+    def count(self):
+        import numpy as np
+
+        m = len(self.registers)
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def result(self):
+        return self.count()
+
+
+# distinct counts are HyperLogLog estimates
+Distinct = HyperLogLog
+
+
+class CountMinSketch(object):
+    """
+    Frequency estimates in a depth x width table of counters. Estimates
+    never undercount; they overcount by at most 2 / width of the total
+    weight, with probability 1 - 0.5 ** depth. Weights must be positive.
+    """
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('q', bytes(8 * width)) for _ in range(depth)]
+
+    def _columns(self, key):
+        h = hash64(key)
+        # double hashing, row i uses h1 + i * h2
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, key, weight=1):
+        """
+        Add weight to key.
+
+        :return: new estimate of key
+        :rtype: int
+        """
+        estimate = None
+        for row, column in zip(self.rows, self._columns(key)):
+            row[column] += weight
+            if estimate is None or row[column] < estimate:
+                estimate = row[column]
+        return estimate
+
+    def estimate(self, key):
+        return min(row[column]
+                   for row, column in zip(self.rows, self._columns(key)))
+
+    def merge(self, other):
+        import numpy as np
+
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise AggregateError("Cannot merge sketches of different size!")
+        for row, other_row in zip(self.rows, other.rows):
+            np.frombuffer(row, dtype=np.int64)[:] += \
+                np.frombuffer(other_row, dtype=np.int64)
+
+    def result(self):
+        return sum(self.rows[0])
+
+
+class TopK(object):
+    """
+    Heavy hitters: the k keys with the largest total weight, estimated with
+    a :py:class:`CountMinSketch` while only k candidate keys are kept.
+    Events with a weight below 1 are ignored.
+    """
+    def __init__(self, k=10, width=2048, depth=4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates = {}
+        self._heap = []
+        # tie breaker, keys themselves may not be comparable
+        self._order = itertools.count()
+
+    def add(self, key, weight=1):
+        if weight < 1:
+            return
+        estimate = self.sketch.add(key, int(weight))
+        if key in self.candidates or len(self.candidates) < self.k:
+            self.candidates[key] = estimate
+            heapq.heappush(self._heap, (estimate, next(self._order), key))
+        elif estimate > self._minimum():
+            _, _, evicted = heapq.heappop(self._heap)
+            del self.candidates[evicted]
+            self.candidates[key] = estimate
+            heapq.heappush(self._heap, (estimate, next(self._order), key))
+        if len(self._heap) > 4 * self.k:
+            self._rebuild()
+
+    def _minimum(self):
+        # drop heap entries of keys whose estimate has grown since
+        while True:
+            estimate, _, key = self._heap[0]
+            if self.candidates.get(key) == estimate:
+                return estimate
+            heapq.heappop(self._heap)
+
+    def _rebuild(self):
+        self._heap = [(estimate, next(self._order), key)
+                      for key, estimate in self.candidates.items()]
+        heapq.heapify(self._heap)
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        keys = set(self.candidates) | set(other.candidates)
+        estimates = sorted(((self.sketch.estimate(key), key) for key in keys),
+                           key=lambda e: e[0], reverse=True)[:self.k]
+        self.candidates = dict((key, estimate) for estimate, key in estimates)
+        self._rebuild()
+
+    def result(self):
+        """
+        :return: (key, estimated weight) pairs, largest first
+        :rtype: list
+        """
+        return sorted(self.candidates.items(), key=lambda c: c[1], reverse=True)
+
+
+WindowResult = namedtuple('WindowResult', ['metric', 'start', 'end', 'value'])
+
+
+class Metric(object):
+    """
+    An aggregate over tumbling (step equal to size) or sliding windows of
+    operations. Sliding windows are kept as size / step panes, each with
+    its own aggregate, which are merged when a window closes.
+    """
+    def __init__(self, name, factory, size, step=None, filter_by=None,
+                 key=None, weight=None):
+        """
+        :param name: metric name
+        :param factory: callable returning an empty aggregate e.g.
+            :py:class:`Count`, :py:class:`CountBy`, :py:class:`HyperLogLog`
+            or :py:class:`TopK`
+        :param size: window length in seconds
+        :param step: seconds between windows, defaults to size (tumbling)
+        :param filter_by: operation type or list of types to aggregate
+        :param key: function of an operation body returning its key
+        :param weight: function of an operation body returning its weight,
+            defaults to 1
+        """
+        step = step or size
+        if size % step:
+            raise AggregateError("Window size must be a multiple of step!")
+        self.name = name
+        self.factory = factory
+        self.size = size
+        self.step = step
+        self.ops = compile_filter(filter_by)
+        self.key = key
+        self.weight = weight
+        self._panes = deque(maxlen=size // step)
+        self._current = None
+        self._current_start = None
+
+    def add(self, timestamp, op):
+        """
+        Aggregate an operation.
+
+        :param timestamp: operation time in seconds since epoch
+        :param op: operation body
+        :return: windows closed by this operation
+        :rtype: list of :py:class:`WindowResult`
+        """
+        pane_start = timestamp - timestamp % self.step
+        closed = []
+        if self._current is None:
+            self._open(pane_start)
+        elif pane_start > self._current_start:
+            closed = self._advance(pane_start)
+        self._current.add(self.key(op) if self.key else None,
+                          self.weight(op) if self.weight else 1)
+        return closed
+
+    def _open(self, pane_start):
+        self._current = self.factory()
+        self._current_start = pane_start
+
+    def _advance(self, pane_start):
+        self._panes.append((self._current_start, self._current))
+        closed = []
+        end = self._current_start + self.step
+        # windows after a gap are emitted while they still contain data
+        while end <= pane_start and end - self.size <= self._panes[-1][0]:
+            closed.append(self._window(end))
+            end += self.step
+        self._open(pane_start)
+        return closed
+
+    def _window(self, end):
+        start = end - self.size
+        value = self.factory()
+        for pane_start, pane in self._panes:
+            if start <= pane_start < end:
+                value.merge(pane)
+        return WindowResult(self.name, start, end, value.result())
+
+    def flush(self):
+        """
+        Close the window containing the latest operation.
+        """
+        if self._current is None:
+            return []
+        self._panes.append((self._current_start, self._current))
+        closed = [self._window(self._current_start + self.step)]
+        self._current = None
+        self._current_start = None
+        return closed
+
+
+class Aggregator(object):
+    """
+    Windowed statistics over a stream of operations, memory does not grow
+    with the length of the stream.
+
+    Usage::
+
+        aggregator = Aggregator()
+        aggregator.add_metric("votes_per_minute", Count, 60,
+                              filter_by="vote")
+        aggregator.add_metric("unique_voters", HyperLogLog, 3600, step=60,
+                              filter_by="vote", key=lambda op: op["voter"])
+        # vote operations carry the vote percent, not rshares
+        aggregator.add_metric("top_upvote_weight", TopK, 3600,
+                              filter_by="vote",
+                              key=lambda op: op["author"],
+                              weight=lambda op: op["weight"])
+        for window in aggregator.run(Blockchain(), stream=True):
+            print(window)
+    """
+    def __init__(self):
+        self.metrics = []
+        self._last_timestamp = (None, None)
+
+    def add_metric(self, name, factory, size, step=None, filter_by=None,
+                   key=None, weight=None):
+        """
+        Add a metric, see :py:class:`Metric`.
+
+        :return: the metric
+        :rtype: :py:class:`Metric`
+        """
+        metric = Metric(name, factory, size, step, filter_by, key, weight)
+        self.metrics.append(metric)
+        return metric
+
+    def filter_by(self):
+        """
+        Operation types used by any metric, None if a metric uses all.
+        """
+        ops = set()
+        for metric in self.metrics:
+            if metric.ops is None:
+                return None
+            ops |= metric.ops
+        return sorted(ops)
+
+    def _timestamp(self, timestamp):
+        # operations of a block share their timestamp
+        if timestamp != self._last_timestamp[0]:
+            self._last_timestamp = (timestamp, int(parse_timestamp(timestamp)))
+        return self._last_timestamp[1]
+
+    def add(self, operation):
+        """
+        Aggregate an operation as returned by replay.
+
+        :return: windows closed by this operation
+        :rtype: list of :py:class:`WindowResult`
+        """
+        closed = []
+        timestamp = None
+        for metric in self.metrics:
+            if metric.ops is not None and operation['op_type'] not in metric.ops:
+                continue
+            if timestamp is None:
+                timestamp = self._timestamp(operation['timestamp'])
+            closed.extend(metric.add(timestamp, operation['op']))
+        return closed
+
+    def flush(self):
+        """
+        Close all open windows.
+        """
+        closed = []
+        for metric in self.metrics:
+            closed.extend(metric.flush())
+        return closed
+
+    def consume(self, operations, flush=True):
+        """
+        Aggregate operations, yielding windows as they close.
+
+        :param operations: iterable of operations, e.g. from replay
+        :param flush: close open windows when operations are exhausted
+        """
+        for operation in operations:
+            for window in self.add(operation):
+                yield window
+        if flush:
+            for window in self.flush():
+                yield window
+
+    def run(self, blockchain, stream=False, **kwargs):
+        """
+        Aggregate operations of a replay or stream, fetching only
+        operation types used by the metrics.
+
+        :param blockchain: :py:class:`megaphone.blockchain.Blockchain`
+        :param stream: follow the chain head instead of replaying
+        :param kwargs: arguments of replay or stream
+        """
+        kwargs.setdefault("filter_by", self.filter_by())
+        operations = blockchain.stream(**kwargs) if stream else blockchain.replay(**kwargs)
+        return self.consume(operations)
@@ -0,0 +1,313 @@
+import asyncio
+import collections
+import itertools
+import json
+
+from megaphone.account import Account, AccountError
+from megaphone.blockchain import Blockchain
+from megaphone.helpers import compile_filter, compile_where
+from megaphone.node import Node
+
+
+class AsyncNodeError(RuntimeError):
+    pass
+
+
+class AsyncNode(object):
+    """
+    asyncio JSON-RPC client multiplexing many requests over a single
+    websocket. Responses are matched to requests by id, so any number of
+    calls may be in flight at the same time.
+
+    Requires the ``websockets`` package (``pip install megaphone[async]``).
+
+    Usage::
+
+        async with AsyncNode("ws://127.0.0.1:8090") as node:
+            props = await node.get_dynamic_global_properties()
+            followers = await node.get_followers(name, "", "blog", 100,
+                                                 api="follow")
+    """
+    def __init__(self, url="ws://127.0.0.1:8090"):
+        self.url = url
+        self._ws = None
+        self._reader = None
+        self._ids = itertools.count(1)
+        self._pending = {}
+
+    @classmethod
+    async def default(cls, blockchain="steem"):
+        """
+        Connect to a local node if available, otherwise to the first public
+        node of a blockchain.
+
+        :param blockchain: steem or golos
+        :type blockchain: str
+        :rtype: :py:class:`AsyncNode`
+        """
+        loop = asyncio.get_event_loop()
+        nodes = await loop.run_in_executor(None, Node(blockchain).nodes)
+        last_error = None
+        for url in nodes:
+            try:
+                return await cls(url).connect()
+            except (OSError, AsyncNodeError) as e:
+                last_error = e
+        raise AsyncNodeError("Could not connect to any of %s: %s"
+                             % (nodes, last_error))
+
+    async def connect(self):
+        try:
+            import websockets
+        except ImportError:
+            raise AsyncNodeError("AsyncNode requires the websockets package!")
+        try:
+            self._ws = await websockets.connect(self.url, max_size=None)
+        except websockets.exceptions.InvalidHandshake as e:
+            raise AsyncNodeError("Connection to %s failed: %s" % (self.url, e))
+        self._reader = asyncio.ensure_future(self._read())
+        return self
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
+        if self._reader is not None:
+            await self._reader
+        self._ws = None
+        self._reader = None
+
+    async def __aenter__(self):
+        if self._ws is None:
+            await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _read(self):
+        error = AsyncNodeError("Connection to %s closed" % self.url)
+        try:
+            async for message in self._ws:
+                response = json.loads(message)
+                future = self._pending.pop(response.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(AsyncNodeError(
+                        response["error"].get("message", response["error"])))
+                else:
+                    future.set_result(response.get("result"))
+        except Exception as e:
+            error = AsyncNodeError("Connection to %s lost: %s" % (self.url, e))
+        finally:
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+    async def call(self, method, *params, api="database_api"):
+        """
+        Call an api method.
+
+        :param method: method name e.g. get_block
+        :type method: str
+        :param params: method parameters
+        :param api: api name, "follow" and "follow_api" are equivalent
+        :type api: str
+        :return: result of the call
+        """
+        if self._ws is None:
+            raise AsyncNodeError("Not connected, call connect() first!")
+        if not api.endswith("_api"):
+            api += "_api"
+        request_id = next(self._ids)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await self._ws.send(json.dumps({
+                "jsonrpc": "2.0",
+                "id": request_id,
+                "method": "call",
+                "params": [api, method, list(params)],
+            }))
+            return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+
+        def call(*params, api="database_api"):
+            return self.call(method, *params, api=api)
+        call.__name__ = method
+        return call
+
+
+class AsyncBlockchain(object):
+    """
+    asyncio counterpart of :py:class:`megaphone.blockchain.Blockchain`.
+    Blocks are fetched ahead of the consumer with up to ``prefetch``
+    requests in flight.
+    """
+    def __init__(self, node):
+        """
+        :param node: connected node
+        :type node: :py:class:`AsyncNode`
+        """
+        self.node = node
+        self._config = None
+
+    async def get_config(self):
+        if self._config is None:
+            self._config = await self.node.get_config()
+        return self._config
+
+    async def get_current_block(self):
+        props = await self.node.get_dynamic_global_properties()
+        return props['last_irreversible_block_num']
+
+    async def stream(self, **kwargs):
+        start_block = await self.get_current_block()
+        async for operation in self.replay(start_block=start_block, **kwargs):
+            yield operation
+
+    async def replay(self, start_block=1, end_block=None, filter_by=None,
+                     where=None, virtual=False, prefetch=16, **kwargs):
+        """
+        :param start_block: Block number of the first block to parse.
+        :param end_block: Block number of the last block to parse.
+        :param filter_by: A string or list of filters. ie: "vote" or ["comment", "vote"]
+        :param where: Field predicates of operations, see
+            :py:meth:`megaphone.blockchain.Blockchain.replay`
+        :param virtual: Include virtual operations when not filtering by type.
+        :param prefetch: Number of blocks requested ahead.
+        :param kwargs: Arguments for the parser, namely verbose=False
+        :return: Returns an async generator
+        """
+        config = await self.get_config()
+        block_interval = config["STEEMIT_BLOCK_INTERVAL"]
+        last_block_mode = 'head_block_number' if 'head' in kwargs else 'last_irreversible_block_num'
+
+        ops = compile_filter(filter_by)
+        where = compile_where(where)
+        method, only_virtual = Blockchain.fetch_method(ops, virtual)
+
+        def fetch(block_num):
+            if method == "get_block":
+                return self.node.get_block(block_num)
+            return self.node.get_ops_in_block(block_num, only_virtual)
+
+        current_block = start_block
+        next_block = start_block
+        pending = collections.deque()
+        try:
+            while True:
+                props = await self.node.get_dynamic_global_properties()
+                last_confirmed_block = props[last_block_mode]
+
+                while current_block < last_confirmed_block:
+                    if end_block is not None and current_block >= end_block:
+                        return
+                    while (len(pending) < prefetch and
+                           next_block < last_confirmed_block and
+                           (end_block is None or next_block < end_block)):
+                        pending.append(asyncio.ensure_future(fetch(next_block)))
+                        next_block += 1
+
+                    result = await pending.popleft()
+                    if method == "get_block":
+                        if result is None:
+                            raise LookupError('Block is None. Are you trying to fetch a block from the future?')
+                        operations = Blockchain.parse_block(
+                            result, current_block, ops=ops, where=where, **kwargs)
+                    else:
+                        operations = Blockchain.parse_ops(
+                            result, current_block, ops=ops, where=where, **kwargs)
+                    for operation in operations:
+                        yield operation
+
+                    current_block += 1
+
+                await asyncio.sleep(block_interval)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class AsyncAccount(object):
+    """
+    asyncio counterpart of :py:class:`megaphone.account.Account` history
+    and properties.
+    """
+    def __init__(self, account, node):
+        """
+        :param account: STEEM/GOLOS account name
+        :type account: str
+        :param node: connected node
+        :type node: :py:class:`AsyncNode`
+        """
+        self.account = account
+        self.node = node
+        self._props = None
+
+    async def get_props(self):
+        """
+        Get account properties.
+
+        :return: Account properties.
+        :rtype: dict
+        """
+        if self._props is None:
+            accounts = await self.node.get_accounts([self.account])
+            if not accounts:
+                raise AccountError("Account %s does not exist!" % self.account)
+            self._props = accounts[0]
+        return self._props
+
+    async def virtual_op_count(self):
+        history = await self.node.get_account_history(self.account, -1, 0)
+        return history[0][0] if history else 0
+
+    async def history(self, filter_by=None, start=0, where=None, prefetch=4):
+        """
+        All elements from start to last from history, oldest first, see
+        :py:meth:`megaphone.account.Account.history`. Up to ``prefetch``
+        pages are requested ahead.
+
+        :param filter_by: filter by field
+        :param start: start item
+        :param where: field predicates
+        :param prefetch: number of pages requested ahead
+        :return: yield operations
+        :rtype: dict
+        """
+        batch_size = 1000
+        max_index = await self.virtual_op_count()
+        if not max_index:
+            return
+
+        ops = compile_filter(filter_by)
+        where = compile_where(where)
+        start_index = start + batch_size
+        pages = ((i, batch_size if i == start_index else batch_size - 1)
+                 for i in itertools.takewhile(
+                     lambda i: i - batch_size < max_index,
+                     itertools.count(start_index, batch_size)))
+        pending = collections.deque()
+        try:
+            while True:
+                for i, limit in itertools.islice(pages, prefetch - len(pending)):
+                    pending.append(asyncio.ensure_future(
+                        self.node.get_account_history(self.account, i, limit)))
+                if not pending:
+                    return
+                for item in await pending.popleft():
+                    if item[0] >= max_index:
+                        return
+                    operation = Account.parse_history_item(item, ops, where)
+                    if operation is not None:
+                        yield operation
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,140 @@
+import sys
+from collections import namedtuple
+
+
+class AssetError(RuntimeError):
+    pass
+
+
+PRECISIONS = {
+    "STEEM": 3,
+    "SBD": 3,
+    "VESTS": 6,
+    "GOLOS": 3,
+    "GBG": 3,
+    "GESTS": 6,
+}
+
+# symbol codes used by the bulk parser, new symbols are appended on demand
+SYMBOLS = ["STEEM", "SBD", "VESTS", "GOLOS", "GBG", "GESTS"]
+_symbol_codes = dict((s, i) for i, s in enumerate(SYMBOLS))
+
+def symbol_code(symbol):
+    """
+    Return integer code of an asset symbol.
+
+    :param symbol: asset symbol e.g. STEEM
+    :type symbol: str
+    :rtype: int
+    """
+    code = _symbol_codes.get(symbol)
+    if code is None:
+        code = _symbol_codes.setdefault(sys.intern(symbol), len(SYMBOLS))
+        if code == len(SYMBOLS):
+            SYMBOLS.append(symbol)
+    return code
+
+
+def _split(asset_string):
+    """
+    Split asset string into integer part, fraction and symbol. Common
+    "123.456 STEEM" strings are handled without the regex engine.
+    """
+    number, _, symbol = asset_string.partition(" ")
+    whole, _, fraction = number.partition(".")
+    if not (symbol.isalpha() and (whole.isdigit() or not whole) and
+            (fraction.isdigit() or not fraction) and (whole or fraction)):
+        # helpers imports this module for read_asset
+        from megaphone.helpers import re_asset
+
+        res = re_asset.match(asset_string)
+        if res is None:
+            raise AssetError("Invalid asset: %s" % asset_string)
+        whole, _, fraction = res.group('number').partition(".")
+        symbol = res.group('unit')
+    return whole, fraction, symbol
+
+
+class Asset(namedtuple('Asset', ['amount', 'symbol', 'precision'])):
+    """
+    Amount of an asset kept as integer number of the smallest units of the
+    symbol, e.g. Asset(1000, "STEEM", 3) is 1.000 STEEM. The precision of
+    symbols missing in ``PRECISIONS`` is the number of decimal places of
+    the parsed string, only assets of the same precision can be combined.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_string(cls, asset_string):
+        """
+        Parse asset string such as "123.456 STEEM".
+
+        :param asset_string: asset string
+        :type asset_string: str
+        :rtype: :py:class:`Asset`
+        """
+        whole, fraction, symbol = _split(asset_string)
+        symbol = sys.intern(symbol)
+        precision = PRECISIONS.get(symbol, len(fraction))
+        if len(fraction) > precision:
+            raise AssetError("%s supports only %d decimal places!"
+                             % (symbol, precision))
+        amount = int(whole or 0) * 10 ** precision
+        if fraction:
+            amount += int(fraction) * 10 ** (precision - len(fraction))
+        return cls(amount, symbol, precision)
+
+    @property
+    def value(self):
+        """
+        Amount as a float.
+
+        :rtype: float
+        """
+        return self.amount / 10 ** self.precision
+
+    def _check(self, other):
+        if not isinstance(other, Asset) or other.symbol != self.symbol or \
+                other.precision != self.precision:
+            raise AssetError("Cannot combine %s with %s!" % (self, other))
+
+    def __add__(self, other):
+        self._check(other)
+        return Asset(self.amount + other.amount, self.symbol, self.precision)
+
+    def __sub__(self, other):
+        self._check(other)
+        return Asset(self.amount - other.amount, self.symbol, self.precision)
+
+    def __str__(self):
+        sign = "-" if self.amount < 0 else ""
+        whole, fraction = divmod(abs(self.amount), 10 ** self.precision)
+        if not self.precision:
+            return "%s%d %s" % (sign, whole, self.symbol)
+        return "%s%d.%0*d %s" % (sign, whole, self.precision, fraction,
+                                 self.symbol)
+
+
+def parse_assets(asset_strings):
+    """
+    Parse many asset strings at once. Only symbols of ``PRECISIONS`` are
+    accepted, amounts of other symbols could be in different units.
+
+    :param asset_strings: list of asset strings
+    :type asset_strings: list of str
+    :return: amounts in the smallest units of each symbol and symbol codes
+        (see ``SYMBOLS``)
+    :rtype: tuple of numpy.ndarray
+    """
+    import numpy as np
+
+    count = len(asset_strings)
+    amounts = np.empty(count, dtype=np.int64)
+    codes = np.empty(count, dtype=np.int16)
+    for i, asset_string in enumerate(asset_strings):
+        asset = Asset.from_string(asset_string)
+        if asset.symbol not in PRECISIONS:
+            raise AssetError("Unknown asset symbol %s!" % asset.symbol)
+        amounts[i] = asset.amount
+        codes[i] = symbol_code(asset.symbol)
+    return amounts, codes
@@ -1,10 +1,28 @@
 import time
 
-import dateutil
-from dateutil import parser
-
+from .helpers import compile_filter, compile_where, parse_timestamp
+from .metrics import default_registry
 from .node import Node
 
+# operations generated by the chain itself, they are not part of blocks
+VIRTUAL_OPS = frozenset([
+    "author_reward",
+    "comment_benefactor_reward",
+    "comment_payout_update",
+    "comment_reward",
+    "curation_reward",
+    "fill_convert_request",
+    "fill_order",
+    "fill_transfer_from_savings",
+    "fill_vesting_withdraw",
+    "hardfork",
+    "interest",
+    "liquidity_reward",
+    "producer_reward",
+    "return_vesting_delegation",
+    "shutdown_witness",
+])
+
 
 class Blockchain(object):
     def __init__(self, chaind=None):
@@ -15,16 +33,26 @@ class Blockchain(object):
         self.rpc = chaind.rpc
 
     @staticmethod
-    def parse_block(block, block_id, verbose=False, **kwargs):
+    def parse_block(block, block_id, verbose=False, ops=None, where=None,
+                    **kwargs):
+        """
+        Yield operations of a get_block result.
+
+        :param ops: accepted operation types, see
+            :py:func:`megaphone.helpers.compile_filter`
+        :param where: predicate of operation bodies, see
+            :py:func:`megaphone.helpers.compile_where`
+        """
         if "transactions" in block:
             timestamp = block['timestamp']
             if verbose:
                 print("Processing #%d - %s" % (block_id, timestamp))
             for tx in block["transactions"]:
-                for opObj in tx["operations"]:
-                    op_type = opObj[0]
-                    op = opObj[1]
-
+                for op_type, op in tx["operations"]:
+                    if ops is not None and op_type not in ops:
+                        continue
+                    if where is not None and not where(op):
+                        continue
                     yield {
                         "block_id": block_id,
                         "timestamp": timestamp,
@@ -32,14 +60,60 @@ class Blockchain(object):
                         "op": op,
                     }
 
+    @staticmethod
+    def parse_ops(items, block_id, verbose=False, ops=None, where=None,
+                  **kwargs):
+        """
+        Yield operations of a get_ops_in_block result, see
+        :py:meth:`parse_block`.
+        """
+        if verbose and items:
+            print("Processing #%d - %s" % (block_id, items[0]['timestamp']))
+        for item in items:
+            op_type, op = item["op"]
+            if ops is not None and op_type not in ops:
+                continue
+            if where is not None and not where(op):
+                continue
+            yield {
+                "block_id": block_id,
+                "timestamp": item["timestamp"],
+                "op_type": op_type,
+                "op": op,
+            }
+
+    @staticmethod
+    def fetch_method(ops, virtual=False):
+        """
+        Choose the rpc call fetching operations of a block. Blocks contain
+        only regular operations, get_ops_in_block is needed for virtual
+        ones and returns nothing else if only virtual ones are asked for.
+
+        :param ops: accepted operation types, None accepts all
+        :param virtual: include virtual operations when ops is None
+        :return: "get_block" or "get_ops_in_block" and its only_virtual
+            argument
+        :rtype: tuple
+        """
+        if ops is None:
+            return ("get_ops_in_block", False) if virtual else ("get_block", None)
+        if ops.isdisjoint(VIRTUAL_OPS):
+            return "get_block", None
+        return "get_ops_in_block", ops <= VIRTUAL_OPS
+
     def stream(self, **kwargs):
         return self.replay(start_block=self.get_current_block(), **kwargs)
 
-    def replay(self, start_block=1, end_block=None, filter_by=None, **kwargs):
+    def replay(self, start_block=1, end_block=None, filter_by=None, where=None,
+               virtual=False, **kwargs):
         """
         :param start_block: Block number of the first block to parse.
         :param end_block: Block number of the last block to parse.
-        :param filter_by: A string or list of filters. ie: "vote" or ["comment", "vote"]
+        :param filter_by: A string or list of filters. ie: "vote" or ["comment", "vote"].
+            Virtual operations e.g. "curation_reward" are fetched with get_ops_in_block.
+        :param where: Field predicates of operations, see
+            :py:func:`megaphone.helpers.compile_where`. ie: {"voter": {"alice", "bob"}}
+        :param virtual: Include virtual operations when not filtering by type.
         :param kwargs: Arguments for the parser, namely verbose=False
         :return: Returns a generator
         """
@@ -50,6 +124,10 @@ class Blockchain(object):
         # last confirmed vs head
         last_block_mode = 'head_block_number' if 'head' in kwargs else 'last_irreversible_block_num'
 
+        ops = compile_filter(filter_by)
+        where = compile_where(where)
+        method, only_virtual = self.fetch_method(ops, virtual)
+
         current_block = start_block
 
         while True:
@@ -58,20 +136,27 @@ class Blockchain(object):
 
             while current_block < last_confirmed_block:
 
-                block = self.rpc.get_block(current_block)
-                if block is None:
-                    raise LookupError('Block is None. Are you trying to fetch a block from the future?')
-                for operation in self.parse_block(block, current_block, **kwargs):
-                    if filter_by is None:
-                        yield operation
-                    else:
-                        if type(filter_by) is list:
-                            if operation['op_type'] in filter_by:
-                                yield operation
-
-                        if type(filter_by) is str:
-                            if operation['op_type'] == filter_by:
-                                yield operation
+                fetch_start = time.time()
+                if method == "get_block":
+                    block = self.rpc.get_block(current_block)
+                    if block is None:
+                        raise LookupError('Block is None. Are you trying to fetch a block from the future?')
+                    operations = self.parse_block(block, current_block, ops=ops,
+                                                  where=where, **kwargs)
+                else:
+                    items = self.rpc.get_ops_in_block(current_block, only_virtual)
+                    operations = self.parse_ops(items, current_block, ops=ops,
+                                                where=where, **kwargs)
+                fetch_seconds = time.time() - fetch_start
+
+                count = 0
+                for operation in operations:
+                    count += 1
+                    yield operation
+
+                default_registry.emit("replay.block", block_num=current_block,
+                                      operations=count,
+                                      seconds=fetch_seconds)
 
                 current_block += 1
 
@@ -86,17 +171,17 @@ class Blockchain(object):
         return self.rpc.get_dynamic_global_properties()['last_irreversible_block_num']
 
     def get_block_time(self, block_num, verbose=False):
-        block = self.rpc.get_block(block_num)
+        block = self.rpc.get_block(int(block_num))
         time = block['timestamp']
         if verbose:
             print("Block %d was minted on: %s" % (block_num, time))
-        return dateutil.parser.parse(time + "UTC").timestamp()
+        return parse_timestamp(time)
 
     def get_block_from_time(self, timestring, error_margin=10, verbose=False):
         known_block = self.get_current_block()
         known_block_timestamp = self.get_block_time(known_block)
 
-        timestring_timestamp = dateutil.parser.parse(timestring + "UTC").timestamp()
+        timestring_timestamp = parse_timestamp(timestring)
 
         delta = known_block_timestamp - timestring_timestamp
         block_delta = delta / 3
@@ -0,0 +1,696 @@
+"""
+megaphone command line interface for backfills without writing Python.
+
+    megaphone replay --start 10000000 --end 10100000 --filter transfer \\
+        --workers 8 --output transfers.ndjson --checkpoint transfers.ckpt
+    megaphone replay --filter vote --format chunks --compress --output votes/
+    megaphone history furion --filter vote --output votes.ndjson
+    megaphone usernames --output usernames.txt
+
+Blocks and history pages are fetched by parallel workers, each with its
+own node connection, and written in order. A run with --checkpoint saves
+its position periodically and continues from it when started again with
+the same arguments. Throughput and rpc latency are shown on stderr.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from megaphone.helpers import compile_filter, compile_where
+from megaphone.metrics import Registry, instrument
+from megaphone.node import Node
+from megaphone.pool import close_connection
+
+HISTORY_BATCH_SIZE = 1000
+USERNAMES_BATCH_SIZE = 1000
+
+# operation fields holding integers, --where values of other fields are
+# compared as strings
+INTEGER_FIELDS = frozenset([
+    "block_num",
+    "escrow_id",
+    "orderid",
+    "percent",
+    "percent_steem_dollars",
+    "request_id",
+    "requestid",
+    "weight",
+])
+
+# items a resumed chunk export may fetch again, older buffers of rare
+# operation types are written as smaller chunks at checkpoints
+MAX_REWIND_ITEMS = 10000
+
+
+class CLIError(RuntimeError):
+    pass
+
+
+def ordered_fetch(calls, chain_factory, workers=4, prefetch=64):
+    """
+    Execute rpc calls on worker threads, each with its own connection,
+    and yield the results in order of the calls. At most prefetch calls
+    are in flight or waiting to be consumed. The worker connections are
+    closed when the calls are done.
+
+    :param calls: iterable of (method, args) pairs
+    :param chain_factory: callable returning a new chain instance
+    :param workers: number of worker threads
+    :param prefetch: calls fetched ahead of the consumer
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    local = threading.local()
+    chains = []
+    chains_lock = threading.Lock()
+
+    def run(call):
+        if not hasattr(local, "chaind"):
+            local.chaind = chain_factory()
+            with chains_lock:
+                chains.append(local.chaind)
+        method, args = call
+        return getattr(local.chaind.rpc, method)(*args)
+
+    pending = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for call in calls:
+                    pending.append(executor.submit(run, call))
+                    if len(pending) >= max(prefetch, workers):
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+    finally:
+        for chaind in chains:
+            close_connection(chaind)
+
+
+class Progress(object):
+    """
+    Live throughput display: position, blocks/s, ops/s and the mean rpc
+    latency of the last interval. A terminal gets a single updating line,
+    other streams a line per interval.
+    """
+    def __init__(self, registry, label="block", stream=None, interval=1.0,
+                 enabled=True):
+        self.registry = registry
+        self.label = label
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.enabled = enabled
+        self.blocks = 0
+        self.operations = 0
+        self.position = None
+        self._tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self._started = time.time()
+        self._last = (self._started, 0, 0, 0, 0.0)
+
+    def _rpc_totals(self):
+        rpc = self.registry.snapshot()["rpc"].values()
+        return sum(s["calls"] for s in rpc), sum(s["seconds"] for s in rpc)
+
+    def update(self, blocks=0, operations=0, position=None):
+        self.blocks += blocks
+        self.operations += operations
+        if position is not None:
+            self.position = position
+        now = time.time()
+        if self.enabled and now - self._last[0] >= self.interval:
+            self._render(now)
+
+    def _render(self, now, final=False):
+        calls, seconds = self._rpc_totals()
+        if final:
+            since, blocks, operations, last_calls, last_seconds = \
+                self._started, 0, 0, 0, 0.0
+        else:
+            since, blocks, operations, last_calls, last_seconds = self._last
+        elapsed = max(now - since, 1e-9)
+        latency = (seconds - last_seconds) / (calls - last_calls) \
+            if calls > last_calls else 0.0
+        parts = ["%s %s" % (self.label, "-" if self.position is None
+                            else self.position)]
+        if self.blocks:
+            parts.append("%.1f blocks/s" % ((self.blocks - blocks) / elapsed))
+        parts.append("%.0f ops/s" % ((self.operations - operations) / elapsed))
+        parts.append("rpc %.1f ms, %d calls" % (latency * 1000, calls))
+        if final:
+            parts.append("%d ops in %.1f s" % (self.operations,
+                                               now - self._started))
+        line = " | ".join(parts)
+        if self._tty:
+            self.stream.write("\r\033[K" + line + ("\n" if final else ""))
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+        self._last = (now, self.blocks, self.operations, calls, seconds)
+
+    def close(self):
+        if self.enabled:
+            self._render(time.time(), final=True)
+
+
+class Checkpoint(object):
+    """
+    Position of a run in a JSON file, replaced atomically on save.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.state = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def resume(self, run):
+        """
+        Return the saved state of a run, None to start from scratch.
+
+        :param run: arguments identifying the run, a checkpoint of other
+            arguments is refused
+        :type run: dict
+        """
+        if self.state is None:
+            return None
+        if self.state.get("run") != run:
+            raise CLIError("Checkpoint %s belongs to another run: %s"
+                           % (self.path, json.dumps(self.state.get("run"))))
+        return self.state
+
+    def save(self, **state):
+        if not self.path:
+            return
+        self.state = state
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class NdjsonOutput(object):
+    """
+    Operations as JSON lines in a file or on stdout ("-").
+    """
+    def __init__(self, path, resume=None):
+        self.path = path
+        if path == "-":
+            self._file = sys.stdout
+            return
+        if resume is not None and os.path.exists(path):
+            # drop lines written after the checkpoint
+            self._file = open(path, "r+")
+            self._file.truncate(resume["offset"])
+            self._file.seek(resume["offset"])
+        else:
+            self._file = open(path, "w")
+
+    def encode(self, operation):
+        return json.dumps(operation, separators=(",", ":")) + "\n"
+
+    def write_item(self, position, operations):
+        """
+        Write operations of an item, e.g. a block.
+
+        :return: number of operations written
+        :rtype: int
+        """
+        count = 0
+        for operation in operations:
+            self._file.write(self.encode(operation))
+            count += 1
+        return count
+
+    def checkpoint(self, position, final=False):
+        """
+        Make written items durable.
+
+        :param position: position of the last written item
+        :param final: no more items follow
+        :return: output state, position to continue after and number of
+            operations written after it
+        :rtype: tuple
+        """
+        self._file.flush()
+        if self._file is sys.stdout:
+            return {}, position, 0
+        return {"offset": self._file.tell()}, position, 0
+
+    def close(self):
+        if self._file is sys.stdout:
+            self._file.flush()
+        else:
+            self._file.close()
+
+
+class LinesOutput(NdjsonOutput):
+    """
+    Strings, one per line.
+    """
+    def encode(self, line):
+        return line + "\n"
+
+
+class ChunksOutput(object):
+    """
+    Operations as columnar chunks, see :py:class:`megaphone.export.ChunkWriter`.
+
+    A chunk is written after the item which filled it, so chunks hold whole
+    items and have at least ``chunk_size`` operations. Checkpoints do not
+    write partial chunks, a run continues after the last item before the
+    oldest buffered operation and skips operations of items already in
+    chunks of their type. Only operation types buffered for more than
+    ``max_rewind`` items are written as smaller chunks at checkpoints.
+    """
+    def __init__(self, path, position, chunk_size=100000, compress=False,
+                 resume=None, max_rewind=MAX_REWIND_ITEMS):
+        """
+        :param path: export directory
+        :param position: position of the last item written before
+        :param chunk_size: minimum operations per chunk
+        :param compress: write compressed .npz chunks
+        :param resume: output state of a checkpoint
+        :param max_rewind: items after which a checkpoint writes a buffer
+        """
+        from megaphone.export import ChunkWriter
+
+        self.writer = ChunkWriter(path, chunk_size=None, compress=compress)
+        self.chunk_size = chunk_size
+        self.max_rewind = max_rewind
+        # position of the last item in written chunks per operation type
+        self.written = {}
+        # position of the last item before the first buffered operation
+        # and the number of items written before it
+        self._buffered_after = {}
+        self._position = position
+        self._items = 0
+        if resume is not None:
+            # drop chunks written after the checkpoint
+            del self.writer.manifest["chunks"][resume["chunks"]:]
+            self.written = resume["written"]
+
+    def write_item(self, position, operations):
+        count = 0
+        for operation in operations:
+            op_type = operation['op_type']
+            if op_type in self.written and position <= self.written[op_type]:
+                continue
+            if op_type not in self._buffered_after:
+                self._buffered_after[op_type] = (self._position, self._items)
+            self.writer.add(operation)
+            count += 1
+        self._position = position
+        self._items += 1
+        for op_type, rows in self.writer.pending.items():
+            if rows >= self.chunk_size:
+                self._write_chunk(op_type)
+        return count
+
+    def _write_chunk(self, op_type):
+        self.writer.write_chunk(op_type)
+        self.written[op_type] = self._position
+        del self._buffered_after[op_type]
+
+    def checkpoint(self, position, final=False):
+        for op_type, (_, items) in list(self._buffered_after.items()):
+            if final or self._items - items > self.max_rewind:
+                self._write_chunk(op_type)
+        self.writer.write_manifest()
+        pending = sum(self.writer.pending.values())
+        if self._buffered_after:
+            position = min(p for p, _ in self._buffered_after.values())
+        state = {"chunks": len(self.writer.manifest["chunks"]),
+                 "written": dict(self.written)}
+        return state, position, pending
+
+    def close(self):
+        self.writer.close()
+
+
+def _output(args, position, resume=None):
+    if args.format == "chunks":
+        return ChunksOutput(args.output, position, chunk_size=args.chunk_size,
+                            compress=args.compress, resume=resume)
+    return NdjsonOutput(args.output, resume=resume)
+
+
+def _chain_factory(args, registry):
+    # connections share the throttle of their node, see Node.throttle
+    node = Node(args.blockchain)
+
+    def connect():
+        return instrument(node.connect_throttled(nodes=args.node),
+                          registry=registry)
+    return connect
+
+
+def _value(field, value):
+    if field in INTEGER_FIELDS:
+        try:
+            return int(value)
+        except ValueError:
+            raise CLIError("%s must be an integer, not %s" % (field, value))
+    return value
+
+
+def _where(conditions):
+    """
+    Build a compile_where mapping from FIELD=VALUE[,VALUE...] strings.
+    """
+    if not conditions:
+        return None
+    where = {}
+    for condition in conditions:
+        field, sep, values = condition.partition("=")
+        if not sep or not field:
+            raise CLIError("Invalid condition %s, expected FIELD=VALUE"
+                           % condition)
+        values = [_value(field, v) for v in values.split(",")]
+        where[field] = values[0] if len(values) == 1 else set(values)
+    return where
+
+
+def _filters(filters):
+    # repeatable and comma separated
+    if not filters:
+        return None
+    return [f for arg in filters for f in arg.split(",") if f]
+
+
+def _save(checkpoint, output, state, final=False):
+    output_state, position, pending = output.checkpoint(state["position"],
+                                                        final)
+    saved = dict(state, output=output_state, position=position,
+                 operations=state["operations"] - pending)
+    if final:
+        saved["done"] = True
+    checkpoint.save(**saved)
+
+
+def _run(checkpoint, output, state, progress, items, interval):
+    """
+    Write operations of items, (position, operations, blocks) tuples, and
+    save checkpoints between items. Interrupted runs continue from the last
+    checkpoint.
+    """
+    last_save = time.time()
+    for position, operations, blocks in items:
+        count = output.write_item(position, operations)
+        state["position"] = position
+        state["operations"] += count
+        progress.update(blocks=blocks, operations=count, position=position)
+        if checkpoint.path and time.time() - last_save >= interval:
+            _save(checkpoint, output, state)
+            last_save = time.time()
+    _save(checkpoint, output, state, final=True)
+
+
+def replay(args):
+    from megaphone.blockchain import Blockchain
+
+    registry = Registry()
+    chain_factory = _chain_factory(args, registry)
+    filter_by = _filters(args.filter)
+    ops = compile_filter(filter_by)
+    where = compile_where(_where(args.where))
+    method, only_virtual = Blockchain.fetch_method(ops, args.virtual)
+
+    end_block = args.end
+    if end_block is None:
+        chaind = chain_factory()
+        try:
+            props = chaind.rpc.get_dynamic_global_properties()
+        finally:
+            close_connection(chaind)
+        end_block = props['last_irreversible_block_num']
+
+    checkpoint = Checkpoint(args.checkpoint)
+    run = {"command": "replay", "start": args.start, "filter": filter_by,
+           "where": args.where, "virtual": args.virtual,
+           "format": args.format, "output": args.output}
+    resume = checkpoint.resume(run)
+    start_block = resume["position"] + 1 if resume else args.start
+    output = _output(args, start_block - 1,
+                     resume["output"] if resume else None)
+    state = {"run": run, "position": start_block - 1,
+             "operations": resume["operations"] if resume else 0}
+    if not resume:
+        _save(checkpoint, output, state)
+
+    def calls():
+        for block_num in range(start_block, end_block):
+            if method == "get_block":
+                yield method, (block_num,)
+            else:
+                yield method, (block_num, only_virtual)
+
+    def blocks():
+        results = ordered_fetch(calls(), chain_factory, workers=args.workers,
+                                prefetch=args.prefetch)
+        for block_num, result in enumerate(results, start_block):
+            if method == "get_block":
+                if result is None:
+                    raise CLIError("Block %d does not exist!" % block_num)
+                operations = Blockchain.parse_block(result, block_num,
+                                                    ops=ops, where=where)
+            else:
+                operations = Blockchain.parse_ops(result, block_num,
+                                                  ops=ops, where=where)
+            yield block_num, operations, 1
+
+    progress = Progress(registry, interval=args.progress_interval,
+                        enabled=not args.quiet)
+    try:
+        _run(checkpoint, output, state, progress, blocks(),
+             args.checkpoint_interval)
+    finally:
+        output.close()
+        progress.close()
+
+
+def history(args):
+    from megaphone.account import Account
+
+    registry = Registry()
+    chain_factory = _chain_factory(args, registry)
+    filter_by = _filters(args.filter)
+    ops = compile_filter(filter_by)
+    where = compile_where(_where(args.where))
+    chaind = chain_factory()
+    try:
+        max_index = Account(args.account, chaind).virtual_op_count()
+    finally:
+        close_connection(chaind)
+
+    checkpoint = Checkpoint(args.checkpoint)
+    run = {"command": "history", "account": args.account,
+           "start": args.start, "filter": filter_by, "where": args.where,
+           "format": args.format, "output": args.output}
+    resume = checkpoint.resume(run)
+    start = resume["position"] + 1 if resume else args.start
+    output = _output(args, start - 1, resume["output"] if resume else None)
+    state = {"run": run, "position": start - 1,
+             "operations": resume["operations"] if resume else 0}
+    if not resume:
+        _save(checkpoint, output, state)
+
+    # pages as in Account.history, the first one includes index start
+    pages = []
+    i = start + HISTORY_BATCH_SIZE
+    limit = HISTORY_BATCH_SIZE
+    while i - limit < max_index:
+        pages.append((i, limit))
+        i += HISTORY_BATCH_SIZE
+        limit = HISTORY_BATCH_SIZE - 1
+
+    def items():
+        calls = (("get_account_history", (args.account, index, limit))
+                 for index, limit in pages)
+        results = ordered_fetch(calls, chain_factory, workers=args.workers,
+                                prefetch=args.prefetch)
+        for (index, _), page in zip(pages, results):
+            operations = []
+            for item in page:
+                if item[0] >= max_index:
+                    break
+                operation = Account.parse_history_item(item, ops, where)
+                if operation is not None:
+                    operation["block_id"] = item[1].get("block")
+                    operations.append(operation)
+            yield min(index, max_index - 1), operations, 0
+
+    progress = Progress(registry, label="index",
+                        interval=args.progress_interval,
+                        enabled=not args.quiet)
+    try:
+        _run(checkpoint, output, state, progress, items(),
+             args.checkpoint_interval)
+    finally:
+        output.close()
+        progress.close()
+
+
+def usernames(args):
+    registry = Registry()
+    chaind = _chain_factory(args, registry)()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    run = {"command": "usernames", "start": args.start, "output": args.output}
+    resume = checkpoint.resume(run)
+    output = LinesOutput(args.output,
+                         resume=resume["output"] if resume else None)
+    lower_bound = resume["position"] if resume else args.start
+    state = {"run": run, "position": lower_bound,
+             "operations": resume["operations"] if resume else 0}
+    if not resume:
+        _save(checkpoint, output, state)
+
+    def items():
+        bound = lower_bound
+        first = not resume
+        while True:
+            names = chaind.rpc.lookup_accounts(bound, USERNAMES_BATCH_SIZE)
+            # lookup_accounts includes the lower bound itself
+            new = names if first else [n for n in names if n > bound]
+            first = False
+            if not new:
+                return
+            bound = new[-1]
+            yield bound, new, 0
+            if len(names) < USERNAMES_BATCH_SIZE:
+                return
+
+    progress = Progress(registry, label="account",
+                        interval=args.progress_interval,
+                        enabled=not args.quiet)
+    try:
+        _run(checkpoint, output, state, progress, items(),
+             args.checkpoint_interval)
+    finally:
+        output.close()
+        progress.close()
+        close_connection(chaind)
+
+
+def _errors():
+    """
+    Errors reported on one line instead of a traceback: megaphone errors,
+    errors returned by the node and transport errors.
+    """
+    from megaphone.account import AccountError
+    from megaphone.export import ExportError
+    from megaphone.node import NodeError
+    from megaphone.pool import PoolError, transport_errors
+
+    errors = [CLIError, AccountError, ExportError, NodeError, PoolError,
+              LookupError, ImportError]
+    try:
+        from grapheneapi.graphenewsrpc import RPCError
+        errors.append(RPCError)
+    except ImportError:
+        pass
+    return tuple(errors) + transport_errors()
+
+
+def _add_common(parser):
+    parser.add_argument("--blockchain", default="steem",
+                        choices=["steem", "golos"])
+    parser.add_argument("--node", action="append",
+                        help="node url to use instead of discovery, "
+                             "repeatable")
+    parser.add_argument("--output", "-o", default="-",
+                        help="output file or directory, default stdout")
+    parser.add_argument("--checkpoint",
+                        help="file to save the position to, the run "
+                             "continues from it when started again")
+    parser.add_argument("--checkpoint-interval", type=float, default=10.0,
+                        help="seconds between checkpoints")
+    parser.add_argument("--progress-interval", type=float, default=1.0,
+                        help="seconds between throughput updates")
+    parser.add_argument("--quiet", "-q", action="store_true",
+                        help="do not show throughput")
+
+
+def _add_operations(parser):
+    parser.add_argument("--filter", "-f", action="append",
+                        help="operation type, repeatable or comma separated")
+    parser.add_argument("--where", "-w", action="append",
+                        help="FIELD=VALUE[,VALUE...] condition on operation "
+                             "fields, repeatable")
+    parser.add_argument("--workers", "-j", type=int, default=4,
+                        help="parallel connections")
+    parser.add_argument("--prefetch", type=int, default=64,
+                        help="requests fetched ahead of the writer")
+    parser.add_argument("--format", choices=["ndjson", "chunks"],
+                        default="ndjson")
+    parser.add_argument("--chunk-size", type=int, default=100000,
+                        help="operations per chunk")
+    parser.add_argument("--compress", action="store_true",
+                        help="write compressed .npz chunks")
+
+
+def parser():
+    arg_parser = argparse.ArgumentParser(
+        prog="megaphone", description=__doc__.strip().splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.strip().splitlines()[2:]))
+    commands = arg_parser.add_subparsers(dest="command")
+    commands.required = True
+
+    command = commands.add_parser("replay", help="operations of a block range")
+    command.add_argument("--start", type=int, default=1,
+                         help="first block")
+    command.add_argument("--end", type=int,
+                         help="block to stop before, default the last "
+                              "irreversible block")
+    command.add_argument("--virtual", action="store_true",
+                         help="include virtual operations when not "
+                              "filtering by type")
+    _add_operations(command)
+    _add_common(command)
+    command.set_defaults(func=replay)
+
+    command = commands.add_parser("history", help="operations of an account")
+    command.add_argument("account")
+    command.add_argument("--start", type=int, default=0,
+                         help="first history index")
+    _add_operations(command)
+    _add_common(command)
+    command.set_defaults(func=history)
+
+    command = commands.add_parser("usernames", help="all account names")
+    command.add_argument("--start", default="",
+                         help="first name, default from the beginning")
+    _add_common(command)
+    command.set_defaults(func=usernames)
+    return arg_parser
+
+
+def main(argv=None):
+    arg_parser = parser()
+    args = arg_parser.parse_args(argv)
+    if getattr(args, "format", None) == "chunks" and args.output == "-":
+        arg_parser.error("--format chunks needs --output DIRECTORY")
+    try:
+        args.func(args)
+    except KeyboardInterrupt:
+        if args.checkpoint:
+            print("Interrupted, continue from %s" % args.checkpoint,
+                  file=sys.stderr)
+        return 130
+    except Exception as e:
+        if not isinstance(e, _errors()):
+            raise
+        print("megaphone: error: %s" % e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,345 @@
+import bisect
 import math
-from werkzeug.contrib.cache import SimpleCache
+from collections import deque
 
-from megaphone.helpers import parse_payout, read_asset, simple_cache
+from megaphone.helpers import LazyCache, parse_payout, read_asset, \
+    simple_cache
+from megaphone.metrics import hooked
 from megaphone.node import Node
 
 
-base_cache = SimpleCache()
+base_cache = LazyCache()
+
+
+class ConverterError(RuntimeError):
+    pass
+
+
+class FeedHistory(object):
+    """
+    Currency feed median rebuilt from replayed ``feed_publish`` operations.
+
+    Like steemd, the median of the witness feeds is taken once per feed
+    interval and the current median is the median of the last
+    ``window`` of those. Feeds older than ``max_age`` blocks are ignored.
+    All publishers count, the active witness set is not known from the
+    operations alone.
+    """
+    def __init__(self, interval=1200, window=84, max_age=7 * 24 * 1200):
+        self.interval = interval
+        self.max_age = max_age
+        self.feeds = {}
+        self.history = deque(maxlen=window)
+        self.median = None
+        self._next_update = None
+
+    def publish(self, block_num, publisher, exchange_rate):
+        """
+        Record the feed of a witness.
+
+        :param block_num: block number of the operation
+        :type block_num: int
+        :param publisher: witness name
+        :type publisher: str
+        :param exchange_rate: ``base`` and ``quote`` assets of the feed
+        :type exchange_rate: dict
+        """
+        quote = parse_payout(exchange_rate['quote'])
+        if quote:
+            self.feeds[publisher] = \
+                (block_num, parse_payout(exchange_rate['base']) / quote)
+
+    def advance(self, block_num):
+        """
+        Take the medians of all feed intervals up to a block.
+
+        :param block_num: block number
+        :type block_num: int
+        :return: (block number, current median) pairs of the intervals
+            that changed the current median
+        :rtype: list
+        """
+        if self._next_update is None:
+            self._next_update = block_num - block_num % self.interval
+        changes = []
+        while self._next_update <= block_num:
+            at = self._next_update
+            self._next_update += self.interval
+            prices = [price for published, price in self.feeds.values()
+                      if at - published <= self.max_age]
+            if not prices:
+                continue
+            self.history.append(_median(prices))
+            median = _median(self.history)
+            if median != self.median:
+                self.median = median
+                changes.append((at, median))
+        return changes
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+class ConverterSeries(object):
+    """
+    Compact time series of the chain state needed for conversions, once
+    it is built no RPC is needed for historical conversions.
+
+    Fields are recorded independently and known from their first sample
+    to their last one. Vesting totals grow steadily and are linearly
+    interpolated between samples. The feed median and the reward fund
+    change in steps, a value holds from its sample until the next one.
+    Reward shares are kept as Python int, float64 would round them.
+
+    The feed median is rebuilt from replayed ``feed_publish`` operations
+    and reward funds come from stored get_reward_fund results, see
+    :py:meth:`from_history`. Vesting totals are not part of any
+    operation: they come from :py:meth:`sample` called periodically, e.g.
+    by a cron job, or from stored get_dynamic_global_properties results.
+    """
+    FIELDS = ("total_vesting_fund_steem", "total_vesting_shares",
+              "total_reward_fund_steem", "total_reward_shares2",
+              "currency_median_price")
+    INTERPOLATED = ("total_vesting_fund_steem", "total_vesting_shares")
+
+    def __init__(self):
+        self.blocks = {field: [] for field in self.FIELDS}
+        self.values = {field: [] for field in self.FIELDS}
+        # last block the value of a field is known at
+        self.end = {field: None for field in self.FIELDS}
+        self._feeds = None
+
+    def __len__(self):
+        return len(set().union(*self.blocks.values()))
+
+    def add(self, block_num, total_vesting_fund_steem=None,
+            total_vesting_shares=None, total_reward_fund_steem=None,
+            total_reward_shares2=None, currency_median_price=None):
+        """
+        Add a sample to the series. Samples may be added in any order,
+        fields left as None are not recorded.
+
+        :param block_num: block number the sample was taken at
+        :type block_num: int
+        """
+        row = (total_vesting_fund_steem, total_vesting_shares,
+               total_reward_fund_steem, total_reward_shares2,
+               currency_median_price)
+        for field, value in zip(self.FIELDS, row):
+            if value is None:
+                continue
+            self._extend(field, block_num)
+            blocks, values = self.blocks[field], self.values[field]
+            pos = bisect.bisect_left(blocks, block_num)
+            if pos < len(blocks) and blocks[pos] == block_num:
+                values[pos] = value
+                continue
+            blocks.insert(pos, block_num)
+            values.insert(pos, value)
+
+    def _extend(self, field, block_num):
+        if self.end[field] is None or block_num > self.end[field]:
+            self.end[field] = block_num
+
+    def add_vesting(self, block_num, vesting_fund, vesting_shares):
+        """
+        Add a vesting totals sample, e.g. from stored
+        get_dynamic_global_properties results.
+
+        :param block_num: block number the sample was taken at
+        :type block_num: int
+        :param vesting_fund: vesting fund in tokens or an asset string
+        :param vesting_shares: vesting shares or an asset string
+        """
+        if isinstance(vesting_fund, str):
+            vesting_fund = parse_payout(vesting_fund)
+        if isinstance(vesting_shares, str):
+            vesting_shares = parse_payout(vesting_shares)
+        self.add(block_num, total_vesting_fund_steem=vesting_fund,
+                 total_vesting_shares=vesting_shares)
+
+    def add_reward_fund(self, block_num, reward_fund, reward_shares):
+        """
+        Add a reward fund sample, e.g. from stored get_reward_fund results.
+
+        :param block_num: block number the sample was taken at
+        :type block_num: int
+        :param reward_fund: reward fund in tokens or an asset string
+        :param reward_shares: reward shares (recent claims) as int or str
+        """
+        if isinstance(reward_fund, str):
+            reward_fund = parse_payout(reward_fund)
+        self.add(block_num, total_reward_fund_steem=reward_fund,
+                 total_reward_shares2=int(reward_shares))
+
+    def apply_operation(self, operation):
+        """
+        Update the feed median from a replayed operation. Operations must
+        be applied in block order.
+
+        :param operation: operation as yielded by
+            :py:meth:`megaphone.blockchain.Blockchain.replay`
+        :type operation: dict
+        """
+        if self._feeds is None:
+            self._feeds = FeedHistory()
+        block_num = operation['block_id']
+        for at, median in self._feeds.advance(block_num):
+            self.add(at, currency_median_price=median)
+        if self._feeds.median is not None:
+            self._extend("currency_median_price", block_num)
+        if operation['op_type'] == "feed_publish":
+            op = operation['op']
+            self._feeds.publish(block_num, op['publisher'],
+                                op['exchange_rate'])
+
+    @classmethod
+    def from_history(cls, operations, reward_funds=(), vesting=()):
+        """
+        Build a series from replayed operations, reward fund history and
+        vesting totals history.
+
+        Usage::
+
+            series = ConverterSeries.from_history(
+                Blockchain().replay(start, end, filter_by="feed_publish"),
+                reward_funds=[(block_num, "1000.000 STEEM", "123456"), ...],
+                vesting=[(block_num, "190000000.000 STEEM",
+                          "390000000000.000000 VESTS"), ...])
+
+        :param operations: operations in block order, ``feed_publish``
+            ones rebuild the currency feed median
+        :param reward_funds: (block number, reward fund, reward shares)
+            tuples, see :py:meth:`add_reward_fund`
+        :param vesting: (block number, vesting fund, vesting shares)
+            tuples, see :py:meth:`add_vesting`
+        :rtype: :py:class:`ConverterSeries`
+        """
+        series = cls()
+        for operation in operations:
+            series.apply_operation(operation)
+        for block_num, reward_fund, reward_shares in reward_funds:
+            series.add_reward_fund(block_num, reward_fund, reward_shares)
+        for block_num, vesting_fund, vesting_shares in vesting:
+            series.add_vesting(block_num, vesting_fund, vesting_shares)
+        return series
+
+    def sample(self, rpc):
+        """
+        Sample current chain state and add it to the series.
+
+        :param rpc: steemd/golosd rpc instance
+        :return: block number of the sample
+        :rtype: int
+        """
+        dgpo = rpc.get_dynamic_global_properties()
+        median = rpc.get_feed_history()['current_median_history']['base']
+        block_num = dgpo['head_block_number']
+        self.add(block_num,
+                 parse_payout(dgpo['total_vesting_fund_steem']),
+                 parse_payout(dgpo['total_vesting_shares']),
+                 parse_payout(dgpo['total_reward_fund_steem']),
+                 int(dgpo['total_reward_shares2']),
+                 parse_payout(median))
+        return block_num
+
+    def value(self, field, block_num, clamp=False):
+        """
+        Return the value of a field at a block.
+
+        :param field: one of ``FIELDS``
+        :param block_num: block number
+        :type block_num: int
+        :param clamp: use the first or the last sample for blocks outside
+            of the sampled range instead of raising
+        :type clamp: bool
+        :raises ConverterError: the field has no samples or the block is
+            outside of their range
+        """
+        blocks, values = self.blocks[field], self.values[field]
+        if not values:
+            raise ConverterError("Converter series has no %s samples!"
+                                 % field)
+        if not blocks[0] <= block_num <= self.end[field]:
+            if not clamp:
+                raise ConverterError(
+                    "Block %d is outside of the %s samples, blocks %d-%d!"
+                    % (block_num, field, blocks[0], self.end[field]))
+            block_num = min(max(block_num, blocks[0]), blocks[-1])
+        pos = bisect.bisect_right(blocks, block_num) - 1
+        if field in self.INTERPOLATED and pos + 1 < len(blocks):
+            start, end = blocks[pos], blocks[pos + 1]
+            return values[pos] + (values[pos + 1] - values[pos]) * \
+                (block_num - start) / (end - start)
+        return values[pos]
+
+    def lookup(self, block_num, clamp=False):
+        """
+        Return chain state at a block, see :py:meth:`value`. Fields
+        without samples are None.
+
+        :param block_num: block number
+        :type block_num: int
+        :param clamp: use the first or the last sample for blocks outside
+            of the sampled range instead of raising
+        :type clamp: bool
+        :return: chain state with the keys from ``FIELDS``
+        :rtype: dict
+        """
+        if not len(self):
+            raise ConverterError("Converter series is empty!")
+        return dict((field, self.value(field, block_num, clamp)
+                     if self.values[field] else None)
+                    for field in self.FIELDS)
+
+    def save(self, path):
+        """
+        Persist the series in compressed NumPy format. Reward shares are
+        stored as decimal strings to keep them exact.
+
+        :param path: output file path
+        :type path: str
+        """
+        import numpy as np
+        arrays = {}
+        for field in self.FIELDS:
+            values = self.values[field]
+            if field == "total_reward_shares2":
+                values = np.array([str(v) for v in values], dtype=np.str_)
+            else:
+                values = np.array(values, dtype=np.float64)
+            arrays[field + "_blocks"] = np.array(self.blocks[field],
+                                                 dtype=np.int64)
+            arrays[field + "_end"] = np.array(
+                -1 if self.end[field] is None else self.end[field],
+                dtype=np.int64)
+            arrays[field] = values
+        with open(path, "wb") as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a series previously stored with :py:meth:`save`.
+
+        :param path: input file path
+        :type path: str
+        :rtype: :py:class:`ConverterSeries`
+        """
+        import numpy as np
+        series = cls()
+        with np.load(path) as data:
+            for field in cls.FIELDS:
+                series.blocks[field] = data[field + "_blocks"].tolist()
+                end = int(data[field + "_end"])
+                series.end[field] = None if end < 0 else end
+                values = data[field].tolist()
+                if field == "total_reward_shares2":
+                    values = [int(v) for v in values]
+                series.values[field] = values
+        return series
 
 
 class Converter(object):
@@ -16,12 +350,34 @@ class Converter(object):
         token power: STEEM/GOLOS power,
         token currencies: SBD/GBG.
     """
-    def __init__(self, chaind=None):
+    def __init__(self, chaind=None, series=None):
+        if series is not None and not series.values['total_vesting_shares']:
+            raise ConverterError("Converter series has no vesting samples!")
         if not chaind:
             chaind = Node().default()
         self.rpc = chaind.rpc
         self.CONTENT_CONSTANT = 2000000000000
+        self.series = series
+
+    def at_block(self, block_num, series=None, clamp=False):
+        """
+        Return a converter pinned to the chain state at a block.
+
+        :param block_num: block number
+        :type block_num: int
+        :param series: chain state series, defaults to ``self.series``
+        :type series: :py:class:`ConverterSeries`
+        :param clamp: use the first or the last sample of the series for
+            blocks outside of the sampled range instead of raising
+        :rtype: :py:class:`HistoricalConverter`
+        """
+        if series is None:
+            series = self.series
+        if series is None:
+            raise ConverterError("Historical conversion requires a series!")
+        return HistoricalConverter(series, block_num, clamp)
 
+    @hooked("converter")
     @simple_cache(base_cache, timeout=5 * 60)
     def currency_median_price(self):
         """
@@ -33,6 +389,7 @@ class Converter(object):
         asset = self.rpc.get_feed_history()['current_median_history']['base']
         return read_asset(asset)['value']
 
+    @hooked("converter")
     @simple_cache(base_cache, timeout=5 * 60)
     def token_per_mvests(self):
         """
@@ -118,6 +475,18 @@ class Converter(object):
         """
         return amount_currency / self.currency_median_price()
 
+    @hooked("converter")
+    def reward_fund(self):
+        """
+        Return total reward fund and total reward shares2.
+
+        :return: reward fund in tokens and reward shares2
+        :rtype: tuple
+        """
+        dgpo = self.rpc.get_dynamic_global_properties()
+        asset = dgpo['total_reward_fund_steem']
+        return read_asset(asset)['value'], int(dgpo['total_reward_shares2'])
+
     def currency_to_rshares(self, currency_payout):
         """
         Convert token-based currency to reward shares.
@@ -130,10 +499,7 @@ class Converter(object):
         """
         tokens_payout = self.currency_to_token(currency_payout)
 
-        dgpo = self.rpc.get_dynamic_global_properties()
-        asset = dgpo['total_reward_fund_steem']
-        total_reward_fund_steem = read_asset(asset)['value']
-        total_reward_shares2 = int(dgpo['total_reward_shares2'])
+        total_reward_fund_steem, total_reward_shares2 = self.reward_fund()
         tokens = (tokens_payout / total_reward_fund_steem)
         post_rshares2 = tokens * total_reward_shares2
 
@@ -153,3 +519,37 @@ class Converter(object):
         """
         _max = 2 ** 64 - 1
         return (_max * rshares) / (2 * self.CONTENT_CONSTANT + rshares)
+
+
+class HistoricalConverter(Converter):
+    """
+    Converter using the chain state of a series at a given block instead
+    of the current chain state. It does not issue any RPC calls.
+
+    The series must cover the block with vesting samples, a
+    :py:class:`ConverterError` is raised otherwise. The feed median and
+    the reward fund are looked up when used.
+    """
+    def __init__(self, series, block_num, clamp=False):
+        self.rpc = None
+        self.CONTENT_CONSTANT = 2000000000000
+        self.series = series
+        self.block_num = block_num
+        self.clamp = clamp
+        self._vesting = (
+            series.value('total_vesting_fund_steem', block_num, clamp),
+            series.value('total_vesting_shares', block_num, clamp))
+
+    def _field(self, field):
+        return self.series.value(field, self.block_num, self.clamp)
+
+    def currency_median_price(self):
+        return self._field('currency_median_price')
+
+    def token_per_mvests(self):
+        vesting_fund, vesting_shares = self._vesting
+        return vesting_fund / (vesting_shares / 1e6)
+
+    def reward_fund(self):
+        return (self._field('total_reward_fund_steem'),
+                self._field('total_reward_shares2'))
@@ -0,0 +1,543 @@
+import json
+import os
+
+from megaphone.asset import PRECISIONS, SYMBOLS, Asset, AssetError, symbol_code
+from megaphone.helpers import parse_timestamp
+
+MANIFEST_FILE = "manifest.json"
+ACCOUNTS_FILE = "accounts.txt"
+VERSION = 1
+
+# free text operation fields, never parsed as assets
+TEXT_FIELDS = frozenset([
+    "body", "id", "json", "json_metadata", "memo", "parent_permlink",
+    "permlink", "title",
+])
+
+# operation fields holding account names, they are dictionary encoded
+ACCOUNT_FIELDS = frozenset([
+    "account", "author", "benefactor", "comment_author", "creator",
+    "curator", "delegatee", "delegator", "follower", "following", "from",
+    "from_account", "new_account_name", "owner", "parent_author",
+    "producer", "publisher", "to", "to_account", "voter", "witness",
+])
+
+
+class ExportError(RuntimeError):
+    pass
+
+
+def _is_int(value):
+    return type(value) in (int, bool)
+
+
+def _is_number(value):
+    return type(value) in (int, float, bool)
+
+
+def _fits(kind, value):
+    if kind == "int":
+        return _is_int(value)
+    if kind == "float":
+        return _is_number(value)
+    if kind == "asset":
+        return isinstance(value, str) and _parse_assets([value]) is not None
+    # account, string or json
+    return kind == "json" or isinstance(value, str)
+
+
+def _parse_assets(values):
+    amounts, symbols = [], []
+    for value in values:
+        try:
+            asset = Asset.from_string(value)
+        except AssetError:
+            return None
+        if asset.symbol not in PRECISIONS:
+            return None
+        amounts.append(asset.amount)
+        symbols.append(symbol_code(asset.symbol))
+    return amounts, symbols
+
+
+class ChunkWriter(object):
+    """
+    Export operations into columnar chunks, one chunk per operation type
+    and ``chunk_size`` operations.
+
+    Every chunk holds a numpy array per column: ``block_id``,
+    ``timestamp`` (int64 epoch) and one column per operation field.
+    Account names are int32 codes into a shared dictionary, assets are
+    int64 amounts in the smallest units with int16 symbol codes (see
+    :py:data:`megaphone.asset.SYMBOLS`), numbers are int64 or float64 and
+    other values are utf-8 strings stored as offsets and data arrays, with
+    lists and objects JSON encoded. A JSON manifest lists the chunks with
+    their block range.
+
+    The kind of a column is fixed per operation type by the first chunk
+    containing the field and recorded in the manifest. Operations missing
+    a field get a ``<field>.null`` mask; a later value not fitting the
+    kind raises :py:class:`ExportError`.
+
+    Chunks are either directories of uncompressed .npy files (the
+    default), which :py:class:`Export` memory maps, or with
+    ``compress=True`` compressed .npz files, which are several times
+    smaller but are decompressed into memory when read. Every manifest
+    entry records whether its chunk is compressed. Writing to an existing
+    export appends to it.
+    """
+    def __init__(self, path, chunk_size=100000, compress=False):
+        """
+        :param path: export directory
+        :param chunk_size: operations per chunk, with None chunks are
+            only written by :py:meth:`write_chunk` and :py:meth:`flush`
+        :param compress: write compressed .npz chunks instead of .npy
+            directories
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self._buffers = {}
+        self._last_timestamp = (None, None)
+        os.makedirs(path, exist_ok=True)
+
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = {"version": VERSION, "symbols": [],
+                             "accounts": ACCOUNTS_FILE, "chunks": []}
+        accounts_path = os.path.join(path, ACCOUNTS_FILE)
+        self.accounts = {}
+        if os.path.exists(accounts_path):
+            with open(accounts_path) as f:
+                for line in f:
+                    self.accounts[line.rstrip("\n")] = len(self.accounts)
+        self._accounts_file = open(accounts_path, "a")
+
+    @property
+    def last_block(self):
+        """
+        Highest block of the written chunks, 0 for an empty export.
+        """
+        return max([c["end_block"] for c in self.manifest["chunks"]] or [0])
+
+    def _timestamp(self, timestamp):
+        # operations of a block share their timestamp
+        if timestamp != self._last_timestamp[0]:
+            self._last_timestamp = (timestamp, int(parse_timestamp(timestamp)))
+        return self._last_timestamp[1]
+
+    def add(self, operation):
+        """
+        Add an operation as returned by replay.
+        """
+        op_type = operation['op_type']
+        buffer = self._buffers.setdefault(op_type, [])
+        buffer.append((operation['block_id'],
+                       self._timestamp(operation['timestamp']),
+                       operation['op']))
+        if self.chunk_size and len(buffer) >= self.chunk_size:
+            self.write_chunk(op_type)
+
+    def write(self, operations):
+        """
+        Add all operations of an iterable.
+
+        :return: number of operations
+        :rtype: int
+        """
+        count = 0
+        for operation in operations:
+            self.add(operation)
+            count += 1
+        return count
+
+    def _account_codes(self, names):
+        codes = []
+        for name in names:
+            code = self.accounts.get(name)
+            if code is None:
+                code = self.accounts[name] = len(self.accounts)
+                self._accounts_file.write(name + "\n")
+            codes.append(code)
+        return codes
+
+    @staticmethod
+    def _infer(field, values):
+        # kind of a column from the values of its first chunk
+        present = [v for v in values if v is not None]
+        if not present:
+            return None
+        if all(_is_int(v) for v in present):
+            return "int"
+        if all(_is_number(v) for v in present):
+            return "float"
+        if all(isinstance(v, str) for v in present):
+            if field in ACCOUNT_FIELDS:
+                return "account"
+            if field not in TEXT_FIELDS and _parse_assets(present) is not None:
+                return "asset"
+            return "string"
+        return "json"
+
+    def _encode(self, op_type, field, kind, values):
+        import numpy as np
+
+        missing = [v is None for v in values]
+        arrays = {}
+        if kind != "json" and any(missing):
+            arrays[field + ".null"] = np.array(missing, dtype=bool)
+        present = [v for v in values if v is not None]
+        if kind == "asset":
+            assets = _parse_assets(present)
+            fits = assets is not None
+        else:
+            fits = all(_fits(kind, v) for v in present)
+        if not fits:
+            bad = next(v for v in present if not _fits(kind, v))
+            raise ExportError("Column %s of %s is %s, cannot store %r"
+                              % (field, op_type, kind, bad))
+
+        if kind == "int":
+            arrays[field] = np.array([0 if v is None else v for v in values],
+                                     dtype=np.int64)
+        elif kind == "float":
+            arrays[field] = np.array([0 if v is None else v for v in values],
+                                     dtype=np.float64)
+        elif kind == "account":
+            codes = iter(self._account_codes(present))
+            arrays[field] = np.array([-1 if v is None else next(codes)
+                                      for v in values], dtype=np.int32)
+        elif kind == "asset":
+            amounts, symbols = iter(assets[0]), iter(assets[1])
+            arrays[field] = np.array([0 if v is None else next(amounts)
+                                      for v in values], dtype=np.int64)
+            arrays[field + ".symbol"] = np.array(
+                [-1 if v is None else next(symbols) for v in values],
+                dtype=np.int16)
+        else:
+            if kind == "json":
+                values = [json.dumps(v) for v in values]
+            encoded = [b"" if v is None else v.encode() for v in values]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(e) for e in encoded], out=offsets[1:])
+            arrays[field + ".offsets"] = offsets
+            arrays[field + ".data"] = np.frombuffer(b"".join(encoded),
+                                                    dtype=np.uint8)
+        return arrays
+
+    @property
+    def pending(self):
+        """
+        Number of buffered operations per operation type.
+
+        :rtype: dict
+        """
+        return dict((op_type, len(rows)) for op_type, rows in
+                    self._buffers.items() if rows)
+
+    def write_chunk(self, op_type):
+        """
+        Write buffered operations of a type as a chunk. The manifest is
+        updated by :py:meth:`write_manifest`.
+        """
+        import numpy as np
+
+        rows = self._buffers.pop(op_type, None)
+        if not rows:
+            return
+        fields = list(dict.fromkeys(f for _, _, op in rows for f in op))
+        arrays = {
+            "block_id": np.array([r[0] for r in rows], dtype=np.int64),
+            "timestamp": np.array([r[1] for r in rows], dtype=np.int64),
+        }
+        columns = {"block_id": "int", "timestamp": "int"}
+        # a field keeps the kind of its first chunk
+        kinds = self.manifest.setdefault("kinds", {}).setdefault(op_type, {})
+        for field in fields:
+            values = [r[2].get(field) for r in rows]
+            kind = kinds.get(field)
+            if kind is None:
+                kind = self._infer(field, values)
+                if kind is None:
+                    continue
+                kinds[field] = kind
+            arrays.update(self._encode(op_type, field, kind, values))
+            columns[field] = kind
+
+        name = "%s-%d-%d" % (op_type, rows[0][0], len(self.manifest["chunks"]))
+        if self.compress:
+            chunk_path = name + ".npz"
+            np.savez_compressed(os.path.join(self.path, chunk_path), **arrays)
+        else:
+            chunk_path = name
+            os.makedirs(os.path.join(self.path, chunk_path), exist_ok=True)
+            for column, array in arrays.items():
+                np.save(os.path.join(self.path, chunk_path, column + ".npy"),
+                        array)
+        self.manifest["chunks"].append({
+            "op_type": op_type,
+            "path": chunk_path,
+            "rows": len(rows),
+            "start_block": int(arrays["block_id"][0]),
+            "end_block": int(arrays["block_id"][-1]),
+            "compressed": self.compress,
+            "columns": columns,
+        })
+
+    def flush(self):
+        """
+        Write all buffered operations and the manifest, the export is
+        complete and readable afterwards.
+        """
+        for op_type in list(self._buffers):
+            self.write_chunk(op_type)
+        self.write_manifest()
+
+    def write_manifest(self):
+        """
+        Write the manifest of the chunks written so far, buffered
+        operations are not included.
+        """
+        self._accounts_file.flush()
+        self.manifest["symbols"] = list(SYMBOLS)
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def close(self):
+        self.flush()
+        self._accounts_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Export(object):
+    """
+    Read an export written by :py:class:`ChunkWriter`. Columns of .npy
+    chunks are memory mapped, so reading them is zero-copy.
+
+    Usage::
+
+        export = Export("votes")
+        for chunk in export.chunks("vote", start_block=10000000):
+            voters = export.account_names(chunk["voter"])
+            weights = chunk["weight"]
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != VERSION:
+            raise ExportError("Unsupported export version %s"
+                              % self.manifest.get("version"))
+        self._accounts = None
+
+    @property
+    def op_types(self):
+        return sorted(set(c["op_type"] for c in self.manifest["chunks"]))
+
+    @property
+    def accounts(self):
+        """
+        Account name dictionary, codes index into it.
+
+        :rtype: numpy.ndarray
+        """
+        if self._accounts is None:
+            import numpy as np
+
+            with open(os.path.join(self.path, self.manifest["accounts"])) as f:
+                self._accounts = np.array(f.read().splitlines(), dtype=str)
+        return self._accounts
+
+    def account_names(self, codes):
+        """
+        Names of account codes, "" for missing values (code -1).
+        """
+        import numpy as np
+
+        return np.where(codes >= 0, self.accounts[codes], "")
+
+    def symbols(self, codes):
+        """
+        Symbols of asset symbol codes, "" for missing values (code -1).
+        """
+        import numpy as np
+
+        symbols = np.array(self.manifest["symbols"], dtype=str)
+        return np.where(codes >= 0, symbols[codes], "")
+
+    def columns(self, op_type):
+        """
+        Column kinds of an operation type: int, float, account, asset,
+        string or json.
+
+        :rtype: dict
+        """
+        columns = {}
+        for chunk in self.manifest["chunks"]:
+            if chunk["op_type"] == op_type:
+                columns.update(chunk["columns"])
+        columns.update(self.manifest.get("kinds", {}).get(op_type, {}))
+        return columns
+
+    def _entries(self, op_type, start_block, end_block):
+        for entry in self.manifest["chunks"]:
+            if entry["op_type"] != op_type:
+                continue
+            if start_block is not None and entry["end_block"] < start_block:
+                continue
+            if end_block is not None and entry["start_block"] > end_block:
+                continue
+            yield entry
+
+    def load_chunk(self, entry, mmap=True):
+        """
+        Load arrays of a chunk. Compressed chunks are decompressed into
+        memory, only .npy chunks are memory mapped.
+
+        :param entry: chunk entry of the manifest
+        :param mmap: memory map .npy chunks instead of reading them
+        :rtype: dict
+        """
+        import numpy as np
+
+        path = os.path.join(self.path, entry["path"])
+        if entry["path"].endswith(".npz"):
+            with np.load(path) as data:
+                return dict((name, data[name]) for name in data.files)
+        arrays = {}
+        for file_name in os.listdir(path):
+            if file_name.endswith(".npy"):
+                arrays[file_name[:-4]] = np.load(
+                    os.path.join(path, file_name),
+                    mmap_mode="r" if mmap else None)
+        return arrays
+
+    def chunks(self, op_type, start_block=None, end_block=None, mmap=True):
+        """
+        Yield chunks of an operation type overlapping a block range. Rows
+        outside of the range are not removed, see :py:meth:`read`.
+
+        :rtype: dict of numpy.ndarray
+        """
+        for entry in self._entries(op_type, start_block, end_block):
+            yield self.load_chunk(entry, mmap)
+
+    def read(self, op_type, columns=None, start_block=None, end_block=None):
+        """
+        Read columns of an operation type in a block range into memory.
+        Asset columns come with their ``<column>.symbol`` codes. Columns
+        with missing values come with a ``<column>.null`` mask, missing
+        numbers and assets are 0, account codes -1 and strings None.
+        Columns of exports written before column kinds were fixed may
+        have different kinds in different chunks, they are returned as
+        lists.
+
+        :param columns: column names, defaults to all
+        :rtype: dict
+        """
+        import numpy as np
+
+        kinds = self.columns(op_type)
+        columns = columns or list(kinds)
+        parts = dict((c, []) for c in columns)
+        nulls = dict((c, []) for c in columns)
+        for entry in self._entries(op_type, start_block, end_block):
+            chunk = self.load_chunk(entry)
+            block_id = chunk["block_id"]
+            mask = np.ones(len(block_id), dtype=bool)
+            if start_block is not None:
+                mask &= block_id >= start_block
+            if end_block is not None:
+                mask &= block_id <= end_block
+            rows = int(mask.sum())
+            for column in columns:
+                kind = entry["columns"].get(column)
+                if kind is None:
+                    # the field is missing in all operations of the chunk
+                    kind = kinds.get(column)
+                    part = self._missing(kind, rows)
+                    null = np.ones(rows, dtype=bool)
+                else:
+                    part = self._column(chunk, column, kind, mask)
+                    null = chunk[column + ".null"][mask] \
+                        if column + ".null" in chunk else np.zeros(rows, dtype=bool)
+                parts[column].append((kind, part))
+                nulls[column].append(null)
+
+        result = {}
+        for column in columns:
+            if nulls[column]:
+                null = np.concatenate(nulls[column])
+                if null.any():
+                    result[column + ".null"] = null
+            column_kinds = set(kind for kind, _ in parts[column])
+            values = [part for _, part in parts[column]]
+            if column_kinds == {"asset"}:
+                result[column] = np.concatenate([v[0] for v in values])
+                result[column + ".symbol"] = np.concatenate([v[1] for v in values])
+            elif column_kinds and column_kinds <= {"int", "float", "account"} and \
+                    (len(column_kinds) == 1 or "account" not in column_kinds):
+                result[column] = np.concatenate(values)
+            else:
+                result[column] = [x for kind, part in parts[column]
+                                  for x in self._as_list(kind, part)]
+        return result
+
+    @staticmethod
+    def _missing(kind, rows):
+        import numpy as np
+
+        if kind == "asset":
+            return (np.zeros(rows, dtype=np.int64),
+                    np.full(rows, -1, dtype=np.int16))
+        if kind == "account":
+            return np.full(rows, -1, dtype=np.int32)
+        if kind == "int":
+            return np.zeros(rows, dtype=np.int64)
+        if kind == "float":
+            return np.zeros(rows, dtype=np.float64)
+        return [None] * rows
+
+    def _as_list(self, kind, part):
+        if kind == "asset":
+            return part[0].tolist()
+        if kind == "account":
+            return [name or None for name in self.account_names(part).tolist()]
+        if kind in ("int", "float"):
+            return part.tolist()
+        return part
+
+    def _column(self, chunk, column, kind, mask):
+        if kind == "asset":
+            return chunk[column][mask], chunk[column + ".symbol"][mask]
+        if kind in ("string", "json"):
+            values = self.strings(chunk, column)
+            if kind == "json":
+                values = [json.loads(v) for v in values]
+            elif column + ".null" in chunk:
+                values = [None if null else v for v, null in
+                          zip(values, chunk[column + ".null"])]
+            return [v for v, keep in zip(values, mask) if keep]
+        return chunk[column][mask]
+
+    @staticmethod
+    def strings(chunk, column):
+        """
+        Decode a string column of a chunk.
+
+        :rtype: list of str
+        """
+        offsets = chunk[column + ".offsets"]
+        data = chunk[column + ".data"].tobytes()
+        return [data[offsets[i]:offsets[i + 1]].decode()
+                for i in range(len(offsets) - 1)]
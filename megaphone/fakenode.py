@@ -0,0 +1,361 @@
+import asyncio
+import calendar
+import json
+import random
+import threading
+import time
+
+# apis registered by the fake node, the index is the api id returned by
+# get_api_by_name
+APIS = [
+    "database_api",
+    "login_api",
+    "network_broadcast_api",
+    "follow_api",
+    "market_history_api",
+    "tag_api",
+]
+
+BLOCK_INTERVAL = 3
+
+
+class FakeNodeError(RuntimeError):
+    pass
+
+
+def _key(method, params):
+    return method, json.dumps(params, sort_keys=True)
+
+
+def _format_time(epoch):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(epoch))
+
+
+class EmptyChain(object):
+    """
+    Minimal synthetic responses used when a call was not recorded: a chain
+    of ``head_block`` empty blocks, accounts without history, followers or
+    posts.
+
+    Any object with methods named like rpc calls can be used as a source of
+    a :py:class:`FakeNode`, see :py:mod:`megaphone.synthetic` for a source
+    with realistic data.
+    """
+    def __init__(self, head_block=1000000, symbol="STEEM",
+                 genesis="2016-03-24T16:05:00"):
+        self.head_block = head_block
+        self.symbol = symbol
+        self.genesis = calendar.timegm(time.strptime(genesis, "%Y-%m-%dT%H:%M:%S"))
+
+    def block_time(self, block_num):
+        return _format_time(self.genesis + block_num * BLOCK_INTERVAL)
+
+    def get_config(self):
+        return {
+            "STEEMIT_SYMBOL": self.symbol,
+            "BLOCKCHAIN_NAME": self.symbol,
+            "STEEMIT_BLOCK_INTERVAL": BLOCK_INTERVAL,
+            "STEEMIT_100_PERCENT": 10000,
+            "STEEMIT_VOTE_REGENERATION_SECONDS": 432000,
+        }
+
+    def get_dynamic_global_properties(self):
+        return {
+            "head_block_number": self.head_block,
+            "last_irreversible_block_num": self.head_block,
+            "time": self.block_time(self.head_block),
+            "total_vesting_fund_steem": "190000000.000 %s" % self.symbol,
+            "total_vesting_shares": "390000000000.000000 VESTS",
+            "total_reward_fund_steem": "850000.000 %s" % self.symbol,
+            "total_reward_shares2": "300000000000000000000000000000",
+        }
+
+    def get_block(self, block_num):
+        if not 0 < block_num <= self.head_block:
+            return None
+        return {
+            "previous": "%040x" % (block_num - 1),
+            "timestamp": self.block_time(block_num),
+            "witness": "initminer",
+            "transactions": [],
+        }
+
+    def get_ops_in_block(self, block_num, only_virtual=False):
+        return []
+
+    def get_account_history(self, account, index, limit):
+        return []
+
+    def get_accounts(self, names):
+        return [self._account(name) for name in names]
+
+    def get_account(self, name):
+        return self._account(name)
+
+    def _account(self, name):
+        return {
+            "name": name,
+            "reputation": "0",
+            "balance": "0.000 %s" % self.symbol,
+            "sbd_balance": "0.000 SBD",
+            "vesting_shares": "0.000000 VESTS",
+            "voting_power": 10000,
+            "last_vote_time": self.block_time(0),
+        }
+
+    def get_followers(self, account, start, follow_type, limit):
+        return []
+
+    def get_following(self, account, start, follow_type, limit):
+        return []
+
+    def get_state(self, path):
+        return {"accounts": {}, "content": {}}
+
+    def get_feed_history(self):
+        return {
+            "current_median_history": {"base": "1.000 SBD",
+                                       "quote": "1.000 %s" % self.symbol},
+            "price_history": [],
+        }
+
+    def lookup_accounts(self, lower_bound, limit):
+        return []
+
+
+class FakeNode(object):
+    """
+    Local JSON-RPC websocket server answering with recorded responses and
+    falling back to a synthetic source, for reproducible benchmarks
+    without a live node. Every response can be delayed by ``latency``
+    seconds plus up to ``jitter`` seconds of random noise.
+
+    Requires the ``websockets`` package (``pip install megaphone[async]``).
+
+    Usage::
+
+        with FakeNode("fixtures.jsonl", latency=0.02) as fake:
+            Node.pin([fake.url])
+            blockchain = Blockchain()
+    """
+    def __init__(self, fixtures=None, source=None, latency=0.0, jitter=0.0,
+                 seed=None, host="127.0.0.1", port=0):
+        """
+        :param fixtures: JSONL file written by :py:class:`RecordingRPC`
+        :type fixtures: str
+        :param source: object answering calls missing in fixtures, defaults
+            to :py:class:`EmptyChain`
+        :param latency: seconds added to every response
+        :type latency: float
+        :param jitter: maximum random seconds added to latency
+        :type jitter: float
+        :param seed: random seed of the jitter
+        :param host: listening address
+        :param port: listening port, 0 picks a free port
+        """
+        self.source = source if source is not None else EmptyChain()
+        self.latency = latency
+        self.jitter = jitter
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._responses = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        if fixtures:
+            self.load(fixtures)
+
+    @property
+    def url(self):
+        return "ws://%s:%d" % (self.host, self.port)
+
+    def load(self, path):
+        """
+        Load recorded responses, later records of the same call win.
+
+        :param path: JSONL file with method, params and result fields
+        :type path: str
+        """
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                self._responses[_key(record["method"], record["params"])] = \
+                    record["result"]
+
+    def add(self, method, params, result):
+        """
+        Add a response for a call.
+        """
+        self._responses[_key(method, list(params))] = result
+
+    def respond(self, method, params):
+        """
+        Return result of a call.
+
+        :param method: rpc method name
+        :param params: list of call parameters
+        """
+        if method == "login":
+            return True
+        if method == "get_api_by_name":
+            api = params[0] if params[0].endswith("_api") else params[0] + "_api"
+            return APIS.index(api) if api in APIS else None
+        key = _key(method, params)
+        if key in self._responses:
+            return self._responses[key]
+        handler = getattr(self.source, method, None)
+        if handler is None or method.startswith("_"):
+            raise FakeNodeError("Unknown method %s" % method)
+        return handler(*params)
+
+    def _delay(self):
+        if not self.jitter:
+            return self.latency
+        return max(0.0, self.latency + self._random.uniform(0, self.jitter))
+
+    async def _reply(self, ws, request):
+        self.requests += 1
+        response = {"jsonrpc": "2.0", "id": request.get("id")}
+        try:
+            params = request.get("params") or []
+            if request.get("method") == "call":
+                method, params = params[1], params[2]
+            else:
+                method = request.get("method")
+            response["result"] = self.respond(method, list(params))
+        except Exception as e:
+            response["error"] = {"code": 1, "message": "%s: %s"
+                                 % (type(e).__name__, e)}
+        delay = self._delay()
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            await ws.send(json.dumps(response))
+        except Exception:
+            pass
+
+    async def _handle(self, ws, path=None):
+        # requests are answered concurrently, clients match responses by id
+        tasks = set()
+        try:
+            async for message in ws:
+                task = asyncio.ensure_future(self._reply(ws, json.loads(message)))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except Exception:
+            pass
+        for task in list(tasks):
+            task.cancel()
+
+    async def _serve(self):
+        import websockets
+        self._server = await websockets.serve(self._handle, self.host,
+                                              self.port, max_size=None)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def start(self):
+        """
+        Start serving in a background thread.
+
+        :return: self
+        """
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            raise FakeNodeError("FakeNode requires the websockets package!")
+        if self._thread is not None:
+            return self
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._serve())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="fakenode",
+                                        daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            self._thread = None
+            raise FakeNodeError("Could not start fake node: %s" % errors[0])
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            await self._server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class RecordingRPC(object):
+    """
+    Rpc wrapper appending every successful call to a JSONL file which
+    :py:class:`FakeNode` can serve later.
+    """
+    def __init__(self, rpc, path):
+        """
+        :param rpc: rpc instance to wrap, e.g. chain.rpc
+        :param path: JSONL file, records are appended
+        :type path: str
+        """
+        self._rpc = rpc
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def __getattr__(self, method):
+        func = getattr(self._rpc, method)
+
+        def call(*args, **kwargs):
+            result = func(*args, **kwargs)
+            line = json.dumps({"method": method, "params": list(args),
+                               "result": result}, default=str)
+            with self._lock:
+                self._file.write(line + "\n")
+                self._file.flush()
+            return result
+        call.__name__ = method
+        return call
+
+    def close(self):
+        self._file.close()
+
+
+def record(chaind, path):
+    """
+    Replace rpc of a chain instance or a connection pool with a
+    :py:class:`RecordingRPC`.
+
+    :param chaind: chain instance or :py:class:`megaphone.pool.ConnectionPool`
+    :param path: JSONL file
+    :return: the same chain instance
+    """
+    if not isinstance(chaind.rpc, RecordingRPC):
+        chaind.rpc = RecordingRPC(chaind.rpc, path)
+    return chaind
@@ -1,11 +1,19 @@
+import bisect
+import calendar
 import datetime
+import json
+import operator
 import re
 import time
+from array import array
+from contextlib import contextmanager
+from functools import lru_cache, partial, wraps
 
-from dateutil import parser
+from megaphone.asset import _split as _split_asset
+from megaphone.metrics import default_registry
 
-from funcy import contextmanager, decorator
-from werkzeug.contrib.cache import SimpleCache
+_json_backend = None
+_json_decoder = json.JSONDecoder()
 
 
 @contextmanager
@@ -15,24 +23,105 @@ def timeit():
     print("Time Elapsed: %.2f" % (time.time() - t1))
 
 
-@decorator
-def simple_cache(func, cache_obj, timeout=3600):
-    if type(cache_obj) is not SimpleCache:
-        return func()
-    name = "%s_%s_%s" % (func._func.__name__, func._args, func._kwargs)
-    cache_value = cache_obj.get(name)
-    if cache_value:
-        return cache_value
-    else:
-        out = func()
-        cache_obj.set(name, out, timeout=timeout)
-        return out
+class LazyCache(object):
+    """
+    Werkzeug SimpleCache created on first use, so that importing a module
+    defining a cache does not import werkzeug.
+    """
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._cache = None
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from werkzeug.contrib.cache import SimpleCache
+            self._cache = SimpleCache(**self._kwargs)
+        return self._cache
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout=None):
+        return self.cache.set(key, value, timeout=timeout)
+
+
+def simple_cache(cache_obj, timeout=3600):
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not (hasattr(cache_obj, "get") and hasattr(cache_obj, "set")):
+                return func(*args, **kwargs)
+            name = "%s_%s_%s" % (func.__name__, args, kwargs)
+            cache_value = cache_obj.get(name)
+            if cache_value:
+                default_registry.cache_hit("simple_cache")
+                return cache_value
+            else:
+                default_registry.cache_miss("simple_cache")
+                out = func(*args, **kwargs)
+                cache_obj.set(name, out, timeout=timeout)
+                return out
+        return wrapper
+    return decorate
+
+
+def compile_filter(filter_by):
+    """
+    Compile an operation type filter into a set, once per query.
+
+    :param filter_by: operation type, list of types or None
+    :return: accepted operation types, None accepts all
+    :rtype: frozenset
+    """
+    if filter_by is None:
+        return None
+    if isinstance(filter_by, str):
+        return frozenset((filter_by,))
+    return frozenset(filter_by)
+
+
+def compile_where(where):
+    """
+    Compile field predicates of operation bodies into a single test, e.g.
+    ``{"voter": {"alice", "bob"}, "weight": lambda w: w > 0}``. A field
+    matches a value by equality, a set, list or tuple by membership and a
+    callable by its result. Operations without the field do not match.
+
+    :param where: field predicates
+    :type where: dict
+    :return: function of an operation body returning True if all fields
+        match, None if there are no predicates
+    """
+    if not where:
+        return None
+    tests = []
+    for field, expected in where.items():
+        if callable(expected):
+            tests.append((field, expected))
+        elif isinstance(expected, (set, frozenset, list, tuple)):
+            tests.append((field, frozenset(expected).__contains__))
+        else:
+            tests.append((field, partial(operator.eq, expected)))
+
+    def match(op):
+        for field, test in tests:
+            if field not in op or not test(op[field]):
+                return False
+        return True
+    return match
+
+
+re_asset = re.compile(r'(?P<number>\d*\.?\d+)\s?(?P<unit>[a-zA-Z]+)')
 
 
 def read_asset(asset_string):
-    re_asset = re.compile(r'(?P<number>\d*\.?\d+)\s?(?P<unit>[a-zA-Z]+)')
-    res = re_asset.match(asset_string)
-    return {'value': float(res.group('number')), 'symbol': res.group('unit')}
+    number, _, symbol = asset_string.partition(" ")
+    if symbol.isalpha() and number.replace(".", "", 1).isdigit():
+        return {'value': float(number), 'symbol': symbol}
+    whole, fraction, symbol = _split_asset(asset_string)
+    return {'value': float(whole + "." + fraction if fraction else whole),
+            'symbol': symbol}
 
 
 def parse_payout(payout):
@@ -40,9 +129,7 @@ def parse_payout(payout):
 
 
 def time_diff(time1, time2):
-    time1 = parser.parse(time1 + "UTC").timestamp()
-    time2 = parser.parse(time2 + "UTC").timestamp()
-    return time2 - time1
+    return parse_timestamp(time2) - parse_timestamp(time1)
 
 
 def is_comment(item):
@@ -52,63 +139,285 @@ def is_comment(item):
     return False
 
 
+def json_loads(json_string):
+    """
+    Decode JSON with the fastest available backend (orjson, ujson or the
+    standard library).
+
+    :param json_string: JSON document
+    :type json_string: str
+    """
+    global _json_backend
+    if _json_backend is None:
+        try:
+            import orjson as backend
+        except ImportError:
+            try:
+                import ujson as backend
+            except ImportError:
+                backend = json
+        _json_backend = backend
+    return _json_backend.loads(json_string)
+
+
+def _skip_whitespace(text, pos):
+    while pos < len(text) and text[pos] in " \t\n\r":
+        pos += 1
+    return pos
+
+
+def read_json_fields(json_string, fields):
+    """
+    Decode selected top-level fields of a JSON object. When a field can be
+    located unambiguously only its value is decoded, otherwise the whole
+    document is parsed. Decoding errors, including anything but whitespace
+    after the closing brace, result in an empty dict like with json.loads.
+
+    :param json_string: JSON object
+    :type json_string: str
+    :param fields: names of the fields
+    :type fields: list of str
+    :return: decoded fields present in the document
+    :rtype: dict
+    """
+    result = {}
+    # the document must end with the brace closing the object
+    closed = (json_string.rstrip(" \t\n\r").endswith("}") and
+              json_string.count("{") == json_string.count("}"))
+    for field in fields:
+        key = '"%s"' % field
+        pos = json_string.find(key)
+        if pos == -1:
+            continue
+        start = pos + len(key)
+        colon = _skip_whitespace(json_string, start)
+        before = json_string[:pos].rstrip()
+        # the key is at the top level if no nested object was opened
+        # before it, it is a key if a colon follows
+        if (not closed or
+                json_string.count("{", 0, pos) != 1 or
+                json_string.count("}", 0, pos) or
+                json_string.find(key, start) != -1 or
+                not before.endswith(("{", ",")) or
+                json_string[colon:colon + 1] != ":"):
+            break
+        try:
+            result[field], _ = _json_decoder.raw_decode(
+                json_string, _skip_whitespace(json_string, colon + 1))
+        except ValueError:
+            break
+    else:
+        return result
+
+    try:
+        document = json_loads(json_string)
+    except (ValueError, TypeError):
+        return {}
+    if not isinstance(document, dict):
+        return {}
+    return dict((f, document[f]) for f in fields if f in document)
+
+
+def post_tags(item):
+    """
+    Return tags of a post or a comment operation. Piston posts carry
+    parsed tags, otherwise they are read from json_metadata.
+
+    :param item: post, get_content result or comment operation
+    :return: list of tags
+    :rtype: list of str
+    """
+    tags = item.get('_tags')
+    if tags is None:
+        try:
+            tags = json_loads(item.get('json_metadata') or "{}").get('tags', [])
+        except (ValueError, AttributeError):
+            tags = []
+    return tags if isinstance(tags, list) else []
+
+
 def time_elapsed(time1):
-    created_at = parser.parse(time1 + "UTC").timestamp()
+    created_at = parse_timestamp(time1)
     now_adjusted = time.time()
     return now_adjusted - created_at
 
 
 def parse_time(block_time):
-    return parser.parse(block_time + "UTC").astimezone(datetime.timezone.utc)
+    return datetime.datetime.fromtimestamp(parse_timestamp(block_time),
+                                           datetime.timezone.utc)
 
 
-def translate_tag(tag):
-    if not (hasattr(translate_tag, "cyr_chars") and
-            hasattr(translate_tag, "lat_chars") and
-            hasattr(translate_tag, "cyr_prefix")):
-        translate_tag.cyr_chars = "щ    ш  ч  ц  й  ё  э  ю  я  х  ж  а б в г д е з и к л м н о п р с т у ф ъ  ы ь".split()
-        translate_tag.lat_chars = "shch sh ch cz ij yo ye yu ya kh zh a b v g d e z i k l m n o p r s t u f xx y x".split()
-        translate_tag.cyr_prefix = "ru--"
+_cyr_chars = "щ    ш  ч  ц  й  ё  э  ю  я  х  ж  а б в г д е з и к л м н о п р с т у ф ъ  ы ь".split()
+_lat_chars = "shch sh ch cz ij yo ye yu ya kh zh a b v g d e z i k l m n o p r s t u f xx y x".split()
+_cyr_prefix = "ru--"
+
+# cyrillic letters map one to one, so a translate table suffices
+_cyr_to_lat = str.maketrans(dict(zip(_cyr_chars, _lat_chars)))
+# latin sequences are matched longest first, which gives the same result
+# as replacing them one by one in the order of the table
+_lat_to_cyr = dict(zip(_lat_chars, _cyr_chars))
+_lat_max_len = max(len(x) for x in _lat_chars)
+
+
+def _lat_to_cyr_tag(tag):
+    out = []
+    i = 0
+    length = len(tag)
+    while i < length:
+        for size in range(min(_lat_max_len, length - i), 0, -1):
+            chunk = _lat_to_cyr.get(tag[i:i + size])
+            if chunk is not None:
+                out.append(chunk)
+                i += size
+                break
+        else:
+            out.append(tag[i])
+            i += 1
+    return "".join(out)
+
 
+@lru_cache(maxsize=4096)
+def translate_tag(tag):
     if "а" <= tag[:1] <= "я" or tag.startswith("ё"):
-        prefix = translate_tag.cyr_prefix
-        table = zip(translate_tag.cyr_chars, translate_tag.lat_chars)
-    elif tag.startswith(translate_tag.cyr_prefix):
-        prefix = ""
-        table = zip(translate_tag.lat_chars, translate_tag.cyr_chars)
-        tag = tag[4:]
-    else:
-        prefix = ""
-        table = []
+        return _cyr_prefix + tag.translate(_cyr_to_lat)
+    elif tag.startswith(_cyr_prefix):
+        return _lat_to_cyr_tag(tag[4:])
+    return tag
+
 
-    for l, i in table:
-        tag = i.join(tag.split(l))
-    return prefix + tag
+default_registry.register_cache("translate_tag", translate_tag.cache_info)
 
 
-def filter_by_date(items, start_time, end_time=None):
+def translate_tags(tags):
     """
-    Filter items by date.
+    Translate a list of tags, see :py:func:`translate_tag`.
 
-    :param items:
-    :param start_time:
-    :param end_time:
-    :return: filtered items
+    :param tags: tags
+    :type tags: list of str
+    :return: translated tags
+    :rtype: list of str
+    """
+    return [translate_tag(tag) for tag in tags]
+
+
+def parse_timestamp(time_string):
     """
-    start_time = parser.parse(start_time + "UTC").timestamp()
+    Return UTC epoch of a chain timestamp such as "2016-10-18T14:00:00".
+    Other formats are handled by dateutil.
+
+    :param time_string: timestamp
+    :type time_string: str
+    :rtype: float
+    """
+    if len(time_string) == 19 and time_string[10] == "T":
+        try:
+            return float(calendar.timegm((
+                int(time_string[0:4]), int(time_string[5:7]),
+                int(time_string[8:10]), int(time_string[11:13]),
+                int(time_string[14:16]), int(time_string[17:19]))))
+        except ValueError:
+            pass
+    from dateutil import parser
+    return parser.parse(time_string + "UTC").timestamp()
+
+
+def item_timestamp(item):
+    """
+    Return UTC epoch of a history or replay item.
+
+    :param item: item with 'time' or 'timestamp' field
+    :type item: dict
+    :rtype: float
+    """
+    if 'time' in item:
+        return parse_timestamp(item['time'])
+    return parse_timestamp(item['timestamp'])
+
+
+def _date_window(start_time, end_time):
+    start_time = parse_timestamp(start_time)
     if end_time:
-        end_time = parser.parse(end_time + "UTC").timestamp()
+        end_time = parse_timestamp(end_time)
     else:
         end_time = time.time()
+    return start_time, end_time
+
+
+class _TimestampView(object):
+    """
+    Sequence of item timestamps parsed on access, so bisect only parses
+    the O(log n) items it looks at.
+    """
+    def __init__(self, items):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return item_timestamp(self.items[index])
+
+
+class DateIndex(object):
+    """
+    Precomputed epoch array over time-ordered items for repeated window
+    lookups in O(log n).
+    """
+    def __init__(self, items):
+        self.items = items
+        self.epochs = array('d', (item_timestamp(x) for x in items))
+
+    def window(self, start_time, end_time=None):
+        """
+        Return items strictly between start_time and end_time.
+
+        :param start_time: window start
+        :param end_time: window end, defaults to now
+        :return: filtered items
+        :rtype: list
+        """
+        start_time, end_time = _date_window(start_time, end_time)
+        lo = bisect.bisect_right(self.epochs, start_time)
+        hi = bisect.bisect_left(self.epochs, end_time, lo)
+        return self.items[lo:hi]
+
+
+def iter_by_date(items, start_time, end_time=None, presorted=False):
+    """
+    Filter items by date lazily.
 
-    filtered_items = []
+    :param items: iterable of items
+    :param start_time: window start
+    :param end_time: window end, defaults to now
+    :param presorted: items are sorted oldest first, stop once end_time
+        is passed
+    :return: yield filtered items
+    """
+    start_time, end_time = _date_window(start_time, end_time)
     for item in items:
-        if 'time' in item:
-            item_time = item['time']
-        elif 'timestamp' in item:
-            item_time = item['timestamp']
-        timestamp = parser.parse(item_time + "UTC").timestamp()
+        timestamp = item_timestamp(item)
         if end_time > timestamp > start_time:
-            filtered_items.append(item)
+            yield item
+        elif presorted and timestamp >= end_time:
+            return
+
+
+def filter_by_date(items, start_time, end_time=None, presorted=False):
+    """
+    Filter items by date.
+
+    :param items:
+    :param start_time:
+    :param end_time:
+    :param presorted: items are a list sorted oldest first, the window is
+        found by bisection
+    :return: filtered items
+    """
+    if presorted:
+        start_time, end_time = _date_window(start_time, end_time)
+        timestamps = _TimestampView(items)
+        lo = bisect.bisect_right(timestamps, start_time)
+        hi = bisect.bisect_left(timestamps, end_time, lo)
+        return items[lo:hi]
 
-    return filtered_items
+    return list(iter_by_date(items, start_time, end_time))
@@ -1,6 +1,5 @@
 import time
 
-import numpy as np
 from megaphone.helpers import parse_payout
 from megaphone.node import Node
 from megaphone.ticker import Ticker
@@ -49,5 +48,7 @@ class Markets(Ticker):
         return self.sbd_btc() * self.btc_usd()
 
     def avg_witness_price(self, take=10):
+        import numpy as np
+
         price_history = self.steem.rpc.get_feed_history()['price_history']
         return np.mean([parse_payout(x['base']) for x in price_history[-take:]])
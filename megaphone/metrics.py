@@ -0,0 +1,282 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+class MethodStats(object):
+    """
+    Counters and latency histogram of one rpc method.
+    """
+    def __init__(self, buckets):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.histogram = [0] * (len(buckets) + 1)
+
+    def as_dict(self, buckets):
+        bounds = [str(b) for b in buckets] + ["+Inf"]
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "histogram": dict(zip(bounds, self.histogram)),
+        }
+
+
+class Registry(object):
+    """
+    Collects per-method rpc statistics, cache hit rates and dispatches
+    events from hot paths to registered hooks.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._methods = {}
+        self._cache_counters = {}
+        self._cache_sources = {}
+        self._hooks = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method, seconds, error=False, bytes_out=0, bytes_in=0):
+        """
+        Record an rpc call.
+
+        :param method: rpc method name
+        :param seconds: call latency
+        :param error: the call failed
+        :param bytes_out: request size
+        :param bytes_in: response size
+        """
+        with self._lock:
+            stats = self._methods.get(method)
+            if stats is None:
+                stats = self._methods[method] = MethodStats(self.buckets)
+            stats.calls += 1
+            stats.errors += bool(error)
+            stats.seconds += seconds
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            stats.histogram[bisect_left(self.buckets, seconds)] += 1
+
+    def cache_hit(self, name):
+        with self._lock:
+            self._cache_counters.setdefault(name, [0, 0])[0] += 1
+
+    def cache_miss(self, name):
+        with self._lock:
+            self._cache_counters.setdefault(name, [0, 0])[1] += 1
+
+    def register_cache(self, name, source):
+        """
+        Register a cache reporting its own counters.
+
+        :param name: cache name, counters of caches with the same name are
+            summed up
+        :param source: object with ``hits`` and ``misses`` attributes or a
+            callable returning such an object, e.g. ``func.cache_info``
+        """
+        with self._lock:
+            self._cache_sources.setdefault(name, []).append(source)
+
+    def add_hook(self, event, callback):
+        """
+        Call callback(event, **fields) on every event, e.g.
+        "replay.block", "history.page" or "converter".
+
+        :param event: event name
+        :param callback: callable
+        """
+        with self._lock:
+            self._hooks[event] = self._hooks.get(event, ()) + (callback,)
+
+    def remove_hook(self, event, callback):
+        with self._lock:
+            hooks = tuple(h for h in self._hooks.get(event, ()) if h is not callback)
+            if hooks:
+                self._hooks[event] = hooks
+            else:
+                self._hooks.pop(event, None)
+
+    def has_hooks(self, event):
+        return event in self._hooks
+
+    def emit(self, event, **fields):
+        """
+        Dispatch an event to its hooks. This is cheap when no hooks are
+        registered for the event.
+        """
+        for callback in self._hooks.get(event, ()):
+            callback(event, **fields)
+
+    def _caches(self):
+        caches = {}
+        for name, (hits, misses) in self._cache_counters.items():
+            caches[name] = [hits, misses]
+        for name, sources in self._cache_sources.items():
+            counters = caches.setdefault(name, [0, 0])
+            for source in sources:
+                info = source() if callable(source) else source
+                counters[0] += info.hits
+                counters[1] += info.misses
+        return dict((name, {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }) for name, (hits, misses) in caches.items())
+
+    def snapshot(self):
+        """
+        Return all statistics.
+
+        :return: ``rpc`` statistics per method and ``caches`` hit rates
+        :rtype: dict
+        """
+        with self._lock:
+            rpc = dict((method, stats.as_dict(self.buckets))
+                       for method, stats in self._methods.items())
+            caches = self._caches()
+        return {"rpc": rpc, "caches": caches}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        Return statistics in Prometheus text exposition format.
+
+        :rtype: str
+        """
+        snapshot = self.snapshot()
+        rpc = sorted(snapshot["rpc"].items())
+        caches = sorted(snapshot["caches"].items())
+        lines = []
+        # every metric family is one group after its TYPE line
+        for name in ("calls", "errors", "bytes_out", "bytes_in"):
+            lines.append("# TYPE megaphone_rpc_%s_total counter" % name)
+            for method, stats in rpc:
+                lines.append('megaphone_rpc_%s_total{method="%s"} %d'
+                             % (name, method, stats[name]))
+        lines.append("# TYPE megaphone_rpc_latency_seconds histogram")
+        for method, stats in rpc:
+            label = 'method="%s"' % method
+            cumulative = 0
+            for bound, count in stats["histogram"].items():
+                cumulative += count
+                lines.append('megaphone_rpc_latency_seconds_bucket{%s,le="%s"} %d'
+                             % (label, bound, cumulative))
+            lines.append("megaphone_rpc_latency_seconds_sum{%s} %f" % (label, stats["seconds"]))
+            lines.append("megaphone_rpc_latency_seconds_count{%s} %d" % (label, stats["calls"]))
+        for name in ("hits", "misses"):
+            lines.append("# TYPE megaphone_cache_%s_total counter" % name)
+            for cache_name, cache in caches:
+                lines.append('megaphone_cache_%s_total{cache="%s"} %d'
+                             % (name, cache_name, cache[name]))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        Reset rpc statistics and cache counters. Registered caches and
+        hooks are kept.
+        """
+        with self._lock:
+            self._methods.clear()
+            self._cache_counters.clear()
+
+
+# default registry used throughout megaphone
+default_registry = Registry()
+
+
+def hooked(event):
+    """
+    Decorator emitting event with ``method`` and ``seconds`` fields after
+    every call of the decorated function. Calls are not timed unless a hook
+    is registered for the event.
+
+    :param event: event name
+    :type event: str
+    """
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not default_registry.has_hooks(event):
+                return func(*args, **kwargs)
+            start = time.time()
+            result = func(*args, **kwargs)
+            default_registry.emit(event, method=func.__name__,
+                                  seconds=time.time() - start)
+            return result
+        return wrapper
+    return decorate
+
+
+def _size(value):
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class InstrumentedRPC(object):
+    """
+    Rpc wrapper recording every call in a :py:class:`Registry`.
+    """
+    def __init__(self, rpc, registry=None, measure_bytes=False):
+        """
+        :param rpc: rpc instance to wrap, e.g. chain.rpc
+        :param registry: registry, defaults to ``default_registry``
+        :param measure_bytes: record JSON encoded request and response
+            sizes, this costs an extra serialization of every response
+        """
+        self._rpc = rpc
+        self._registry = registry or default_registry
+        self._measure_bytes = measure_bytes
+
+    def __getattr__(self, method):
+        func = getattr(self._rpc, method)
+
+        def call(*args, **kwargs):
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                self._registry.observe(method, time.time() - start, error=True)
+                raise
+            seconds = time.time() - start
+            if self._measure_bytes:
+                self._registry.observe(method, seconds,
+                                       bytes_out=_size([method, args]),
+                                       bytes_in=_size(result))
+            else:
+                self._registry.observe(method, seconds)
+            return result
+        call.__name__ = method
+        return call
+
+
+def instrument(chaind, registry=None, measure_bytes=False):
+    """
+    Replace rpc of a chain instance or a connection pool with an
+    :py:class:`InstrumentedRPC`. Cache statistics of a wrapped
+    :py:class:`megaphone.rpc.CoalescingRPC` are registered as well.
+
+    :param chaind: chain instance or :py:class:`megaphone.pool.ConnectionPool`
+    :return: the same chain instance
+    """
+    if isinstance(chaind.rpc, InstrumentedRPC):
+        return chaind
+    from megaphone.rpc import CoalescingRPC
+    registry = registry or default_registry
+    # rpc instances and wrappers answer any attribute with an rpc call
+    if isinstance(chaind.rpc, CoalescingRPC):
+        registry.register_cache("coalescing_rpc", chaind.rpc)
+    chaind.rpc = InstrumentedRPC(chaind.rpc, registry, measure_bytes)
+    return chaind
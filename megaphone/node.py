@@ -1,6 +1,6 @@
 import ssl
-import websocket
-from piston.steem import Steem as Chain
+import threading
+import time
 
 
 class NodeError(RuntimeError):
@@ -12,17 +12,34 @@ class Node(object):
     # and therefore all users of Node().default()
     _default = None
 
+    # shared chain instances returned by default()
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    # local node discovery results, {candidates: (timestamp, nodes)}
+    _discovery_cache = {}
+    discovery_ttl = 60
+    probe_timeout = 0.5
+    local_candidates = ("ws://127.0.0.1:8090",)
+
+    # requests per second allowed to a single public node
+    public_rate_limit = 20
+
+    # when set, the only nodes used, e.g. a megaphone.fakenode.FakeNode
+    pinned_nodes = None
+
     def __init__(self, blockchain="steem"):
         supported_blockchains = ["steem", "golos"]
         if blockchain.lower() not in supported_blockchains:
             raise NodeError("Blockchain %s not supported!" % blockchain)
+        self.blockchain = blockchain.lower()
 
         public_nodes = {
             "golos": ["wss://node.golos.ws"],
             "steem": ["wss://node.steem.ws", "wss://this.piston.rocks"]}
 
         self._nodes = {
-            "local": ["ws://127.0.0.1:8090"],
+            "local": list(self.local_candidates),
             "public": public_nodes[blockchain],
         }
 
@@ -38,35 +55,178 @@ class Node(object):
     def default(self, **kwargs):
         """
         Try local node first, and automatically fallback to public nodes.
+        The chain instance is shared by all callers asking for the same
+        blockchain and arguments, use :py:meth:`connect` to get a private
+        connection e.g. for a worker thread.
         """
         if self._default:
             return self._default
-        nodes = self.find_local_nodes() + self._nodes['public']
-        return Chain(node=nodes, apis=self._apis, **kwargs)
+        key = (self.blockchain, repr(sorted(kwargs.items())))
+        with self._instances_lock:
+            chaind = self._instances.get(key)
+            if chaind is None:
+                chaind = self._instances[key] = self.connect(**kwargs)
+        return chaind
+
+    def connect(self, nodes=None, **kwargs):
+        """
+        Return a new chain instance, local node first with automatic
+        fallback to public nodes.
+
+        :param nodes: node urls to use instead of :py:meth:`nodes`
+        """
+        from piston.steem import Steem as Chain
+        return Chain(node=list(nodes or self.nodes()), apis=self._apis,
+                     **kwargs)
+
+    def connect_throttled(self, nodes=None, **kwargs):
+        """
+        Return a new chain instance whose calls pass through the throttle
+        of its node, see :py:meth:`throttle`. The throttle is shared with
+        all other throttled connections and pools using the node, so
+        parallel fetchers together stay within its limits.
+
+        :param nodes: node urls to use instead of :py:meth:`nodes`
+        """
+        from megaphone.throttle import ThrottledRPC
+        nodes = list(nodes or self.nodes())
+        chaind = self.connect(nodes=nodes, **kwargs)
+        # the node the connection settled on, if the rpc tells
+        url = getattr(chaind.rpc, "__dict__", {}).get("url")
+        if url not in nodes:
+            url = nodes[0]
+        chaind.rpc = ThrottledRPC(chaind.rpc, self.throttle(url))
+        return chaind
+
+    def nodes(self):
+        """
+        Return nodes to connect to in order of preference: pinned nodes if
+        any, otherwise reachable local nodes followed by public nodes.
+
+        :rtype: list of str
+        """
+        if self.pinned_nodes:
+            return list(self.pinned_nodes)
+        return self.find_local_nodes() + self._nodes['public']
+
+    @classmethod
+    def pin(cls, nodes):
+        """
+        Use only the given nodes for all new and shared chain instances,
+        e.g. ``Node.pin([FakeNode().start().url])``. ``Node.pin(None)``
+        restores discovery.
+
+        :param nodes: node urls or None
+        :type nodes: list of str
+        """
+        cls.pinned_nodes = tuple(nodes) if nodes else None
+        cls.reset()
+
+    @classmethod
+    def reset(cls):
+        """
+        Forget shared chain instances and cached local node discovery.
+        """
+        with cls._instances_lock:
+            cls._instances.clear()
+        cls._discovery_cache.clear()
 
     def public(self, **kwargs):
+        from piston.steem import Steem as Chain
         return Chain(node=self._nodes['public'], apis=self._apis, **kwargs)
 
+    def pool(self, connections_per_endpoint=2, timeout=10, num_retries=0,
+             **kwargs):
+        """
+        Connection pool over local and public nodes with latency-aware
+        routing and failover, see :py:class:`megaphone.pool.ConnectionPool`.
+
+        :param timeout: connection and call timeout in seconds
+        :param num_retries: reconnects of a connection before a call fails
+            over to the next node
+        """
+        from megaphone.pool import ConnectionPool
+        nodes = self.nodes()
+        throttles = dict((node, self.throttle(node)) for node in nodes)
+        return ConnectionPool(nodes, apis=self._apis,
+                              connections_per_endpoint=connections_per_endpoint,
+                              throttles=throttles, timeout=timeout,
+                              num_retries=num_retries, **kwargs)
+
+    def throttle(self, node):
+        """
+        Return the rate and concurrency limiter shared by all parallel
+        fetchers using a node. Public nodes are limited to
+        ``public_rate_limit`` requests per second.
+
+        :param node: node url
+        :type node: str
+        :rtype: :py:class:`megaphone.throttle.Throttle`
+        """
+        from megaphone.throttle import for_endpoint
+        rate = self.public_rate_limit if node in self._nodes['public'] else None
+        return for_endpoint(node, rate=rate)
+
     def _prioritize(self, priority_node):
         return [priority_node].extend([x for x in self._nodes if x != priority_node])
 
     @staticmethod
-    def find_local_nodes():
-        local_nodes = []
-        for node in ["ws://127.0.0.1:8090"]:
-            if node[:3] == "wss":
-                sslopt_ca_certs = {'cert_reqs': ssl.CERT_NONE}
-                ws = websocket.WebSocket(sslopt=sslopt_ca_certs)
-            else:
-                ws = websocket.WebSocket()
-            try:
-                ws.connect(node)
-                ws.close()
-                local_nodes.append(node)
-            except:
-                ws.close()
-
-        return local_nodes
+    def probe(node, timeout=0.5):
+        """
+        Check if a websocket node accepts connections.
+
+        :param node: node url
+        :type node: str
+        :param timeout: connection timeout in seconds
+        :type timeout: float
+        :rtype: bool
+        """
+        import websocket
+
+        sslopt = {'cert_reqs': ssl.CERT_NONE} if node[:3] == "wss" else None
+        try:
+            ws = websocket.create_connection(node, timeout=timeout,
+                                             sslopt=sslopt)
+        except (websocket.WebSocketException, OSError):
+            return False
+        ws.close()
+        return True
+
+    @classmethod
+    def find_local_nodes(cls, candidates=None, timeout=None, ttl=None):
+        """
+        Probe candidate nodes concurrently and return those accepting
+        connections. Results are cached for ttl seconds.
+
+        :param candidates: node urls, defaults to ``local_candidates``
+        :param timeout: probe timeout, defaults to ``probe_timeout``
+        :param ttl: cache lifetime, defaults to ``discovery_ttl``
+        :return: reachable nodes
+        :rtype: list of str
+        """
+        candidates = tuple(candidates or cls.local_candidates)
+        timeout = cls.probe_timeout if timeout is None else timeout
+        ttl = cls.discovery_ttl if ttl is None else ttl
+
+        cached = cls._discovery_cache.get(candidates)
+        if cached and cached[0] + ttl > time.time():
+            return list(cached[1])
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+            reachable = list(executor.map(
+                lambda node: cls.probe(node, timeout), candidates))
+        local_nodes = [n for n, ok in zip(candidates, reachable) if ok]
+        cls._discovery_cache[candidates] = (time.time(), local_nodes)
+        return list(local_nodes)
+
+
+def __getattr__(name):
+    # piston is imported on first use of Chain
+    if name == "Chain":
+        from piston.steem import Steem
+        return Steem
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 # legacy method
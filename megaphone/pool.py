@@ -0,0 +1,368 @@
+import queue
+import threading
+import time
+
+
+class PoolError(RuntimeError):
+    pass
+
+
+_transport_errors = None
+
+
+def transport_errors():
+    """
+    Exception types of broken connections and timeouts, as opposed to
+    errors returned by the node for a call, e.g. an unknown account.
+
+    :rtype: tuple
+    """
+    global _transport_errors
+    if _transport_errors is None:
+        errors = [OSError]
+        try:
+            import websocket
+            errors.append(websocket.WebSocketException)
+        except ImportError:
+            pass
+        try:
+            from grapheneapi.graphenewsrpc import NumRetriesReached
+            errors.append(NumRetriesReached)
+        except ImportError:
+            pass
+        _transport_errors = tuple(errors)
+    return _transport_errors
+
+
+def close_connection(chaind):
+    """
+    Close the websocket of a chain instance, errors are ignored. Rpc
+    wrappers, e.g. :py:class:`megaphone.throttle.ThrottledRPC`, are
+    looked through.
+    """
+    # rpc instances answer unknown attributes with rpc calls
+    attributes = getattr(chaind.rpc, "__dict__", {})
+    while "ws" not in attributes and "_rpc" in attributes:
+        attributes = getattr(attributes["_rpc"], "__dict__", {})
+    ws = attributes.get("ws")
+    if ws is None:
+        return
+    try:
+        ws.close()
+    except Exception:
+        pass
+
+
+def connect(url, apis=None, timeout=10, num_retries=0, **kwargs):
+    """
+    Open a chain instance for a pool. The rpc of the chain retries
+    num_retries times instead of reconnecting forever, so transport errors
+    reach the pool, and its calls time out after timeout seconds. An
+    endpoint not accepting connections within timeout is refused before
+    the chain logs in.
+
+    :param url: node url
+    :param apis: apis to register
+    :param timeout: seconds to wait for a connection or a response
+    :param num_retries: reconnects of the rpc before it gives up
+    :param kwargs: arguments for the chain instance
+    """
+    from megaphone.node import Node
+    from piston.steem import Steem as Chain
+
+    if not Node.probe(url, timeout):
+        raise PoolError("Could not connect to %s!" % url)
+    chaind = Chain(node=url, apis=apis, num_retries=num_retries, **kwargs)
+    ws = getattr(chaind.rpc, "__dict__", {}).get("ws")
+    if ws is not None:
+        ws.settimeout(timeout)
+    return chaind
+
+
+class Endpoint(object):
+    """
+    Node endpoint with a bounded set of lazily opened connections and
+    health statistics.
+    """
+    def __init__(self, url, size, chain_factory, max_lag=3, max_errors=3,
+                 throttle=None):
+        self.url = url
+        self.throttle = throttle
+        self.size = size
+        self.chain_factory = chain_factory
+        self.max_lag = max_lag
+        self.max_errors = max_errors
+        self.latency = None
+        self.head_block = None
+        self.lag = 0
+        self.errors = 0
+        self.in_use = 0
+        self._created = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                chaind = self._idle.get_nowait()
+                break
+            except queue.Empty:
+                pass
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    chaind = self.chain_factory(self.url)
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+                break
+            if deadline is not None and time.time() > deadline:
+                raise PoolError("No connection to %s available!" % self.url)
+            # wake up regularly, a discarded connection frees a slot
+            try:
+                chaind = self._idle.get(timeout=0.1)
+                break
+            except queue.Empty:
+                pass
+        with self._lock:
+            self.in_use += 1
+        return chaind
+
+    def release(self, chaind):
+        with self._lock:
+            self.in_use -= 1
+        self._idle.put(chaind)
+
+    def discard(self, chaind):
+        with self._lock:
+            self.in_use -= 1
+            self._created -= 1
+        close_connection(chaind)
+
+    def close(self):
+        """
+        Close idle connections.
+        """
+        while True:
+            try:
+                chaind = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._created -= 1
+            close_connection(chaind)
+
+    def record_success(self, latency):
+        with self._lock:
+            self.errors = 0
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * latency
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    @property
+    def healthy(self):
+        return self.errors < self.max_errors and self.lag <= self.max_lag
+
+    def score(self):
+        latency = self.latency if self.latency is not None else 0.0
+        return (not self.healthy, latency * (1 + self.in_use / self.size))
+
+
+class PoolRPC(object):
+    """
+    Rpc proxy routing every call through :py:meth:`ConnectionPool.call`.
+    """
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            return self._pool.call(method, *args, **kwargs)
+        call.__name__ = method
+        return call
+
+
+class ConnectionPool(object):
+    """
+    Pool of websocket connections over several node endpoints.
+
+    Every call is routed to the healthy endpoint with the lowest latency
+    weighted by its current load. A background thread checks head block
+    lag and latency of every endpoint. A call failing on a broken
+    connection or a timeout is retried on the next best endpoint, so
+    in-flight requests survive a node going down. Errors returned by the
+    node, e.g. for a bad argument, are raised at once.
+
+    The pool exposes ``rpc`` and can be used in place of a chain instance
+    by classes that only issue rpc calls, e.g.
+    :py:class:`megaphone.blockchain.Blockchain`.
+    """
+    def __init__(self, urls, apis=None, connections_per_endpoint=2,
+                 health_interval=10, max_lag=3, max_errors=3,
+                 acquire_timeout=30, chain_factory=None, throttles=None,
+                 timeout=10, num_retries=0, **kwargs):
+        """
+        :param urls: node endpoints
+        :type urls: list of str
+        :param apis: apis to register on every connection
+        :param connections_per_endpoint: maximum number of connections
+            opened to every endpoint
+        :param health_interval: seconds between health checks, 0 disables
+            the background checks
+        :param max_lag: maximum head block lag of a healthy endpoint
+        :param max_errors: consecutive errors making an endpoint unhealthy
+        :param acquire_timeout: seconds to wait for a free connection
+        :param chain_factory: callable creating a chain instance for an url
+        :param throttles: :py:class:`megaphone.throttle.Throttle` per url,
+            shared with other users of the endpoints
+        :param timeout: connection and call timeout of the default
+            chain_factory in seconds, see :py:func:`connect`
+        :param num_retries: reconnects of the default chain_factory
+            connections before a call fails over
+        :param kwargs: arguments for the chain instances
+        """
+        if not urls:
+            raise PoolError("At least one endpoint is required!")
+        if chain_factory is None:
+            def chain_factory(url):
+                return connect(url, apis=apis, timeout=timeout,
+                               num_retries=num_retries, **kwargs)
+        throttles = throttles or {}
+        self.endpoints = [Endpoint(url, connections_per_endpoint,
+                                   chain_factory, max_lag, max_errors,
+                                   throttles.get(url))
+                          for url in urls]
+        self.acquire_timeout = acquire_timeout
+        self.rpc = PoolRPC(self)
+
+        self._stop = threading.Event()
+        self._health_thread = None
+        if health_interval:
+            self._health_thread = threading.Thread(
+                target=self._health_loop, args=(health_interval,),
+                name="megaphone-pool-health", daemon=True)
+            self._health_thread.start()
+
+    def _select(self, exclude):
+        candidates = [e for e in self.endpoints if e.url not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=Endpoint.score)
+
+    def call(self, method, *args, **kwargs):
+        """
+        Execute an rpc call on the best endpoint, failing over to the other
+        endpoints on transport errors, see :py:func:`transport_errors`.
+
+        :param method: rpc method name
+        :type method: str
+        """
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._select(tried)
+            if endpoint is None:
+                raise PoolError("%s failed on all endpoints: %s"
+                                % (method, last_error))
+            tried.add(endpoint.url)
+            try:
+                chaind = endpoint.acquire(self.acquire_timeout)
+            except Exception as e:
+                endpoint.record_error()
+                last_error = e
+                continue
+
+            start = time.time()
+            try:
+                func = getattr(chaind.rpc, method)
+                if endpoint.throttle is not None:
+                    result = endpoint.throttle.call(func, *args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+            except transport_errors() as e:
+                # the connection is broken, open a new one next time
+                endpoint.discard(chaind)
+                endpoint.record_error()
+                last_error = e
+                continue
+            except Exception:
+                # the node answered, retrying would repeat e.g. a broadcast
+                endpoint.release(chaind)
+                raise
+            endpoint.record_success(time.time() - start)
+            endpoint.release(chaind)
+            return result
+
+    def check_health(self):
+        """
+        Measure latency and head block of every endpoint and mark endpoints
+        lagging more than max_lag blocks behind the best one as unhealthy.
+        """
+        for endpoint in self.endpoints:
+            try:
+                chaind = endpoint.acquire(self.acquire_timeout)
+            except Exception:
+                endpoint.record_error()
+                continue
+            start = time.time()
+            try:
+                props = chaind.rpc.get_dynamic_global_properties()
+            except transport_errors():
+                endpoint.discard(chaind)
+                endpoint.record_error()
+                continue
+            except Exception:
+                endpoint.release(chaind)
+                endpoint.record_error()
+                continue
+            endpoint.record_success(time.time() - start)
+            endpoint.release(chaind)
+            endpoint.head_block = props['head_block_number']
+
+        heads = [e.head_block for e in self.endpoints if e.head_block is not None]
+        if not heads:
+            return
+        best = max(heads)
+        for endpoint in self.endpoints:
+            if endpoint.head_block is not None:
+                endpoint.lag = best - endpoint.head_block
+
+    def _health_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.check_health()
+
+    def stats(self):
+        """
+        Return health statistics of all endpoints.
+
+        :rtype: list of dict
+        """
+        return [{
+            "url": e.url,
+            "healthy": e.healthy,
+            "latency": e.latency,
+            "head_block": e.head_block,
+            "lag": e.lag,
+            "errors": e.errors,
+            "in_use": e.in_use,
+        } for e in self.endpoints]
+
+    def close(self):
+        """
+        Stop background health checks and close idle connections.
+        """
+        self._stop.set()
+        if self._health_thread is not None:
+            self._health_thread.join()
+        for endpoint in self.endpoints:
+            endpoint.close()
@@ -1,42 +1,200 @@
-import json
+import re
+import threading
 import time
-from contextlib import suppress
-from dateutil import parser
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
 from piston.steem import Post as PistonPost
 
-from megaphone.helpers import parse_payout, time_diff
+from megaphone.helpers import json_loads, parse_payout, parse_timestamp, \
+    read_json_fields, time_diff
 from megaphone.node import Node
+from megaphone.pool import close_connection
 
 
 class PostError(RuntimeError):
     pass
 
 
+def resolve_identifier(identifier):
+    """
+    Split post identifier into author and permlink.
+
+    :param identifier: post identifier e.g. @author/permlink
+    :type identifier: str
+    :return: author and permlink
+    :rtype: tuple
+    """
+    match = re.match(r"@?([\w\-\.]*)/([\w\-]*)", identifier)
+    if match is None:
+        raise PostError("Invalid post identifier: %s" % identifier)
+    return match.group(1), match.group(2)
+
+
+def fetch_concurrently(chaind, calls, concurrency=1, chain_factory=None,
+                       connections=None):
+    """
+    Execute rpc calls, optionally in parallel. Every worker thread uses its
+    own chain connection created by chain_factory, since a single
+    websocket connection cannot serve concurrent requests. Worker
+    connections are closed before returning unless a connections list
+    keeps them for the next call.
+
+    :param chaind: chain instance used when concurrency is 1
+    :param calls: list of (rpc method name, args) tuples
+    :param concurrency: number of parallel connections
+    :type concurrency: int
+    :param chain_factory: callable returning a new chain instance, defaults
+        to :py:meth:`megaphone.node.Node.connect_throttled` so that all
+        workers share the rate and concurrency limits of the node; it may
+        also return a shared :py:class:`megaphone.pool.ConnectionPool`
+    :param connections: idle worker connections, taken before new ones
+        are opened and returned to the list afterwards; the caller closes
+        them with :py:func:`megaphone.pool.close_connection`
+    :type connections: list
+    :return: results in the order of calls, exceptions are returned in
+        place of results of failed calls
+    :rtype: list
+    """
+    def execute(rpc, call):
+        method, args = call
+        try:
+            return getattr(rpc, method)(*args)
+        except Exception as e:
+            return e
+
+    if concurrency <= 1 or len(calls) <= 1:
+        return [execute(chaind.rpc, call) for call in calls]
+
+    if chain_factory is None:
+        chain_factory = Node().connect_throttled
+    idle = connections if connections is not None else []
+    used = []
+    lock = threading.Lock()
+    local = threading.local()
+
+    def worker(call):
+        if not hasattr(local, "chaind"):
+            with lock:
+                chaind = idle.pop() if idle else None
+            if chaind is None:
+                chaind = chain_factory()
+            with lock:
+                used.append(chaind)
+            local.chaind = chaind
+        return execute(local.chaind.rpc, call)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(worker, calls))
+    finally:
+        if connections is None:
+            for chaind in used:
+                close_connection(chaind)
+        else:
+            connections.extend(used)
+
+
+ReplyTree = namedtuple('ReplyTree', ['posts', 'parents', 'depths'])
+
+
 class Post(PistonPost):
     """
     Piston Post enhanced with metadata and a few utility methods.
     """
-    def __init__(self, post, chaind=None):
+    def __init__(self, post, chaind=None, blockchain_name=None):
         if not chaind:
             chaind = Node().default()
-        self.blockchain_name = chaind.rpc.get_config()['BLOCKCHAIN_NAME']
+        if blockchain_name is None:
+            blockchain_name = chaind.rpc.get_config()['BLOCKCHAIN_NAME']
+        self.blockchain_name = blockchain_name
         if isinstance(post, PistonPost):
             post = post.identifier
         super(Post, self).__init__(chaind, post)
 
+    @classmethod
+    def load_many(cls, identifiers, chaind=None, concurrency=1,
+                  chain_factory=None):
+        """
+        Load many posts with a single config lookup. Content is fetched
+        over ``concurrency`` parallel connections.
+
+        :param identifiers: post identifiers e.g. @author/permlink
+        :type identifiers: list of str
+        :param chaind: chain instance the posts are bound to
+        :param concurrency: number of parallel connections
+        :type concurrency: int
+        :param chain_factory: callable returning a new chain instance for
+            every worker, defaults to Node().connect_throttled
+        :return: posts in input order, a :py:class:`PostError` takes the
+            place of every post that failed to load
+        :rtype: list
+        """
+        if not chaind:
+            chaind = Node().default()
+        blockchain_name = chaind.rpc.get_config()['BLOCKCHAIN_NAME']
+
+        posts = [None] * len(identifiers)
+        calls = []
+        positions = []
+        for i, identifier in enumerate(identifiers):
+            try:
+                calls.append(("get_content", resolve_identifier(identifier)))
+                positions.append(i)
+            except PostError as e:
+                posts[i] = e
+
+        results = fetch_concurrently(chaind, calls, concurrency, chain_factory)
+        for i, content in zip(positions, results):
+            identifier = identifiers[i]
+            if isinstance(content, Exception):
+                posts[i] = PostError("Failed to load %s: %s" % (identifier, content))
+            elif not content or not content.get("author"):
+                posts[i] = PostError("Post %s does not exist!" % identifier)
+            else:
+                try:
+                    posts[i] = cls(content, chaind, blockchain_name)
+                except Exception as e:
+                    posts[i] = PostError("Failed to load %s: %s" % (identifier, e))
+        return posts
+
     @property
     def meta(self):
         """
-        JSON metadata of the post.
+        JSON metadata of the post. Decoded metadata is cached until
+        json_metadata changes.
 
-        :return: post metadata
-        :rtype: json
+        :return: post metadata, empty if it cannot be decoded
+        :rtype: dict
         """
-        with suppress(Exception):
-            meta_str = self.get("json_metadata", "")
-            meta = json.loads(meta_str)
+        meta_str = self.get("json_metadata", "")
+        cache = getattr(self, "_meta_cache", None)
+        if cache is not None and cache[0] == meta_str:
+            return cache[1]
+        try:
+            meta = json_loads(meta_str)
+        except (ValueError, TypeError):
+            meta = {}
+        if not isinstance(meta, dict):
+            meta = {}
+        self._meta_cache = (meta_str, meta)
         return meta
 
+    def meta_fields(self, *fields):
+        """
+        Selected fields of JSON metadata, e.g. meta_fields("tags", "app").
+        Only the requested fields are decoded unless the full metadata is
+        already cached.
+
+        :return: requested fields present in the metadata
+        :rtype: dict
+        """
+        meta_str = self.get("json_metadata", "")
+        cache = getattr(self, "_meta_cache", None)
+        if cache is not None and cache[0] == meta_str:
+            return dict((f, cache[1][f]) for f in fields if f in cache[1])
+        return read_json_fields(meta_str or "", fields)
+
     @property
     def url(self):
         """
@@ -66,6 +224,59 @@ class Post(PistonPost):
         else:
             return False
 
+    def get_replies_tree(self, max_depth=None, concurrency=1,
+                         chain_factory=None):
+        """
+        Load the reply tree of the post breadth-first. Replies of a whole
+        level are fetched over ``concurrency`` parallel connections.
+
+        :param max_depth: maximum depth relative to the post, unlimited if
+            None
+        :type max_depth: int
+        :param concurrency: number of parallel connections
+        :type concurrency: int
+        :param chain_factory: callable returning a new chain instance for
+            every worker, defaults to Node().connect_throttled
+        :return: posts in breadth-first order starting with this post,
+            index of the parent of every post (-1 for this post) and depth
+            relative to this post
+        :rtype: :py:class:`ReplyTree`
+        """
+        posts = [self]
+        parents = [-1]
+        depths = [0]
+        level = [0]
+        depth = 0
+        # worker connections are kept for all levels
+        connections = []
+        try:
+            while level and (max_depth is None or depth < max_depth):
+                depth += 1
+                calls = [("get_content_replies",
+                          (posts[i]["author"], posts[i]["permlink"]))
+                         for i in level]
+                results = fetch_concurrently(self.steem, calls, concurrency,
+                                             chain_factory, connections)
+                next_level = []
+                for parent, replies in zip(level, results):
+                    if isinstance(replies, Exception):
+                        raise PostError("Failed to load replies of %s: %s"
+                                        % (posts[parent].identifier, replies))
+                    for reply in replies:
+                        next_level.append(len(posts))
+                        posts.append(Post(reply, self.steem,
+                                          self.blockchain_name))
+                        parents.append(parent)
+                        depths.append(depth)
+                level = next_level
+        finally:
+            for chaind in connections:
+                close_connection(chaind)
+
+        import numpy as np
+        return ReplyTree(posts, np.array(parents, dtype=np.int32),
+                         np.array(depths, dtype=np.int32))
+
     def get_votes(self, from_account=None):
         """
         Get votes for an account.
@@ -128,7 +339,7 @@ class Post(PistonPost):
         :return: time elapsed in seconds since post creation
         :rtype int
         """
-        created_at = parser.parse(self['created'] + "UTC").timestamp()
+        created_at = parse_timestamp(self['created'])
         now_adjusted = time.time()
         return now_adjusted - created_at
 
@@ -0,0 +1,207 @@
+import time
+
+import numpy as np
+
+from megaphone.helpers import parse_payout, parse_timestamp, post_tags
+
+
+class PostFrameError(RuntimeError):
+    pass
+
+
+class PostFrame(object):
+    """
+    Columnar container of many posts with vectorized equivalents of
+    :py:class:`megaphone.post.Post` methods. Every method returns a NumPy
+    array with one value per post.
+
+    Tags are stored sparsely as ``tag_indices``, the tag ids of all posts
+    one after another, with post i owning
+    ``tag_indices[tag_indptr[i]:tag_indptr[i + 1]]``, so memory grows with
+    the number of tags per post and not with the tag vocabulary.
+    """
+    def __init__(self, identifiers, rshares, weights, votes_rshares,
+                 votes_weights, payouts, created, depths, comments,
+                 tag_indptr, tag_indices, tags):
+        self.identifiers = identifiers
+        self.rshares = rshares
+        self.weights = weights
+        self.votes_rshares = votes_rshares
+        self.votes_weights = votes_weights
+        self.payouts = payouts
+        self.created = created
+        self.depths = depths
+        self.comments = comments
+        self.tag_indptr = tag_indptr
+        self.tag_indices = tag_indices
+        self.tags = tags
+
+    @classmethod
+    def from_posts(cls, posts):
+        """
+        Build a frame from posts or raw get_content dictionaries. The
+        payout of a raw dictionary is its total plus its pending payout,
+        as in piston's ``total_payout_reward``.
+
+        :param posts: posts
+        :type posts: list of :py:class:`megaphone.post.Post` or dict
+        :rtype: :py:class:`PostFrame`
+        """
+        count = len(posts)
+        identifiers = []
+        rshares = np.zeros(count, dtype=np.int64)
+        weights = np.zeros(count, dtype=np.uint64)
+        votes_rshares = np.zeros(count, dtype=np.int64)
+        votes_weights = np.zeros(count, dtype=np.uint64)
+        payouts = np.zeros(count, dtype=np.float64)
+        created = np.zeros(count, dtype=np.float64)
+        depths = np.zeros(count, dtype=np.int32)
+        comments = np.zeros(count, dtype=bool)
+        tags = {}
+        tag_ids = []
+
+        for i, post in enumerate(posts):
+            identifiers.append("@%s/%s" % (post["author"], post["permlink"]))
+            rshares[i] = int(post["vote_rshares"])
+            weights[i] = int(post["total_vote_weight"])
+            votes = post.get("active_votes") or []
+            votes_rshares[i] = sum(int(v["rshares"]) for v in votes)
+            votes_weights[i] = sum(int(v["weight"]) for v in votes)
+            if "total_payout_reward" in post:
+                payouts[i] = parse_payout(post["total_payout_reward"])
+            else:
+                payouts[i] = parse_payout(post["total_payout_value"]) + \
+                    parse_payout(post["pending_payout_value"])
+            created[i] = parse_timestamp(post["created"])
+            depths[i] = post["depth"]
+            comments[i] = (len(post["title"]) == 0 or post["depth"] > 0 or
+                           len(post["parent_author"]) > 0)
+            tag_ids.append([tags.setdefault(t, len(tags))
+                            for t in post_tags(post)])
+
+        tag_indptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in tag_ids], out=tag_indptr[1:])
+        tag_indices = np.fromiter((t for ids in tag_ids for t in ids),
+                                  dtype=np.int32, count=tag_indptr[-1])
+
+        return cls(identifiers, rshares, weights, votes_rshares,
+                   votes_weights, payouts, created, depths, comments,
+                   tag_indptr, tag_indices, tags)
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def select(self, index):
+        """
+        Return a frame with a subset of posts.
+
+        :param index: boolean mask or integer indices
+        :rtype: :py:class:`PostFrame`
+        """
+        index = np.asarray(index)
+        if index.dtype == bool:
+            index = np.flatnonzero(index)
+        index = index.astype(np.int64)
+        starts = self.tag_indptr[index]
+        lengths = self.tag_indptr[index + 1] - starts
+        tag_indptr = np.zeros(len(index) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=tag_indptr[1:])
+        # position of every selected tag in the original tag_indices
+        positions = np.repeat(starts - tag_indptr[:-1], lengths) + \
+            np.arange(tag_indptr[-1])
+        return PostFrame([self.identifiers[i] for i in index],
+                         self.rshares[index], self.weights[index],
+                         self.votes_rshares[index], self.votes_weights[index],
+                         self.payouts[index], self.created[index],
+                         self.depths[index], self.comments[index],
+                         tag_indptr, self.tag_indices[positions], self.tags)
+
+    def time_elapsed(self, now=None):
+        """
+        Time elapsed since post creation, see
+        :py:meth:`megaphone.post.Post.time_elapsed`.
+
+        :param now: reference UTC epoch, defaults to current time
+        :rtype: numpy.ndarray
+        """
+        if now is None:
+            now = time.time()
+        return now - self.created
+
+    def calc_reward_pct(self, now=None):
+        """
+        Reward percentage, see :py:meth:`megaphone.post.Post.calc_reward_pct`.
+
+        :rtype: numpy.ndarray
+        """
+        return np.minimum(self.time_elapsed(now) / 1800 * 100, 100)
+
+    def payout(self):
+        """
+        Post payouts, see :py:meth:`megaphone.post.Post.payout`.
+
+        :rtype: numpy.ndarray
+        """
+        return self.payouts
+
+    def is_comment(self):
+        """
+        Comment flags, see :py:meth:`megaphone.post.Post.is_comment`.
+
+        :rtype: numpy.ndarray
+        """
+        return self.comments
+
+    def get_metadata(self, now=None):
+        """
+        Rshares, weights and time elapsed, see
+        :py:meth:`megaphone.post.Post.get_metadata`.
+
+        :rtype: dict of numpy.ndarray
+        """
+        elapsed = self.time_elapsed(now)
+        recount = (self.weights == 0) & (elapsed > 3600)
+        return {
+            "rshares": np.where(recount, self.votes_rshares, self.rshares),
+            "weight": np.where(recount, self.votes_weights, self.weights),
+            "time_elapsed": elapsed,
+        }
+
+    def contains_tags(self, filter_by=('spam', 'test', 'nsfw')):
+        """
+        Check which posts contain any of the tags, see
+        :py:meth:`megaphone.post.Post.contains_tags`.
+
+        :param filter_by: tags to filter the posts with
+        :type filter_by: tuple of str
+        :rtype: numpy.ndarray
+        """
+        ids = [self.tags[tag] for tag in filter_by if tag in self.tags]
+        found = np.zeros(len(self), dtype=bool)
+        if not ids:
+            return found
+        hits = np.flatnonzero(np.isin(self.tag_indices, ids))
+        # the post owning every matching tag
+        found[np.searchsorted(self.tag_indptr, hits, side="right") - 1] = True
+        return found
+
+    def top(self, scores, k=10):
+        """
+        Return identifiers of the k posts with the highest scores.
+
+        :param scores: one score per post
+        :type scores: numpy.ndarray
+        :param k: number of posts
+        :type k: int
+        :rtype: list of str
+        """
+        scores = np.asarray(scores)
+        if len(scores) != len(self):
+            raise PostFrameError("Expected %d scores, got %d!"
+                                 % (len(self), len(scores)))
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [self.identifiers[i] for i in best]
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CoalescingRPC(object):
+    """
+    Rpc wrapper sharing one network request among identical concurrent
+    calls (same method and params). Results of calls for immutable data
+    are kept in a small short-lived cache:
+        get_config,
+        get_block and get_ops_in_block below the last irreversible block,
+        get_account_history pages ending at the requested index.
+
+    Callers share result objects and should not modify them. Cache
+    counters are reported by :py:func:`megaphone.metrics.instrument`.
+    """
+    def __init__(self, rpc, cache_ttl=60, cache_size=1024):
+        """
+        :param rpc: rpc instance to wrap, e.g. chain.rpc
+        :param cache_ttl: seconds to keep cached results
+        :type cache_ttl: float
+        :param cache_size: maximum number of cached results
+        :type cache_size: int
+        """
+        self._rpc = rpc
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.last_irreversible_block = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._cache = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            return self.call(method, *args, **kwargs)
+        call.__name__ = method
+        return call
+
+    def _cacheable(self, method, args, result):
+        if method == "get_config":
+            return True
+        if method in ("get_block", "get_ops_in_block"):
+            return (result is not None and bool(args) and
+                    args[0] <= self.last_irreversible_block)
+        if method == "get_account_history":
+            return (len(args) > 1 and args[1] >= 0 and bool(result) and
+                    result[-1][0] == args[1])
+        return False
+
+    def call(self, method, *args, **kwargs):
+        """
+        Execute an rpc call, joining an identical call already in flight.
+
+        :param method: rpc method name
+        :type method: str
+        """
+        key = (method, repr(args), repr(sorted(kwargs.items())))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                if cached[0] > time.time():
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                    return cached[1]
+                del self._cache[key]
+            pending = self._in_flight.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._in_flight[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+
+        try:
+            pending.result = getattr(self._rpc, method)(*args, **kwargs)
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if pending.error is None:
+                    self._store(key, method, args, pending.result)
+            pending.done.set()
+        return pending.result
+
+    def _store(self, key, method, args, result):
+        if method == "get_dynamic_global_properties":
+            self.last_irreversible_block = max(
+                self.last_irreversible_block,
+                result.get('last_irreversible_block_num', 0))
+        if not self._cacheable(method, args, result):
+            return
+        self._cache[key] = (time.time() + self.cache_ttl, result)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        """
+        Drop all cached results.
+        """
+        with self._lock:
+            self._cache.clear()
+
+
+def coalesce(chaind, **kwargs):
+    """
+    Replace rpc of a chain instance or a connection pool with a
+    :py:class:`CoalescingRPC`.
+
+    :param chaind: chain instance or :py:class:`megaphone.pool.ConnectionPool`
+    :param kwargs: arguments for :py:class:`CoalescingRPC`
+    :return: the same chain instance
+    """
+    if not isinstance(chaind.rpc, CoalescingRPC):
+        chaind.rpc = CoalescingRPC(chaind.rpc, **kwargs)
+    return chaind
@@ -0,0 +1,428 @@
+import os
+import time
+
+from megaphone.asset import Asset
+from megaphone.converter import Converter
+from megaphone.helpers import parse_timestamp
+from megaphone.node import Node
+
+# table columns and the symbols they hold
+COLUMNS = ("balance", "sbd_balance", "vesting_shares")
+SYMBOL_COLUMNS = {
+    "STEEM": "balance",
+    "GOLOS": "balance",
+    "SBD": "sbd_balance",
+    "GBG": "sbd_balance",
+    "VESTS": "vesting_shares",
+    "GESTS": "vesting_shares",
+}
+PRECISIONS = {"balance": 3, "sbd_balance": 3, "vesting_shares": 6}
+
+FULL_VOTING_POWER = 10000
+VOTE_REGENERATION_SECONDS = 432000
+
+# get_accounts batches read again when a block was produced meanwhile
+SNAPSHOT_ATTEMPTS = 5
+
+
+class StateError(RuntimeError):
+    pass
+
+
+class AccountState(object):
+    """
+    Balances and voting power of many accounts kept up to date from
+    replayed operations instead of per-account rpc calls.
+
+    The state starts from get_accounts snapshots and applies transfers,
+    vesting, votes and rewards from the following blocks. Every account
+    remembers the head block of its snapshot, operations up to it are
+    already included and skipped. Amounts are kept as integer numbers of
+    the smallest units in numpy columns, one row per account. Rewards are
+    credited when they are paid, so unclaimed reward balances are
+    included.
+
+    Not tracked, balances of accounts using them drift: savings balances,
+    limit orders and their fill_order, account_create fees, escrow and
+    vesting delegations.
+
+    Usage::
+
+        state = AccountState()
+        state.load_accounts(["alice", "bob"])
+        # replay follows irreversible blocks, it waits until the end
+        # block became irreversible
+        state.sync(end_block=state.block_num + 100)
+        state.get("alice")
+    """
+    def __init__(self, chaind=None, converter=None, vote_denominator=200):
+        """
+        :param chaind: Blockchain node instance (steemd/golosd)
+        :param converter: converter of token power to vests, see
+            :py:class:`megaphone.converter.Converter`; with a series it
+            converts at the block of each operation
+        :param vote_denominator: share of voting power used by a full vote
+            is 1 / vote_denominator
+        """
+        if not chaind:
+            chaind = Node().default()
+        self.chaind = chaind
+        self.rpc = chaind.rpc
+        self.converter = converter
+        self.vote_denominator = vote_denominator
+        self.names = []
+        self.index = {}
+        self.block_num = 0
+        self.time = None
+        # all operations of block_num have been applied
+        self._synced_block = True
+        self._columns = None
+        self._handlers = {
+            "transfer": self._transfer,
+            "transfer_to_savings": self._transfer_to_savings,
+            "fill_transfer_from_savings": self._fill_transfer_from_savings,
+            "transfer_to_vesting": self._transfer_to_vesting,
+            "fill_vesting_withdraw": self._fill_vesting_withdraw,
+            "convert": self._convert,
+            "fill_convert_request": self._fill_convert_request,
+            "vote": self._vote,
+            "curation_reward": self._curation_reward,
+            "author_reward": self._author_reward,
+            "comment_benefactor_reward": self._benefactor_reward,
+            "producer_reward": self._producer_reward,
+            "interest": self._interest,
+        }
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    @property
+    def ops(self):
+        """
+        Operation types changing the state.
+        """
+        return frozenset(self._handlers)
+
+    # snapshot
+
+    def _allocate(self, count):
+        import numpy as np
+
+        columns = dict((c, np.zeros(count, dtype=np.int64)) for c in COLUMNS)
+        columns["voting_power"] = np.zeros(count, dtype=np.int32)
+        columns["last_vote_time"] = np.zeros(count, dtype=np.float64)
+        columns["snapshot_block"] = np.zeros(count, dtype=np.int64)
+        if self._columns is None:
+            self._columns = columns
+        else:
+            for name, column in columns.items():
+                self._columns[name] = np.concatenate([self._columns[name], column])
+
+    def load_accounts(self, names, batch_size=1000):
+        """
+        Add accounts from get_accounts snapshots. get_accounts returns the
+        state at the head block, every batch is stamped with the head
+        block it was read at. A new state continues from the head block of
+        its first batch.
+
+        :param names: account names
+        :type names: list of str
+        :param batch_size: accounts per get_accounts call
+        """
+        names = [n for n in dict.fromkeys(names) if n not in self.index]
+        for i in range(0, len(names), batch_size):
+            accounts, props = self._snapshot(names[i:i + batch_size])
+            if not self.block_num:
+                self.block_num = props['head_block_number']
+                self.time = parse_timestamp(props['time'])
+            first = len(self.names)
+            self._allocate(len(accounts))
+            for row, account in enumerate(accounts, first):
+                self.index[account['name']] = row
+                self.names.append(account['name'])
+                for column in COLUMNS:
+                    self._columns[column][row] = \
+                        Asset.from_string(account[column]).amount
+                self._columns["voting_power"][row] = account['voting_power']
+                self._columns["last_vote_time"][row] = \
+                    parse_timestamp(account['last_vote_time'])
+                self._columns["snapshot_block"][row] = \
+                    props['head_block_number']
+
+    def _snapshot(self, names):
+        # the head block before and after get_accounts must match, or the
+        # accounts could include operations of a later block
+        props = self.rpc.get_dynamic_global_properties()
+        for _ in range(SNAPSHOT_ATTEMPTS):
+            accounts = self.rpc.get_accounts(names)
+            after = self.rpc.get_dynamic_global_properties()
+            if after['head_block_number'] == props['head_block_number']:
+                return accounts, props
+            props = after
+        raise StateError("Head block changed during %d get_accounts calls!"
+                         % SNAPSHOT_ATTEMPTS)
+
+    # operations
+
+    def _tracked(self, name):
+        # row of an account whose snapshot misses the current operation
+        row = self.index.get(name)
+        if row is None or \
+                self._columns["snapshot_block"][row] >= self.block_num:
+            return None
+        return row
+
+    def _credit(self, name, asset_string, sign=1):
+        row = self._tracked(name)
+        if row is None:
+            return
+        asset = Asset.from_string(asset_string)
+        column = SYMBOL_COLUMNS.get(asset.symbol)
+        if column is None:
+            raise StateError("Unknown asset symbol %s" % asset.symbol)
+        self._columns[column][row] += sign * asset.amount
+
+    def _transfer(self, op):
+        self._credit(op['from'], op['amount'], -1)
+        self._credit(op['to'], op['amount'])
+
+    def _transfer_to_savings(self, op):
+        self._credit(op['from'], op['amount'], -1)
+
+    def _fill_transfer_from_savings(self, op):
+        self._credit(op['to'], op['amount'])
+
+    def _transfer_to_vesting(self, op):
+        self._credit(op['from'], op['amount'], -1)
+        row = self._tracked(op['to'] or op['from'])
+        if row is None:
+            return
+        power = Asset.from_string(op['amount']).value
+        vests = self._converter().power_to_vests(power)
+        self._columns["vesting_shares"][row] += \
+            int(vests * 10 ** PRECISIONS["vesting_shares"])
+
+    def _converter(self):
+        if self.converter is None:
+            self.converter = Converter(self.chaind)
+        if self.converter.series is not None:
+            return self.converter.at_block(self.block_num)
+        return self.converter
+
+    def _fill_vesting_withdraw(self, op):
+        self._credit(op['from_account'], op['withdrawn'], -1)
+        self._credit(op['to_account'], op['deposited'])
+
+    def _convert(self, op):
+        self._credit(op['owner'], op['amount'], -1)
+
+    def _fill_convert_request(self, op):
+        self._credit(op['owner'], op['amount_out'])
+
+    def _vote(self, op):
+        row = self._tracked(op['voter'])
+        if row is None:
+            return
+        power = self._regenerated(row, self.time)
+        used = power * abs(op['weight']) // FULL_VOTING_POWER
+        used = used // self.vote_denominator + 1
+        self._columns["voting_power"][row] = max(0, power - used)
+        self._columns["last_vote_time"][row] = self.time
+
+    def _curation_reward(self, op):
+        self._credit(op['curator'], op['reward'])
+
+    def _author_reward(self, op):
+        self._credit(op['author'], op['sbd_payout'])
+        self._credit(op['author'], op['steem_payout'])
+        self._credit(op['author'], op['vesting_payout'])
+
+    def _benefactor_reward(self, op):
+        self._credit(op['benefactor'], op['reward'])
+
+    def _producer_reward(self, op):
+        self._credit(op['producer'], op['vesting_shares'])
+
+    def _interest(self, op):
+        self._credit(op['owner'], op['interest'])
+
+    def apply(self, operation):
+        """
+        Apply an operation as returned by replay. Operations of blocks up
+        to the state's block are ignored, so a replay may overlap the
+        snapshot, as are operations included in the snapshot of an
+        account.
+
+        :param operation: operation
+        :type operation: dict
+        :return: True if the operation was applied
+        :rtype: bool
+        """
+        handler = self._handlers.get(operation['op_type'])
+        block_num = operation['block_id']
+        if handler is None or block_num < self.block_num or (
+                block_num == self.block_num and self._synced_block):
+            return False
+        if block_num > self.block_num:
+            self.block_num = block_num
+            self._synced_block = False
+        self.time = parse_timestamp(operation['timestamp'])
+        handler(operation['op'])
+        return True
+
+    def sync(self, blockchain=None, end_block=None, snapshot_path=None,
+             snapshot_every=1000):
+        """
+        Apply operations from the block after the state's block. Without
+        end_block it follows the chain forever.
+
+        :param blockchain: :py:class:`megaphone.blockchain.Blockchain`
+        :param end_block: last block to apply
+        :param snapshot_path: file to save the state to periodically
+        :param snapshot_every: blocks between snapshots
+        :return: number of applied operations
+        :rtype: int
+        """
+        if not self.block_num:
+            raise StateError("Load accounts before syncing!")
+        if blockchain is None:
+            from megaphone.blockchain import Blockchain
+            blockchain = Blockchain(self.chaind)
+        start_block = self.block_num + 1
+        applied = 0
+        last_snapshot = self.block_num
+        if end_block is not None and end_block < start_block:
+            return applied
+        operations = blockchain.replay(
+            start_block=start_block,
+            end_block=end_block + 1 if end_block is not None else None,
+            filter_by=sorted(self.ops))
+        for operation in operations:
+            if operation['block_id'] > self.block_num:
+                # the previous block is complete, snapshots are taken
+                # only between blocks
+                self._synced_block = True
+                if snapshot_path and \
+                        self.block_num - last_snapshot >= snapshot_every:
+                    self.save(snapshot_path)
+                    last_snapshot = self.block_num
+            applied += self.apply(operation)
+        if end_block is not None:
+            self.block_num = max(self.block_num, end_block)
+            self._synced_block = True
+        if snapshot_path:
+            self.save(snapshot_path)
+        return applied
+
+    # queries
+
+    def _regenerated(self, row, at):
+        elapsed = max(0.0, at - self._columns["last_vote_time"][row])
+        power = self._columns["voting_power"][row] + \
+            int(elapsed * FULL_VOTING_POWER / VOTE_REGENERATION_SECONDS)
+        return int(min(FULL_VOTING_POWER, power))
+
+    def voting_power(self, name, at=None):
+        """
+        Voting power regenerated until a time.
+
+        :param name: account name
+        :param at: seconds since epoch, defaults to the time of the last
+            applied operation
+        :return: voting power, 10000 is 100%
+        :rtype: int
+        """
+        row = self._row(name)
+        return self._regenerated(row, self.time if at is None else at)
+
+    def voting_powers(self, at=None):
+        """
+        Regenerated voting power of all accounts, in order of ``names``.
+
+        :rtype: numpy.ndarray
+        """
+        import numpy as np
+
+        at = self.time if at is None else at
+        elapsed = np.maximum(0.0, at - self._columns["last_vote_time"])
+        power = self._columns["voting_power"] + \
+            (elapsed * FULL_VOTING_POWER / VOTE_REGENERATION_SECONDS).astype(np.int64)
+        return np.minimum(FULL_VOTING_POWER, power)
+
+    def _row(self, name):
+        row = self.index.get(name)
+        if row is None:
+            raise StateError("Account %s is not tracked!" % name)
+        return row
+
+    def get(self, name):
+        """
+        Return balances and voting power of an account.
+
+        :param name: account name
+        :rtype: dict
+        """
+        row = self._row(name)
+        state = dict((column, int(self._columns[column][row]) /
+                      10 ** PRECISIONS[column]) for column in COLUMNS)
+        state["name"] = name
+        state["voting_power"] = self.voting_power(name)
+        return state
+
+    def column(self, name):
+        """
+        Return a column of all accounts as a float array, in order of
+        ``names``, e.g. ``column("vesting_shares")``.
+
+        :param name: one of ``COLUMNS``, "voting_power" or "last_vote_time"
+        :rtype: numpy.ndarray
+        """
+        if name == "voting_power":
+            return self.voting_powers()
+        if name in PRECISIONS:
+            return self._columns[name] / 10 ** PRECISIONS[name]
+        return self._columns[name]
+
+    # persistence
+
+    def save(self, path):
+        """
+        Save the state to a numpy .npz file. The file is replaced
+        atomically, an interrupted save leaves the previous snapshot
+        intact.
+
+        :param path: file name, used as given
+        """
+        import numpy as np
+
+        # a file object keeps numpy from appending .npz to the name
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, names=np.array(self.names, dtype=str),
+                     block_num=self.block_num,
+                     time=self.time if self.time is not None else time.time(),
+                     synced_block=self._synced_block,
+                     **self._columns)
+        os.replace(path + ".tmp", path)
+
+    def load(self, path):
+        """
+        Replace the state with a snapshot saved by :py:meth:`save`.
+
+        :param path: file name
+        :return: self
+        """
+        import numpy as np
+
+        with np.load(path) as data:
+            self.names = [str(n) for n in data["names"]]
+            self.index = dict((n, i) for i, n in enumerate(self.names))
+            self.block_num = int(data["block_num"])
+            self.time = float(data["time"])
+            self._synced_block = bool(data["synced_block"])
+            self._columns = dict((c, data[c]) for c in
+                                 COLUMNS + ("voting_power", "last_vote_time",
+                                            "snapshot_block"))
+        return self
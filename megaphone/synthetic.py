@@ -0,0 +1,609 @@
+import json
+import os
+import random
+import struct
+import zlib
+
+from megaphone.fakenode import BLOCK_INTERVAL, EmptyChain
+
+MASK = 0xFFFFFFFFFFFFFFFF
+
+# relative frequencies of operations in blocks
+OP_MIX = {
+    "vote": 72,
+    "comment": 12,
+    "transfer": 8,
+    "custom_json": 8,
+}
+
+# relative frequencies of operations in account histories
+HISTORY_MIX = {
+    "vote": 50,
+    "curation_reward": 25,
+    "comment": 10,
+    "author_reward": 5,
+    "transfer": 10,
+}
+
+# rewards are paid out 7 days after a post is created
+PAYOUT_BLOCKS = 7 * 24 * 3600 // BLOCK_INTERVAL
+
+TAGS = ["life", "photography", "steem", "art", "travel", "bitcoin", "news",
+        "food", "music", "golos", "blockchain", "crypto", "story", "science"]
+
+
+def _mix(*values):
+    # splitmix64 over all values, a fast deterministic hash of integers
+    h = 0x9E3779B97F4A7C15
+    for value in values:
+        h = ((h ^ value) * 0xBF58476D1CE4E5B9) & MASK
+        h ^= h >> 31
+        h = (h * 0x94D049BB133111EB) & MASK
+        h ^= h >> 29
+    return h
+
+
+def _cumulative(mix):
+    names = sorted(mix)
+    total = 0
+    weights = []
+    for name in names:
+        total += mix[name]
+        weights.append(total)
+    return names, weights
+
+
+class _Names(object):
+    # lazy sorted sequence of account names for bisect
+    def __init__(self, chain):
+        self.chain = chain
+
+    def __len__(self):
+        return self.chain.accounts
+
+    def __getitem__(self, i):
+        return self.chain.account_name(i)
+
+
+class SyntheticChain(EmptyChain):
+    """
+    Deterministic synthetic chain. Every block, account, history item and
+    post is generated on request from the seed and its own number, so any
+    part of a chain of millions of blocks can be served in constant memory
+    and the same seed always yields the same data.
+
+    Activity follows a power law: accounts with low numbers vote, post and
+    get followed much more than others and have long histories. Histories
+    and posts returned by ``get_content`` are generated independently of
+    blocks and are not consistent with them.
+
+    It can be used as a source of :py:class:`megaphone.fakenode.FakeNode`
+    or written to disk with :py:func:`write_blocks`.
+    """
+    def __init__(self, seed=0, head_block=1000000, accounts=100000,
+                 ops_per_block=30, max_history=1000000, max_votes=5000,
+                 max_followers=50000, op_mix=None, history_mix=None,
+                 symbol="STEEM", genesis="2016-03-24T16:05:00"):
+        """
+        :param seed: random seed
+        :type seed: int
+        :param head_block: number of the last block
+        :param accounts: number of accounts
+        :param ops_per_block: mean number of operations in a block
+        :param max_history: history length of the most active account
+        :param max_votes: most votes of a post
+        :param max_followers: followers of the most followed account
+        :param op_mix: relative frequencies of block operations, see
+            ``OP_MIX``
+        :param history_mix: relative frequencies of history operations,
+            see ``HISTORY_MIX``
+        :param symbol: STEEM or GOLOS
+        :param genesis: time of block 0
+        """
+        super(SyntheticChain, self).__init__(head_block, symbol, genesis)
+        self.seed = seed
+        self.accounts = accounts
+        self.ops_per_block = ops_per_block
+        self.max_history = max_history
+        self.max_votes = max_votes
+        self.max_followers = min(max_followers, accounts - 1)
+        self.op_mix = dict(op_mix or OP_MIX)
+        self._op_mix = _cumulative(self.op_mix)
+        self._history_mix = _cumulative(history_mix or HISTORY_MIX)
+
+    # accounts
+
+    def account_name(self, i):
+        return "user%07d" % i
+
+    def account_index(self, name):
+        """
+        Return number of an account, None if it does not exist.
+        """
+        if name[:4] != "user" or not name[4:].isdigit():
+            return None
+        i = int(name[4:])
+        return i if i < self.accounts and name == self.account_name(i) else None
+
+    def _pick_account(self, rng):
+        # skewed towards low numbers, 1% of accounts do ~20% of everything
+        return self.account_name(int(self.accounts * rng.random() ** 3))
+
+    def _rng(self, *values):
+        return random.Random(_mix(self.seed, *values))
+
+    def history_length(self, i):
+        return max(1, int(self.max_history / (i + 1) ** 0.8))
+
+    def follower_count(self, i):
+        return int(self.max_followers / (i + 1) ** 0.7)
+
+    def _account(self, name):
+        i = self.account_index(name)
+        if i is None:
+            return None
+        rng = self._rng(2, i)
+        vests = int(1e12 * rng.random() / (i + 1) ** 0.9) + 1000000
+        return {
+            "id": i,
+            "name": name,
+            "reputation": str(int(1e12 * rng.random() / (i + 1) ** 0.5)),
+            "balance": "%.3f %s" % (vests / 1e9 * rng.random(), self.symbol),
+            "sbd_balance": "%.3f SBD" % (vests / 1e10 * rng.random()),
+            "vesting_shares": "%.6f VESTS" % (vests / 1e6),
+            "voting_power": rng.randint(5000, 10000),
+            "last_vote_time": self.block_time(rng.randrange(self.head_block)),
+            "post_count": self.history_length(i) // 10,
+            "created": self.block_time(i * self.head_block // self.accounts),
+        }
+
+    def get_accounts(self, names):
+        return [a for a in map(self._account, names) if a is not None]
+
+    def get_account(self, name):
+        return self._account(name)
+
+    def lookup_accounts(self, lower_bound, limit):
+        from bisect import bisect_left
+        # Blockchain.get_all_usernames starts from -1
+        if not isinstance(lower_bound, str):
+            lower_bound = ""
+        start = bisect_left(_Names(self), lower_bound)
+        return [self.account_name(i)
+                for i in range(start, min(start + limit, self.accounts))]
+
+    def _followers(self, i):
+        count = self.follower_count(i)
+        followers = set(_mix(self.seed, 3, i, k) % self.accounts
+                        for k in range(count))
+        followers.discard(i)
+        return sorted(followers)
+
+    def get_followers(self, account, start, follow_type, limit):
+        from bisect import bisect_left
+        i = self.account_index(account)
+        if i is None:
+            return []
+        followers = self._followers(i)
+        first = bisect_left(followers, self.account_index(start) or 0)
+        return [{"follower": self.account_name(f), "following": account,
+                 "what": [follow_type]}
+                for f in followers[first:first + limit]]
+
+    # blocks
+
+    def post_count(self, block_num):
+        """
+        Number of posts created in a block.
+        """
+        share = self.op_mix.get("comment", 0) / sum(self.op_mix.values())
+        mean = self.ops_per_block * share
+        return int(mean * 2 * random.Random(_mix(self.seed, 4, block_num)).random())
+
+    def post_author(self, block_num, i):
+        return self.account_name(
+            int(self.accounts * (_mix(self.seed, 5, block_num, i) / MASK) ** 3))
+
+    def _vote_target(self, rng, block_num):
+        # posts get most votes soon after creation
+        for _ in range(8):
+            age = int(rng.expovariate(1.0 / 1200))
+            target = block_num - 1 - age
+            if target < 1:
+                return None
+            count = self.post_count(target)
+            if count:
+                j = rng.randrange(count)
+                return self.post_author(target, j), "post-%d-%d" % (target, j)
+        return None
+
+    def block_operations(self, block_num):
+        """
+        Return operations of a block.
+
+        :rtype: list of [op_type, op] pairs
+        """
+        rng = self._rng(1, block_num)
+        names, weights = self._op_mix
+        ops = []
+        for j in range(self.post_count(block_num)):
+            author = self.post_author(block_num, j)
+            tags = rng.sample(TAGS, 3)
+            ops.append(["comment", {
+                "parent_author": "",
+                "parent_permlink": tags[0],
+                "author": author,
+                "permlink": "post-%d-%d" % (block_num, j),
+                "title": "Post %d of block %d" % (j, block_num),
+                "body": "x" * rng.randint(100, 5000),
+                "json_metadata": json.dumps({"tags": tags}),
+            }])
+        # posts are added above, the other operations fill up the block
+        count = int(rng.expovariate(1.0 / self.ops_per_block))
+        for _ in range(count):
+            op_type = names[_bisect(weights, rng.random() * weights[-1])]
+            if op_type == "comment":
+                continue
+            if op_type == "vote":
+                target = self._vote_target(rng, block_num)
+                if target is None:
+                    continue
+                ops.append(["vote", {
+                    "voter": self._pick_account(rng),
+                    "author": target[0],
+                    "permlink": target[1],
+                    "weight": rng.choice((10000, 10000, 5000, 2500, 100, -10000)),
+                }])
+            elif op_type == "transfer":
+                ops.append(["transfer", {
+                    "from": self._pick_account(rng),
+                    "to": self._pick_account(rng),
+                    "amount": "%.3f %s" % (rng.expovariate(0.1), self.symbol),
+                    "memo": "",
+                }])
+            elif op_type == "custom_json":
+                follower = self._pick_account(rng)
+                ops.append(["custom_json", {
+                    "required_auths": [],
+                    "required_posting_auths": [follower],
+                    "id": "follow",
+                    "json": json.dumps(["follow", {
+                        "follower": follower,
+                        "following": self._pick_account(rng),
+                        "what": ["blog"]}]),
+                }])
+        return ops
+
+    def virtual_operations(self, block_num):
+        """
+        Return virtual operations of a block: author and curation rewards
+        of the posts and votes of the block ``PAYOUT_BLOCKS`` earlier.
+
+        :rtype: list of [op_type, op] pairs
+        """
+        paid_block = block_num - PAYOUT_BLOCKS
+        if paid_block < 1:
+            return []
+        rng = self._rng(6, block_num)
+        ops = []
+        for op_type, op in self.block_operations(paid_block):
+            if op_type == "vote" and op["weight"] > 0:
+                ops.append(["curation_reward", {
+                    "curator": op["voter"],
+                    "reward": "%.6f VESTS" % rng.expovariate(0.01),
+                    "comment_author": op["author"],
+                    "comment_permlink": op["permlink"],
+                }])
+            elif op_type == "comment":
+                ops.append(["author_reward", {
+                    "author": op["author"],
+                    "permlink": op["permlink"],
+                    "sbd_payout": "%.3f SBD" % rng.expovariate(0.5),
+                    "steem_payout": "0.000 %s" % self.symbol,
+                    "vesting_payout": "%.6f VESTS" % rng.expovariate(0.001),
+                }])
+        return ops
+
+    def _trx_id(self, block_num, i):
+        return "%016x%016x%08x" % (_mix(self.seed, 7, block_num, i),
+                                   _mix(self.seed, 8, block_num, i),
+                                   block_num & 0xFFFFFFFF)
+
+    def get_block(self, block_num):
+        if not 0 < block_num <= self.head_block:
+            return None
+        timestamp = self.block_time(block_num)
+        expiration = self.block_time(block_num + 20)
+        ops = self.block_operations(block_num)
+        return {
+            "previous": "%08x%032x" % (block_num - 1,
+                                       _mix(self.seed, 9, block_num - 1)),
+            "timestamp": timestamp,
+            "witness": self.account_name(block_num % 21),
+            "transaction_merkle_root": "%040x" % _mix(self.seed, 10, block_num),
+            "extensions": [],
+            "witness_signature": "",
+            "transactions": [{
+                "ref_block_num": (block_num - 1) & 0xFFFF,
+                "ref_block_prefix": _mix(self.seed, 11, block_num) & 0xFFFFFFFF,
+                "expiration": expiration,
+                "operations": [op],
+                "extensions": [],
+                "signatures": [],
+            } for op in ops],
+            "transaction_ids": [self._trx_id(block_num, i)
+                                for i in range(len(ops))],
+        }
+
+    def get_ops_in_block(self, block_num, only_virtual=False):
+        if not 0 < block_num <= self.head_block:
+            return []
+        timestamp = self.block_time(block_num)
+        ops = []
+        if not only_virtual:
+            for i, op in enumerate(self.block_operations(block_num)):
+                ops.append({
+                    "trx_id": self._trx_id(block_num, i),
+                    "block": block_num,
+                    "trx_in_block": i,
+                    "op_in_trx": 0,
+                    "virtual_op": 0,
+                    "timestamp": timestamp,
+                    "op": op,
+                })
+        for i, op in enumerate(self.virtual_operations(block_num)):
+            ops.append({
+                "trx_id": "0" * 40,
+                "block": block_num,
+                "trx_in_block": len(ops),
+                "op_in_trx": i,
+                "virtual_op": i + 1,
+                "timestamp": timestamp,
+                "op": op,
+            })
+        return ops
+
+    # account history
+
+    def history_item(self, account_index, index):
+        """
+        Return item of an account history as returned by
+        get_account_history. Items are spread evenly over the whole chain.
+        """
+        rng = self._rng(12, account_index, index)
+        length = self.history_length(account_index)
+        block_num = max(1, int((index + rng.random()) * self.head_block / length))
+        name = self.account_name(account_index)
+        names, weights = self._history_mix
+        op_type = names[_bisect(weights, rng.random() * weights[-1])]
+        other = self._pick_account(rng)
+        permlink = "post-%d-%d" % (max(1, block_num - rng.randint(1, 1200)),
+                                   rng.randrange(4))
+        if op_type == "vote":
+            op = {"voter": name, "author": other, "permlink": permlink,
+                  "weight": 10000}
+        elif op_type == "curation_reward":
+            op = {"curator": name,
+                  "reward": "%.6f VESTS" % rng.expovariate(0.01),
+                  "comment_author": other, "comment_permlink": permlink}
+        elif op_type == "comment":
+            op = {"parent_author": "", "parent_permlink": rng.choice(TAGS),
+                  "author": name, "permlink": permlink, "title": permlink,
+                  "body": "", "json_metadata": "{}"}
+        elif op_type == "author_reward":
+            op = {"author": name, "permlink": permlink,
+                  "sbd_payout": "%.3f SBD" % rng.expovariate(0.5),
+                  "steem_payout": "0.000 %s" % self.symbol,
+                  "vesting_payout": "%.6f VESTS" % rng.expovariate(0.001)}
+        else:
+            op = {"from": other, "to": name,
+                  "amount": "%.3f %s" % (rng.expovariate(0.1), self.symbol),
+                  "memo": ""}
+        return [index, {
+            "trx_id": "%040x" % _mix(self.seed, 13, account_index, index),
+            "block": block_num,
+            "trx_in_block": 0,
+            "op_in_trx": 0,
+            "virtual_op": 0,
+            "timestamp": self.block_time(block_num),
+            "op": [op_type, op],
+        }]
+
+    def get_account_history(self, account, index, limit):
+        i = self.account_index(account)
+        if i is None:
+            return []
+        last = self.history_length(i) - 1
+        end = last if index < 0 else min(index, last)
+        begin = max(0, (last if index < 0 else index) - limit)
+        return [self.history_item(i, n) for n in range(begin, end + 1)]
+
+    # posts
+
+    def get_content(self, author, permlink):
+        seed = zlib.crc32(("%s/%s" % (author, permlink)).encode())
+        rng = self._rng(14, seed)
+        created_block = rng.randrange(1, self.head_block)
+        votes = int(self.max_votes * rng.random() ** 8)
+        active_votes = []
+        vote_rshares = 0
+        total_weight = 0
+        for k in range(votes):
+            rshares = int(rng.expovariate(1e-9))
+            weight = int(rshares ** 0.5)
+            vote_rshares += rshares
+            total_weight += weight
+            block_num = created_block + int(rng.expovariate(1.0 / 600))
+            active_votes.append({
+                "voter": self._pick_account(rng),
+                "weight": weight,
+                "rshares": str(rshares),
+                "percent": 10000,
+                "reputation": "0",
+                "time": self.block_time(block_num),
+            })
+        tags = rng.sample(TAGS, 3)
+        paid = created_block + PAYOUT_BLOCKS <= self.head_block
+        payout = vote_rshares / 1e12
+        created = self.block_time(created_block)
+        return {
+            "id": seed,
+            "author": author,
+            "permlink": permlink,
+            "category": tags[0],
+            "parent_author": "",
+            "parent_permlink": tags[0],
+            "title": permlink,
+            "body": "x" * rng.randint(100, 5000),
+            "json_metadata": json.dumps({"tags": tags}),
+            "created": created,
+            "last_update": created,
+            "active": created,
+            "cashout_time": self.block_time(created_block + PAYOUT_BLOCKS),
+            "depth": 0,
+            "children": rng.randint(0, votes // 10 + 1),
+            "net_rshares": str(0 if paid else vote_rshares),
+            "abs_rshares": str(vote_rshares),
+            "vote_rshares": str(vote_rshares),
+            "total_vote_weight": total_weight,
+            "reward_weight": 10000,
+            "total_payout_value": "%.3f SBD" % (payout if paid else 0),
+            "curator_payout_value": "%.3f SBD" % (payout / 4 if paid else 0),
+            "pending_payout_value": "%.3f SBD" % (0 if paid else payout),
+            "total_pending_payout_value": "%.3f SBD" % (0 if paid else payout),
+            "max_accepted_payout": "1000000.000 SBD",
+            "percent_steem_dollars": 10000,
+            "allow_votes": True,
+            "allow_curation_rewards": True,
+            "active_votes": active_votes,
+            "url": "/%s/@%s/%s" % (tags[0], author, permlink),
+            "root_title": permlink,
+            "replies": [],
+        }
+
+    def get_content_replies(self, author, permlink):
+        return []
+
+    def get_state(self, path):
+        state = super(SyntheticChain, self).get_state(path)
+        parts = path.strip("/").split("/")
+        if parts and parts[0].startswith("@"):
+            name = parts[0][1:]
+            account = self._account(name)
+            if account is not None:
+                posts = self.history_length(self.account_index(name)) // 10
+                account["blog"] = ["%s/blog-%d" % (name, k)
+                                   for k in range(posts - 1, max(-1, posts - 21), -1)]
+                state["accounts"][name] = account
+        return state
+
+
+def _bisect(weights, value):
+    from bisect import bisect_right
+    return bisect_right(weights, value)
+
+
+# block store files, one JSON line per block and a table of line offsets
+BLOCKS_FILE = "blocks.ndjson"
+INDEX_FILE = "blocks.idx"
+_OFFSET = struct.Struct("<Q")
+
+
+def write_blocks(source, path, start_block=1, end_block=None):
+    """
+    Stream blocks of a source to a block store directory, appending to an
+    existing store. Each line holds a block and its virtual operations.
+
+    :param source: e.g. :py:class:`SyntheticChain`
+    :param path: directory
+    :param start_block: first block, must follow the last stored block
+    :param end_block: last block, defaults to the head block
+    :return: number of the last stored block
+    :rtype: int
+    """
+    os.makedirs(path, exist_ok=True)
+    end_block = end_block or source.get_dynamic_global_properties()['head_block_number']
+    with open(os.path.join(path, BLOCKS_FILE), "ab") as blocks, \
+            open(os.path.join(path, INDEX_FILE), "ab") as index:
+        stored = index.tell() // _OFFSET.size
+        if start_block != stored + 1:
+            raise ValueError("Store at %s ends with block %d, cannot continue "
+                             "with block %d" % (path, stored, start_block))
+        offset = blocks.tell()
+        for block_num in range(start_block, end_block + 1):
+            line = json.dumps({
+                "block": source.get_block(block_num),
+                "virtual_ops": source.get_ops_in_block(block_num, True),
+            }, separators=(",", ":")).encode() + b"\n"
+            blocks.write(line)
+            index.write(_OFFSET.pack(offset))
+            offset += len(line)
+    return end_block
+
+
+class BlockStore(object):
+    """
+    Read blocks written by :py:func:`write_blocks` without loading the
+    store into memory. Calls other than block fetches are answered by
+    ``fallback``, so a store can be served by
+    :py:class:`megaphone.fakenode.FakeNode` directly.
+    """
+    def __init__(self, path, fallback=None):
+        """
+        :param path: block store directory
+        :param fallback: source answering other calls, defaults to
+            :py:class:`megaphone.fakenode.EmptyChain` ending at the last
+            stored block
+        """
+        self.path = path
+        self._blocks = open(os.path.join(path, BLOCKS_FILE), "rb")
+        self._index = open(os.path.join(path, INDEX_FILE), "rb")
+        self.head_block = os.fstat(self._index.fileno()).st_size // _OFFSET.size
+        self.fallback = fallback if fallback is not None else EmptyChain(self.head_block)
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return getattr(self.fallback, method)
+
+    def _record(self, block_num):
+        if not 0 < block_num <= self.head_block:
+            return None
+        self._index.seek((block_num - 1) * _OFFSET.size)
+        offset, = _OFFSET.unpack(self._index.read(_OFFSET.size))
+        self._blocks.seek(offset)
+        return json.loads(self._blocks.readline())
+
+    def get_dynamic_global_properties(self):
+        props = dict(self.fallback.get_dynamic_global_properties())
+        props["head_block_number"] = self.head_block
+        props["last_irreversible_block_num"] = self.head_block
+        return props
+
+    def get_block(self, block_num):
+        record = self._record(block_num)
+        return record["block"] if record else None
+
+    def get_ops_in_block(self, block_num, only_virtual=False):
+        record = self._record(block_num)
+        if record is None:
+            return []
+        ops = []
+        if not only_virtual:
+            block = record["block"]
+            for i, tx in enumerate(block["transactions"]):
+                for j, op in enumerate(tx["operations"]):
+                    ops.append({
+                        "trx_id": block.get("transaction_ids", [""] * (i + 1))[i],
+                        "block": block_num,
+                        "trx_in_block": i,
+                        "op_in_trx": j,
+                        "virtual_op": 0,
+                        "timestamp": block["timestamp"],
+                        "op": op,
+                    })
+        return ops + record["virtual_ops"]
+
+    def close(self):
+        self._blocks.close()
+        self._index.close()
@@ -0,0 +1,153 @@
+import bisect
+from array import array
+from collections import Counter
+from functools import reduce
+
+import numpy as np
+
+from megaphone.helpers import post_tags
+
+
+class TagIndex(object):
+    """
+    Inverted index from tags to posts. Tags and posts are interned to
+    integer ids and every tag keeps a sorted array of post ids, so tag
+    queries are merges of sorted arrays instead of scans over all posts.
+    """
+    def __init__(self):
+        self.tag_ids = {}
+        self.tag_names = []
+        self.post_ids = {}
+        self.identifiers = []
+        self._post_tags = []
+        self._postings = []
+
+    def __len__(self):
+        return len(self.identifiers)
+
+    def _tag_id(self, tag):
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            tag_id = self.tag_ids[tag] = len(self.tag_names)
+            self.tag_names.append(tag)
+            self._postings.append(array('q'))
+        return tag_id
+
+    def add(self, identifier, tags):
+        """
+        Index a post, or re-index it if its tags have changed.
+
+        :param identifier: post identifier e.g. @author/permlink
+        :type identifier: str
+        :param tags: post tags
+        :type tags: list of str
+        """
+        new_tags = frozenset(self._tag_id(t) for t in tags)
+        post_id = self.post_ids.get(identifier)
+        if post_id is None:
+            post_id = self.post_ids[identifier] = len(self.identifiers)
+            self.identifiers.append(identifier)
+            self._post_tags.append(new_tags)
+            old_tags = frozenset()
+        else:
+            old_tags = self._post_tags[post_id]
+            self._post_tags[post_id] = new_tags
+
+        for tag_id in old_tags - new_tags:
+            posting = self._postings[tag_id]
+            del posting[bisect.bisect_left(posting, post_id)]
+        for tag_id in new_tags - old_tags:
+            posting = self._postings[tag_id]
+            if not posting or posting[-1] < post_id:
+                posting.append(post_id)
+            else:
+                posting.insert(bisect.bisect_left(posting, post_id), post_id)
+
+    def add_post(self, post):
+        """
+        Index a post.
+
+        :param post: post or get_content result
+        :type post: :py:class:`megaphone.post.Post` or dict
+        """
+        self.add("@%s/%s" % (post["author"], post["permlink"]), post_tags(post))
+
+    def add_operation(self, operation):
+        """
+        Index a ``comment`` operation as produced by
+        :py:meth:`megaphone.blockchain.Blockchain.replay`. Other operations
+        are ignored.
+
+        :param operation: replay operation
+        :type operation: dict
+        """
+        if operation['op_type'] == 'comment':
+            self.add_post(operation['op'])
+
+    def posting(self, tag):
+        """
+        Return sorted post ids of a tag.
+
+        :param tag: tag
+        :type tag: str
+        :rtype: numpy.ndarray
+        """
+        tag_id = self.tag_ids.get(tag)
+        if tag_id is None:
+            return np.empty(0, dtype=np.int64)
+        # copy, a view would prevent the posting from growing
+        return np.array(self._postings[tag_id], dtype=np.int64)
+
+    def query_ids(self, any_of=(), all_of=(), none_of=()):
+        """
+        Return sorted ids of posts matching tag conditions.
+
+        :param any_of: posts having at least one of the tags
+        :param all_of: posts having all of the tags
+        :param none_of: posts having none of the tags
+        :rtype: numpy.ndarray
+        """
+        if all_of:
+            postings = sorted((self.posting(t) for t in all_of), key=len)
+            result = reduce(lambda a, b: np.intersect1d(a, b, assume_unique=True),
+                            postings)
+        else:
+            result = None
+        if any_of:
+            matching = np.unique(np.concatenate([self.posting(t) for t in any_of]))
+            result = matching if result is None else \
+                np.intersect1d(result, matching, assume_unique=True)
+        if result is None:
+            result = np.arange(len(self.identifiers), dtype=np.int64)
+        if none_of:
+            excluded = np.concatenate([self.posting(t) for t in none_of])
+            result = np.setdiff1d(result, excluded, assume_unique=True)
+        return result
+
+    def query(self, any_of=(), all_of=(), none_of=()):
+        """
+        Return identifiers of posts matching tag conditions, see
+        :py:meth:`query_ids`.
+
+        :rtype: list of str
+        """
+        return [self.identifiers[i]
+                for i in self.query_ids(any_of, all_of, none_of)]
+
+    def cooccurrence(self, tag):
+        """
+        Count tags appearing together with a tag.
+
+        :param tag: tag
+        :type tag: str
+        :return: number of posts per co-occurring tag
+        :rtype: collections.Counter
+        """
+        tag_id = self.tag_ids.get(tag)
+        counts = Counter()
+        if tag_id is None:
+            return counts
+        for post_id in self._postings[tag_id]:
+            counts.update(self._post_tags[post_id])
+        del counts[tag_id]
+        return Counter(dict((self.tag_names[t], c) for t, c in counts.items()))
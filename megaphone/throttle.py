@@ -0,0 +1,153 @@
+import threading
+import time
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter, allows ``rate`` requests per second on
+    average with bursts of up to ``burst`` requests.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Block until tokens are available and take them.
+
+        :param tokens: number of tokens
+        :type tokens: int
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter(object):
+    """
+    Concurrency limit adjusted by AIMD: the limit grows by one request per
+    window of successful fast requests and is cut by ``backoff`` on errors
+    or latency above ``target_latency``, at most once per ``cooldown``
+    seconds. It starts at the default number of pool connections per
+    endpoint and grows while the node keeps up.
+    """
+    def __init__(self, initial=2, minimum=1, maximum=64, target_latency=1.0,
+                 backoff=0.5, cooldown=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Block until a request may be sent.
+        """
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, latency=None, error=False):
+        """
+        Report a finished request.
+
+        :param latency: request latency in seconds
+        :type latency: float
+        :param error: request failed
+        :type error: bool
+        """
+        with self._cond:
+            self.in_flight -= 1
+            congested = error or (latency is not None and
+                                  latency > self.target_latency)
+            now = time.monotonic()
+            if congested:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.backoff)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class Throttle(object):
+    """
+    Rate limit and adaptive concurrency limit of one endpoint.
+    """
+    def __init__(self, rate=None, burst=None, **kwargs):
+        """
+        :param rate: maximum requests per second, unlimited if None
+        :param burst: maximum burst of requests
+        :param kwargs: arguments for :py:class:`AdaptiveLimiter`
+        """
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.limiter = AdaptiveLimiter(**kwargs)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func once the rate and concurrency limits allow it.
+        """
+        if self.bucket is not None:
+            self.bucket.acquire()
+        self.limiter.acquire()
+        start = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.limiter.release(error=True)
+            raise
+        self.limiter.release(latency=time.time() - start)
+        return result
+
+
+class ThrottledRPC(object):
+    """
+    Rpc wrapper passing every call through a :py:class:`Throttle`.
+    """
+    def __init__(self, rpc, throttle):
+        self._rpc = rpc
+        self._throttle = throttle
+
+    def __getattr__(self, method):
+        func = getattr(self._rpc, method)
+
+        def call(*args, **kwargs):
+            return self._throttle.call(func, *args, **kwargs)
+        call.__name__ = method
+        return call
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def for_endpoint(url, **kwargs):
+    """
+    Return the throttle shared by all users of an endpoint, created with
+    kwargs on first use.
+
+    :param url: node url
+    :type url: str
+    :rtype: :py:class:`Throttle`
+    """
+    with _throttles_lock:
+        throttle = _throttles.get(url)
+        if throttle is None:
+            throttle = _throttles[url] = Throttle(**kwargs)
+        return throttle
@@ -1,6 +1,4 @@
 from decimal import Decimal
-import grequests
-import numpy as np
 
 
 class TickerError(RuntimeError):
@@ -82,6 +80,10 @@ class Ticker(object):
         :return: VWAP price
         :rtype float
         """
+        # grequests monkey-patches with gevent, import it only when needed
+        import grequests
+        import numpy as np
+
         prices = {}
         urls = dict((k, v % Ticker.get_ticker_symbol(pair, k))
                     for k, v in Ticker.URLS.items())
@@ -140,6 +142,8 @@ class Gold(object):
         :return: XAU OZ price in USD, 0.0 if incorrect response
         :rtype float
         """
+        import grequests
+
         rs = grequests.get(Gold.URL, timeout=2)
         response = grequests.map([rs], exception_handler=lambda x, y: "")[0]
         if hasattr(response, "status_code") and response.status_code == 200:
@@ -0,0 +1,224 @@
+import time
+
+from megaphone.helpers import parse_payout, parse_timestamp
+from megaphone.node import Node
+from megaphone.pool import close_connection
+from megaphone.post import PostError, fetch_concurrently, resolve_identifier
+
+
+class PostWatcher(object):
+    """
+    Track posts inside their payout window and report only what changed.
+
+    Every change is reported as a delta dictionary with ``type`` and
+    ``identifier`` keys:
+        vote: new voter, ``rshares`` is None until the post is refreshed,
+        vote_rshares: rshares of a vote with known rshares changed,
+        rshares: net rshares of the post changed,
+        payout: pending payout of the post changed,
+        closed: payout window is over, the post is no longer tracked,
+        error: the post could not be fetched.
+    """
+    def __init__(self, chaind=None, batch_size=100, concurrency=1,
+                 chain_factory=None):
+        """
+        :param chaind: Blockchain node instance (steemd/golosd)
+        :param batch_size: number of posts fetched per batch
+        :type batch_size: int
+        :param concurrency: number of parallel connections per batch
+        :type concurrency: int
+        :param chain_factory: callable returning a new chain instance for
+            every worker, defaults to Node().connect_throttled. Worker
+            connections are kept between refreshes until :py:meth:`close`.
+        """
+        if not chaind:
+            chaind = Node().default()
+        self.chaind = chaind
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.chain_factory = chain_factory
+        self._state = {}
+        self._keys = {}
+        self._dirty = set()
+        self._connections = []
+
+    def __len__(self):
+        return len(self._state)
+
+    def __contains__(self, identifier):
+        return self._normalize(identifier)[0] in self._state
+
+    @staticmethod
+    def _normalize(identifier):
+        # "a/b" and "@a/b" are the same post
+        key = resolve_identifier(identifier)
+        return "@%s/%s" % key, key
+
+    def watch(self, identifiers):
+        """
+        Start tracking posts. They are fetched on the next refresh.
+
+        :param identifiers: post identifiers e.g. @author/permlink
+        :type identifiers: list of str
+        """
+        for identifier in identifiers:
+            identifier, key = self._normalize(identifier)
+            if identifier not in self._state:
+                self._state[identifier] = None
+                self._keys[key] = identifier
+                self._dirty.add(identifier)
+
+    def unwatch(self, identifier):
+        """
+        Stop tracking a post.
+
+        :param identifier: post identifier
+        :type identifier: str
+        """
+        identifier, key = self._normalize(identifier)
+        self._state.pop(identifier, None)
+        self._keys.pop(key, None)
+        self._dirty.discard(identifier)
+
+    def get_state(self, identifier):
+        """
+        Return last seen state of a post: ``votes`` mapping voters to
+        rshares, ``rshares``, ``payout`` and ``cashout_time``.
+
+        :param identifier: post identifier
+        :type identifier: str
+        :rtype: dict
+        """
+        return self._state[self._normalize(identifier)[0]]
+
+    def apply_operation(self, operation):
+        """
+        Update state from a ``vote`` operation as produced by
+        :py:meth:`megaphone.blockchain.Blockchain.stream`. The post is
+        marked to be fetched on the next refresh.
+
+        :param operation: replay operation
+        :type operation: dict
+        :return: deltas
+        :rtype: list of dict
+        """
+        if operation['op_type'] != 'vote':
+            return []
+        op = operation['op']
+        identifier = self._keys.get((op['author'], op['permlink']))
+        if identifier is None:
+            return []
+        self._dirty.add(identifier)
+        state = self._state[identifier]
+        if state is None or op['voter'] in state['votes']:
+            return []
+        state['votes'][op['voter']] = None
+        return [{
+            "type": "vote",
+            "identifier": identifier,
+            "voter": op['voter'],
+            "weight": op['weight'],
+            "rshares": None,
+            "timestamp": operation['timestamp'],
+        }]
+
+    def refresh(self, dirty_only=False):
+        """
+        Fetch tracked posts in batches and diff them against the last seen
+        state.
+
+        :param dirty_only: fetch only posts new to the watcher or touched by
+            a vote operation since the last refresh
+        :type dirty_only: bool
+        :return: deltas
+        :rtype: list of dict
+        """
+        identifiers = list(self._dirty if dirty_only else self._state)
+        self._dirty.difference_update(identifiers)
+        deltas = []
+        for i in range(0, len(identifiers), self.batch_size):
+            batch = identifiers[i:i + self.batch_size]
+            calls = [("get_content", resolve_identifier(x)) for x in batch]
+            results = fetch_concurrently(self.chaind, calls, self.concurrency,
+                                         self.chain_factory, self._connections)
+            for identifier, content in zip(batch, results):
+                if identifier not in self._state:
+                    continue
+                if isinstance(content, Exception) or not content.get("author"):
+                    self._dirty.add(identifier)
+                    deltas.append({
+                        "type": "error",
+                        "identifier": identifier,
+                        "error": PostError("Failed to load %s: %s"
+                                           % (identifier, content)),
+                    })
+                    continue
+                deltas.extend(self._update(identifier, content))
+        return deltas
+
+    def _update(self, identifier, content):
+        old = self._state[identifier]
+        new = {
+            "votes": dict((v['voter'], int(v['rshares']))
+                          for v in content['active_votes']),
+            "rshares": int(content['net_rshares']),
+            "payout": parse_payout(content.get('pending_payout_value') or
+                                   content['total_payout_reward']),
+            "cashout_time": content['cashout_time'],
+        }
+        self._state[identifier] = new
+
+        deltas = []
+        if parse_timestamp(new['cashout_time']) < time.time():
+            self.unwatch(identifier)
+            deltas.append({"type": "closed", "identifier": identifier,
+                           "payout": new['payout']})
+        if old is None:
+            return deltas
+
+        for voter, rshares in new['votes'].items():
+            if voter not in old['votes']:
+                deltas.append({"type": "vote", "identifier": identifier,
+                               "voter": voter, "rshares": rshares})
+            elif old['votes'][voter] is not None and \
+                    old['votes'][voter] != rshares:
+                # None marks a vote seen in an operation, not yet fetched
+                deltas.append({"type": "vote_rshares",
+                               "identifier": identifier, "voter": voter,
+                               "old": old['votes'][voter], "new": rshares})
+        for key in ("rshares", "payout"):
+            if old[key] != new[key]:
+                deltas.append({"type": key, "identifier": identifier,
+                               "old": old[key], "new": new[key]})
+        return deltas
+
+    def follow(self, blockchain, refresh_interval=30, **kwargs):
+        """
+        Follow vote operations on a live stream and refresh posts that
+        received votes every refresh_interval seconds.
+
+        :param blockchain: blockchain to stream operations from
+        :type blockchain: :py:class:`megaphone.blockchain.Blockchain`
+        :param refresh_interval: seconds between refreshes
+        :type refresh_interval: int
+        :param kwargs: arguments for the stream
+        :return: yield deltas
+        :rtype: dict
+        """
+        for delta in self.refresh():
+            yield delta
+        last_refresh = time.time()
+        for operation in blockchain.stream(filter_by="vote", **kwargs):
+            for delta in self.apply_operation(operation):
+                yield delta
+            if time.time() - last_refresh >= refresh_interval:
+                for delta in self.refresh(dirty_only=True):
+                    yield delta
+                last_refresh = time.time()
+
+    def close(self):
+        """
+        Close the worker connections kept between refreshes.
+        """
+        while self._connections:
+            close_connection(self._connections.pop())
@@ -24,10 +24,12 @@ setup(
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: MIT License',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.7',
     ],
     keywords=['steem', 'golos'],
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
+    python_requires='>=3.7',
 
     # Alternatively, if you want to distribute just a my_module.py, uncomment
     # this:
@@ -39,7 +41,7 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
         'steem-piston', 'python-dateutil', 'numpy', 'requests', 'grequests',
-        'werkzeug', 'funcy',
+        'werkzeug',
     ],
     # List additional groups of dependencies here (e.g. development
     # dependencies). You can install these using the following syntax,
@@ -47,7 +49,9 @@ setup(
     # $ pip install -e .[dev,test]
     extras_require={
         'dev': ['check-manifest', 'pymongo', 'matplotlib', 'pandas'],
-        'test': ['coverage'],
+        'test': ['coverage', 'pytest'],
+        'fast': ['orjson'],
+        'async': ['websockets'],
     },
 
     # If there are data files included in your packages that need to be
@@ -66,9 +70,9 @@ setup(
     # To provide executable scripts, use entry points in preference to the
     # "scripts" keyword. Entry points provide cross-platform support and allow
     # pip to create the appropriate form of executable for the target platform.
-    # entry_points={
-    #     'console_scripts': [
-    #         'sample=sample:main',
-    #     ],
-    # },
+    entry_points={
+        'console_scripts': [
+            'megaphone=megaphone.cli:main',
+        ],
+    },
 )
@@ -0,0 +1,106 @@
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from megaphone.aggregate import (AggregateError, Aggregator, CountBy,
+                                 CountMinSketch, HyperLogLog, TopK)
+from megaphone.blockchain import Blockchain
+from megaphone.synthetic import SyntheticChain
+
+
+def zipf_stream(n, keys=10000, seed=0):
+    rng = random.Random(seed)
+    return ["key%d" % int(keys ** rng.random()) for _ in range(n)]
+
+
+@pytest.mark.parametrize("distinct", [10, 1000, 100000])
+def test_hyperloglog_error(distinct):
+    sketch = HyperLogLog()
+    for i in range(distinct):
+        sketch.add("account%d" % i)
+        # repeated keys do not change the estimate
+        sketch.add("account%d" % i)
+    # 1.6% standard error, the bound is three of them
+    assert abs(sketch.count() - distinct) <= max(1, 0.05 * distinct)
+
+
+def test_hyperloglog_merge_is_union():
+    left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(20000):
+        (left if i % 3 else right).add(i)
+        union.add(i)
+    left.merge(right)
+    assert left.registers == union.registers
+    with pytest.raises(AggregateError):
+        left.merge(HyperLogLog(precision=10))
+
+
+def test_count_min_error():
+    stream = zipf_stream(100000)
+    sketch = CountMinSketch()
+    for key in stream:
+        sketch.add(key)
+    exact = Counter(stream)
+    bound = 2.0 * len(stream) / sketch.width
+    errors = [sketch.estimate(key) - count for key, count in exact.items()]
+    assert min(errors) >= 0
+    # each estimate is within the bound with probability 1 - 0.5 ** depth
+    assert sum(e > bound for e in errors) <= len(errors) * 0.5 ** sketch.depth
+    assert sketch.result() == len(stream)
+
+
+def test_count_min_merge():
+    stream = zipf_stream(20000)
+    left, right, whole = CountMinSketch(), CountMinSketch(), CountMinSketch()
+    for i, key in enumerate(stream):
+        (left if i % 2 else right).add(key, 3)
+        whole.add(key, 3)
+    left.merge(right)
+    assert left.rows == whole.rows
+    with pytest.raises(AggregateError):
+        left.merge(CountMinSketch(width=1024))
+
+
+def test_top_k_finds_heavy_hitters():
+    stream = zipf_stream(100000)
+    top = TopK(k=10)
+    for key in stream:
+        top.add(key)
+    exact = Counter(stream)
+    result = top.result()
+    assert [key for key, _ in result] == [key for key, _ in exact.most_common(10)]
+    bound = 2.0 * len(stream) / top.sketch.width
+    for key, estimate in result:
+        assert exact[key] <= estimate <= exact[key] + bound
+
+
+def test_top_k_merge():
+    stream = zipf_stream(50000)
+    left, right = TopK(k=5), TopK(k=5)
+    for i, key in enumerate(stream):
+        (left if i % 2 else right).add(key)
+    left.merge(right)
+    assert [key for key, _ in left.result()] == \
+        [key for key, _ in Counter(stream).most_common(5)]
+
+
+def test_sliding_windows_of_synthetic_votes():
+    source = SyntheticChain(seed=2, head_block=400)
+    blockchain = Blockchain(SimpleNamespace(rpc=source))
+    operations = list(blockchain.replay(1, 300, filter_by="vote"))
+    aggregator = Aggregator()
+    aggregator.add_metric("votes", CountBy, 300, step=60,
+                          key=lambda op: op["voter"])
+    aggregator.add_metric("voters", HyperLogLog, 300, step=60,
+                          key=lambda op: op["voter"])
+    windows = list(aggregator.consume(operations))
+    votes = [w for w in windows if w.metric == "votes"]
+    voters = [w for w in windows if w.metric == "voters"]
+    assert [w.end for w in votes] == [w.end for w in voters]
+    for counts, distinct in zip(votes, voters):
+        exact = Counter(o["op"]["voter"] for o in operations
+                        if counts.start <= aggregator._timestamp(o["timestamp"]) < counts.end)
+        assert counts.value == dict(exact)
+        assert abs(distinct.value - len(exact)) <= max(1, 0.05 * len(exact))
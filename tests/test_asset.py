@@ -0,0 +1,36 @@
+import pytest
+
+from megaphone.asset import Asset, AssetError, parse_assets
+from megaphone.helpers import read_asset
+
+
+def test_from_string():
+    assert Asset.from_string("1.5 STEEM") == Asset(1500, "STEEM", 3)
+    assert str(Asset.from_string("0.000001 VESTS")) == "0.000001 VESTS"
+    assert str(Asset.from_string("3.25GBG")) == "3.250 GBG"
+    with pytest.raises(AssetError):
+        Asset.from_string("1.0001 STEEM")
+
+
+def test_arithmetic():
+    total = Asset.from_string("1.000 STEEM") + Asset.from_string("2.5 STEEM")
+    assert str(total) == "3.500 STEEM"
+    with pytest.raises(AssetError):
+        Asset.from_string("1.000 STEEM") + Asset.from_string("1.000 SBD")
+    # precision of unknown symbols is inferred from each string
+    with pytest.raises(AssetError):
+        Asset.from_string("1.0 FOO") + Asset.from_string("2.00 FOO")
+
+
+def test_parse_assets():
+    amounts, codes = parse_assets(["1.000 STEEM", "2.000000 VESTS"])
+    assert amounts.tolist() == [1000, 2000000]
+    assert codes.tolist() == [0, 2]
+    with pytest.raises(AssetError):
+        parse_assets(["1.0 FOO"])
+
+
+def test_read_asset():
+    assert read_asset("1.000 STEEM") == {"value": 1.0, "symbol": "STEEM"}
+    assert read_asset(".5 SBD") == {"value": 0.5, "symbol": "SBD"}
+    assert read_asset("3.25GBG") == {"value": 3.25, "symbol": "GBG"}
@@ -0,0 +1,82 @@
+import json
+
+import pytest
+
+from megaphone.blockchain import Blockchain
+from megaphone.cli import main
+from megaphone.fakenode import FakeNode
+from megaphone.synthetic import SyntheticChain
+
+pytest.importorskip("piston")
+pytest.importorskip("websockets")
+
+HEAD_BLOCK = 1000
+
+
+@pytest.fixture
+def node():
+    with FakeNode(source=SyntheticChain(seed=1, head_block=HEAD_BLOCK)) as fake:
+        yield fake.url
+
+
+def expected_operations(start, end):
+    source = SyntheticChain(seed=1, head_block=HEAD_BLOCK)
+    return [operation for block_num in range(start, end)
+            for operation in Blockchain.parse_block(source.get_block(block_num),
+                                                    block_num)]
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_replay_with_progress(node, tmp_path, capsys):
+    output = str(tmp_path / "ops.ndjson")
+    assert main(["replay", "--node", node, "--start", "1", "--end", "30",
+                 "--progress-interval", "0", "-o", output]) == 0
+    assert read_lines(output) == expected_operations(1, 30)
+    stderr = capsys.readouterr().err
+    assert "ops/s" in stderr
+    assert "error" not in stderr
+
+
+def test_replay_resumes_from_checkpoint(node, tmp_path):
+    output = str(tmp_path / "ops.ndjson")
+    checkpoint = str(tmp_path / "ops.ckpt")
+    args = ["replay", "--node", node, "--start", "1", "-q", "-j", "2",
+            "-o", output, "--checkpoint", checkpoint,
+            "--checkpoint-interval", "0"]
+    assert main(args + ["--end", "20"]) == 0
+    assert main(args + ["--end", "40"]) == 0
+    assert read_lines(output) == expected_operations(1, 40)
+
+
+def decoded(export, op_type):
+    kinds = export.columns(op_type)
+    columns = {}
+    for name, values in export.read(op_type).items():
+        if kinds.get(name) == "account":
+            values = export.account_names(values)
+        elif name.endswith(".symbol"):
+            values = export.symbols(values)
+        columns[name] = list(values)
+    return columns
+
+
+def test_chunks_resume_equals_full_export(node, tmp_path):
+    from megaphone.export import Export
+
+    def export(path, ends):
+        args = ["replay", "--node", node, "--start", "1", "-q",
+                "--format", "chunks", "--chunk-size", "50", "-o", path,
+                "--checkpoint", path + ".ckpt", "--checkpoint-interval", "0"]
+        for end in ends:
+            assert main(args + ["--end", str(end)]) == 0
+        return Export(path)
+
+    full = export(str(tmp_path / "full"), [60])
+    resumed = export(str(tmp_path / "resumed"), [25, 45, 60])
+    assert full.op_types == resumed.op_types
+    for op_type in full.op_types:
+        assert decoded(full, op_type) == decoded(resumed, op_type)
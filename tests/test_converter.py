@@ -0,0 +1,85 @@
+import pytest
+
+from megaphone.converter import ConverterError, ConverterSeries, \
+    HistoricalConverter
+
+SHARES = 10 ** 30 + 7
+
+
+def feed(block_num, publisher, base):
+    return {"block_id": block_num, "op_type": "feed_publish", "timestamp": "",
+            "op": {"publisher": publisher,
+                   "exchange_rate": {"base": "%.3f SBD" % base,
+                                     "quote": "1.000 STEEM"}}}
+
+
+@pytest.fixture
+def series():
+    operations = [feed(b, "w%d" % (b % 3), 1 + b / 10000.0)
+                  for b in range(1000, 20000, 300)]
+    return ConverterSeries.from_history(
+        operations,
+        reward_funds=[(1500, "1000.000 STEEM", str(SHARES)),
+                      (9000, 2000.0, SHARES + 1)],
+        vesting=[(1000, "100.000 STEEM", "1000000.000000 VESTS"),
+                 (21000, "300.000 STEEM", "2000000.000000 VESTS")])
+
+
+def test_feed_median_is_a_step_function(series):
+    blocks = series.blocks["currency_median_price"]
+    for start, end in zip(blocks, blocks[1:]):
+        value = series.value("currency_median_price", start)
+        assert series.value("currency_median_price", end - 1) == value
+        assert series.value("currency_median_price", end) != value
+    # known until the last replayed operation
+    assert series.end["currency_median_price"] == 19900
+    series.value("currency_median_price", 19900)
+
+
+def test_vesting_is_interpolated(series):
+    assert series.value("total_vesting_fund_steem", 11000) == 200.0
+    assert series.value("total_vesting_shares", 11000) == 1500000.0
+
+
+def test_reward_shares_stay_exact(series):
+    assert series.value("total_reward_shares2", 8999) == SHARES
+    assert series.value("total_reward_shares2", 9000) == SHARES + 1
+
+
+def test_blocks_outside_of_the_samples(series):
+    with pytest.raises(ConverterError):
+        series.value("currency_median_price", 100)
+    with pytest.raises(ConverterError):
+        series.value("total_vesting_shares", 30000)
+    assert series.value("total_vesting_shares", 30000, clamp=True) == 2000000.0
+    with pytest.raises(ConverterError):
+        HistoricalConverter(series, 500)
+    assert HistoricalConverter(series, 500, clamp=True).vests_to_power(1e6) == 100.0
+
+
+def test_historical_converter(series):
+    converter = HistoricalConverter(series, 9000)
+    assert converter.token_per_mvests() == pytest.approx(180.0 / 1.4)
+    assert converter.reward_fund() == (2000.0, SHARES + 1)
+    assert converter.currency_median_price() == \
+        series.value("currency_median_price", 9000)
+    # the reward fund history ends at block 9000
+    with pytest.raises(ConverterError):
+        HistoricalConverter(series, 11000).reward_fund()
+
+
+def test_series_without_vesting_is_rejected():
+    series = ConverterSeries()
+    series.add(5, currency_median_price=1.0)
+    with pytest.raises(ConverterError):
+        HistoricalConverter(series, 5)
+
+
+def test_save_and_load(series, tmp_path):
+    path = str(tmp_path / "series.npz")
+    series.save(path)
+    loaded = ConverterSeries.load(path)
+    assert loaded.blocks == series.blocks
+    assert loaded.values == series.values
+    assert loaded.end == series.end
+    assert type(loaded.values["total_reward_shares2"][0]) is int
@@ -0,0 +1,152 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from megaphone.asset import PRECISIONS, Asset
+from megaphone.blockchain import Blockchain
+from megaphone.export import ChunkWriter, Export, ExportError
+from megaphone.helpers import parse_timestamp
+from megaphone.synthetic import SyntheticChain
+
+
+def synthetic_operations(start=1, end=120):
+    source = SyntheticChain(seed=3, head_block=end + 10)
+    blockchain = Blockchain(SimpleNamespace(rpc=source))
+    return list(blockchain.replay(start, end, virtual=True))
+
+
+def rows(export, op_type, **kwargs):
+    """
+    Operations of a type decoded from the columns of an export.
+    """
+    kinds = export.columns(op_type)
+    columns = export.read(op_type, **kwargs)
+    values = {}
+    for field, kind in kinds.items():
+        column = columns[field]
+        if kind == "account":
+            column = export.account_names(column).tolist()
+        elif kind == "asset":
+            column = [str(Asset(int(amount), symbol, PRECISIONS[symbol]))
+                      if symbol else None
+                      for amount, symbol in zip(column.tolist(),
+                                                export.symbols(columns[field + ".symbol"]))]
+        elif kind in ("int", "float"):
+            column = column.tolist()
+        if field + ".null" in columns:
+            column = [None if null else value for value, null
+                      in zip(column, columns[field + ".null"])]
+        values[field] = column
+    return [dict((field, column[i]) for field, column in values.items())
+            for i in range(len(values["block_id"]))]
+
+
+def expected_rows(operations, op_type, start_block=None, end_block=None):
+    expected = []
+    for operation in operations:
+        block_id = operation["block_id"]
+        if operation["op_type"] != op_type or \
+                start_block is not None and block_id < start_block or \
+                end_block is not None and block_id > end_block:
+            continue
+        row = dict(operation["op"])
+        row.update(block_id=block_id,
+                   timestamp=int(parse_timestamp(operation["timestamp"])))
+        expected.append(row)
+    return expected
+
+
+def complete(rows, fields):
+    return [dict((f, row.get(f)) for f in fields) for row in rows]
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(tmp_path, compress):
+    operations = synthetic_operations()
+    path = str(tmp_path / "export")
+    with ChunkWriter(path, chunk_size=100, compress=compress) as writer:
+        assert writer.write(operations) == len(operations)
+
+    export = Export(path)
+    assert export.op_types == sorted(set(o["op_type"] for o in operations))
+    for entry in export.manifest["chunks"]:
+        assert entry["compressed"] == compress
+        assert entry["path"].endswith(".npz") == compress
+    for op_type in export.op_types:
+        fields = export.columns(op_type)
+        assert rows(export, op_type) == \
+            complete(expected_rows(operations, op_type), fields)
+
+
+def test_block_range(tmp_path):
+    operations = synthetic_operations()
+    path = str(tmp_path / "export")
+    with ChunkWriter(path, chunk_size=50) as writer:
+        writer.write(operations)
+
+    export = Export(path)
+    fields = export.columns("vote")
+    assert rows(export, "vote", start_block=30, end_block=60) == \
+        complete(expected_rows(operations, "vote", 30, 60), fields)
+
+
+def test_append_mixes_compressed_and_npy_chunks(tmp_path):
+    operations = synthetic_operations()
+    path = str(tmp_path / "export")
+    half = len(operations) // 2
+    with ChunkWriter(path, chunk_size=100) as writer:
+        writer.write(operations[:half])
+    with ChunkWriter(path, chunk_size=100, compress=True) as writer:
+        assert writer.last_block == operations[half - 1]["block_id"]
+        writer.write(operations[half:])
+
+    export = Export(path)
+    assert set(e["compressed"] for e in export.manifest["chunks"]) == {False, True}
+    for op_type in export.op_types:
+        fields = export.columns(op_type)
+        assert rows(export, op_type) == \
+            complete(expected_rows(operations, op_type), fields)
+
+
+def operation(block_id, op):
+    return {"op_type": "custom", "block_id": block_id,
+            "timestamp": "2017-01-01T00:00:%02d" % block_id, "op": op}
+
+
+def test_null_masks(tmp_path):
+    path = str(tmp_path / "export")
+    with ChunkWriter(path, chunk_size=2) as writer:
+        writer.write([
+            operation(1, {"from": "alice", "amount": "1.000 STEEM", "n": 1,
+                          "json": [1, 2]}),
+            operation(2, {"from": "bob", "memo": "hi"}),
+            # the second chunk has none of the fields of the first
+            operation(3, {"to": "carol"}),
+            operation(4, {"to": "dave", "n": 2}),
+        ])
+
+    export = Export(path)
+    columns = export.read("custom")
+    assert export.account_names(columns["from"]).tolist() == \
+        ["alice", "bob", "", ""]
+    assert columns["from.null"].tolist() == [False, False, True, True]
+    assert columns["amount"].tolist() == [1000, 0, 0, 0]
+    assert export.symbols(columns["amount.symbol"]).tolist() == ["STEEM", "", "", ""]
+    assert columns["n"].tolist() == [1, 0, 0, 2]
+    assert columns["n.null"].tolist() == [False, True, True, False]
+    assert columns["memo"] == [None, "hi", None, None]
+    assert columns["json"][:2] == [[1, 2], None]
+
+    with open(str(tmp_path / "export" / "manifest.json")) as f:
+        manifest = json.load(f)
+    assert manifest["kinds"]["custom"]["amount"] == "asset"
+    assert [c["rows"] for c in manifest["chunks"]] == [2, 2]
+
+
+def test_kind_is_fixed_by_first_chunk(tmp_path):
+    path = str(tmp_path / "export")
+    with pytest.raises(ExportError):
+        with ChunkWriter(path, chunk_size=1) as writer:
+            writer.add(operation(1, {"n": 1}))
+            writer.add(operation(2, {"n": "one"}))
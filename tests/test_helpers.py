@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from megaphone.helpers import read_json_fields
+
+
+def json_loads_fields(json_string, fields):
+    # what selecting the fields of Post.meta returns
+    try:
+        document = json.loads(json_string)
+    except ValueError:
+        return {}
+    return dict((f, document[f]) for f in fields if f in document)
+
+
+@pytest.mark.parametrize("json_string", [
+    '{"tags": ["steem", "photo"], "app": "steemit/0.1"}',
+    ' {"app": "steemit/0.1",\n "tags": ["steem"]}\n ',
+    '{"tags": ["steem"], "app": "steemit/0.1"} trailing',
+    '{"tags": ["steem"], "app": "steemit/0.1"}}x',
+    '{"tags": ["steem"], "app": "steemit/0.1"} x}',
+    '{"tags": ["{"], "app": "steemit/0.1"}',
+    '{"tags": ["steem"], "app": "steemit/0.1"} {"tags": []}x',
+    '{"links": {"app": "nested"}, "tags": ["steem"]}',
+    '{"tags": ["steem"], "app": }',
+    '',
+])
+def test_read_json_fields_agrees_with_json_loads(json_string):
+    fields = ["tags", "app"]
+    assert read_json_fields(json_string, fields) == \
+        json_loads_fields(json_string, fields)
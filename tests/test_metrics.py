@@ -0,0 +1,47 @@
+from megaphone.metrics import Registry, instrument
+from megaphone.pool import ConnectionPool
+from megaphone.rpc import coalesce
+from megaphone.throttle import Throttle, ThrottledRPC
+
+
+class FakeRPC(object):
+    # like the piston websocket rpc, any attribute is an rpc call
+    def __getattr__(self, method):
+        def call(*args):
+            return {"method": method, "params": list(args)}
+        return call
+
+
+class FakeChain(object):
+    def __init__(self, url=None):
+        self.rpc = FakeRPC()
+
+
+def throttled_chain():
+    chaind = FakeChain()
+    chaind.rpc = ThrottledRPC(chaind.rpc, Throttle())
+    return chaind
+
+
+def pooled_chain():
+    return ConnectionPool(["ws://a", "ws://b"], chain_factory=FakeChain,
+                          health_interval=0)
+
+
+def test_snapshot_of_instrumented_chains():
+    for chaind in (FakeChain(), throttled_chain(), pooled_chain()):
+        registry = Registry()
+        instrument(chaind, registry=registry)
+        chaind.rpc.get_config()
+        snapshot = registry.snapshot()
+        assert snapshot["rpc"]["get_config"]["calls"] == 1
+        assert snapshot["caches"] == {}
+
+
+def test_coalescing_rpc_cache_is_registered():
+    registry = Registry()
+    chaind = instrument(coalesce(FakeChain()), registry=registry)
+    chaind.rpc.get_config()
+    chaind.rpc.get_config()
+    cache = registry.snapshot()["caches"]["coalescing_rpc"]
+    assert (cache["hits"], cache["misses"]) == (1, 1)
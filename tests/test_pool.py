@@ -0,0 +1,52 @@
+import socket
+import time
+
+import pytest
+
+from megaphone.fakenode import EmptyChain, FakeNode
+from megaphone.pool import ConnectionPool
+
+pytest.importorskip("piston")
+pytest.importorskip("websockets")
+
+
+def test_failover_when_a_node_dies():
+    nodes = dict((node.url, node) for node in
+                 (FakeNode(source=EmptyChain(head_block=100)).start()
+                  for _ in range(2)))
+    pool = ConnectionPool(list(nodes), health_interval=0, timeout=2)
+    try:
+        for _ in range(4):
+            assert pool.rpc.get_dynamic_global_properties()["head_block_number"] == 100
+        # kill the node the next call goes to
+        dead = pool._select(set()).url
+        nodes[dead].stop()
+        for _ in range(4):
+            assert pool.rpc.get_dynamic_global_properties()["head_block_number"] == 100
+        errors = dict((s["url"], s["errors"]) for s in pool.stats())
+        assert errors[dead] > 0
+    finally:
+        pool.close()
+        for node in nodes.values():
+            node.stop()
+
+
+def test_health_check_does_not_hang_on_a_hung_node():
+    # accepts connections but never answers the websocket handshake
+    hung = socket.socket()
+    hung.bind(("127.0.0.1", 0))
+    hung.listen(8)
+    url = "ws://127.0.0.1:%d" % hung.getsockname()[1]
+    with FakeNode(source=EmptyChain(head_block=100)) as fake:
+        pool = ConnectionPool([url, fake.url], health_interval=0, timeout=0.5)
+        try:
+            start = time.time()
+            pool.check_health()
+            assert time.time() - start < 5
+            stats = dict((s["url"], s) for s in pool.stats())
+            assert stats[url]["errors"] == 1
+            assert stats[fake.url]["head_block"] == 100
+            assert pool.rpc.get_dynamic_global_properties()["head_block_number"] == 100
+        finally:
+            pool.close()
+    hung.close()
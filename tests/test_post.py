@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("piston")
+
+from megaphone.post import fetch_concurrently  # noqa: E402
+from megaphone.watcher import PostWatcher  # noqa: E402
+
+
+class FakeSocket(object):
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRPC(object):
+    def __init__(self):
+        self.ws = FakeSocket()
+
+    def get_content(self, author, permlink):
+        return {"author": author, "permlink": permlink, "active_votes": [],
+                "net_rshares": "0", "pending_payout_value": "0.000 SBD",
+                "total_payout_reward": "0.000 SBD",
+                "cashout_time": "2099-01-01T00:00:00"}
+
+
+class FakeChain(object):
+    opened = []
+
+    def __init__(self):
+        self.rpc = FakeRPC()
+        self.opened.append(self)
+
+
+def test_worker_connections_are_closed():
+    FakeChain.opened = []
+    calls = [("get_content", ("a", str(i))) for i in range(20)]
+    results = fetch_concurrently(None, calls, 4, FakeChain)
+    assert [r["permlink"] for r in results] == [str(i) for i in range(20)]
+    assert 0 < len(FakeChain.opened) <= 4
+    assert all(c.rpc.ws.closed for c in FakeChain.opened)
+
+
+def test_watcher_reuses_worker_connections():
+    FakeChain.opened = []
+    watcher = PostWatcher(object(), batch_size=100, concurrency=4,
+                          chain_factory=FakeChain)
+    watcher.watch(["@a/%d" % i for i in range(500)])
+    watcher.refresh()
+    watcher.refresh()
+    assert 0 < len(FakeChain.opened) <= 4
+    assert not any(c.rpc.ws.closed for c in FakeChain.opened)
+    watcher.close()
+    assert all(c.rpc.ws.closed for c in FakeChain.opened)
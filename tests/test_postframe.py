@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+
+from megaphone.helpers import parse_payout
+from megaphone.postframe import PostFrame
+from megaphone.synthetic import SyntheticChain
+
+
+def posts(count=200):
+    source = SyntheticChain(head_block=1000000)
+    return [source.get_content(source.account_name(i), "post-%d" % i)
+            for i in range(count)]
+
+
+def test_from_raw_get_content():
+    contents = posts()
+    frame = PostFrame.from_posts(contents)
+    assert len(frame) == len(contents)
+    expected = [parse_payout(c["total_payout_value"]) +
+                parse_payout(c["pending_payout_value"]) for c in contents]
+    assert frame.payout().tolist() == expected
+    assert not frame.is_comment().any()
+
+
+def test_contains_tags_after_select():
+    contents = posts()
+    frame = PostFrame.from_posts(contents)
+    tags = [set(json.loads(c["json_metadata"])["tags"]) for c in contents]
+    expected = np.array([bool(t & {"art", "news"}) for t in tags])
+    assert (frame.contains_tags(("art", "news")) == expected).all()
+
+    index = np.arange(0, len(contents), 3)
+    selected = frame.select(index)
+    assert (selected.contains_tags(("art", "news")) == expected[index]).all()
+    assert selected.identifiers == [frame.identifiers[i] for i in index]
+    assert not frame.contains_tags(("unknown",)).any()
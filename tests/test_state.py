@@ -0,0 +1,138 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from megaphone.asset import Asset
+from megaphone.blockchain import Blockchain
+from megaphone.fakenode import EmptyChain
+from megaphone.state import AccountState
+
+NAMES = ["alice", "bob", "carol", "dave", "erin"]
+
+
+class LedgerChain(EmptyChain):
+    """
+    Transfers and author rewards among a few accounts, get_accounts
+    returns balances at the head block.
+    """
+    def operations(self, block_num):
+        rng = random.Random(block_num)
+        ops = []
+        for _ in range(3):
+            sender, receiver = rng.sample(NAMES, 2)
+            ops.append(["transfer", {
+                "from": sender, "to": receiver, "memo": "",
+                "amount": "%d.%03d STEEM" % (rng.randint(0, 5),
+                                             rng.randint(0, 999))}])
+        ops.append(["author_reward", {
+            "author": rng.choice(NAMES), "permlink": "post",
+            "sbd_payout": "0.100 SBD", "steem_payout": "0.000 STEEM",
+            "vesting_payout": "1.000000 VESTS"}])
+        return ops
+
+    def get_ops_in_block(self, block_num, only_virtual=False):
+        if not 0 < block_num <= self.head_block:
+            return []
+        return [{"op": op, "timestamp": self.block_time(block_num)}
+                for op in self.operations(block_num)
+                if not only_virtual or op[0] == "author_reward"]
+
+    def _account(self, name):
+        amounts = {"STEEM": 100000, "SBD": 10000, "VESTS": 1000000000}
+        for block_num in range(1, self.head_block + 1):
+            for op_type, op in self.operations(block_num):
+                if op_type == "transfer":
+                    amount = Asset.from_string(op["amount"]).amount
+                    amounts["STEEM"] -= amount * (op["from"] == name)
+                    amounts["STEEM"] += amount * (op["to"] == name)
+                elif op["author"] == name:
+                    for field in ("sbd_payout", "steem_payout",
+                                  "vesting_payout"):
+                        asset = Asset.from_string(op[field])
+                        amounts[asset.symbol] += asset.amount
+        account = super(LedgerChain, self)._account(name)
+        account.update(
+            balance=str(Asset(amounts["STEEM"], "STEEM", 3)),
+            sbd_balance=str(Asset(amounts["SBD"], "SBD", 3)),
+            vesting_shares=str(Asset(amounts["VESTS"], "VESTS", 6)))
+        return account
+
+
+@pytest.fixture
+def chain():
+    source = LedgerChain(head_block=10)
+    return SimpleNamespace(rpc=source)
+
+
+def balances(accounts):
+    return dict((a["name"], (a["balance"], a["sbd_balance"],
+                             a["vesting_shares"])) for a in accounts)
+
+
+def state_balances(state, names):
+    return dict((name, tuple(str(Asset(int(round(state.get(name)[column] *
+                                                 10 ** precision)),
+                                       symbol, precision))
+                             for column, symbol, precision in
+                             (("balance", "STEEM", 3),
+                              ("sbd_balance", "SBD", 3),
+                              ("vesting_shares", "VESTS", 6))))
+                for name in names)
+
+
+def test_sync_materializes_balances(chain):
+    state = AccountState(chain)
+    state.load_accounts(NAMES)
+    assert state.block_num == 10
+    chain.rpc.head_block = 60
+    state.sync(Blockchain(chain), end_block=50)
+    chain.rpc.head_block = 50
+    assert state_balances(state, NAMES) == \
+        balances(chain.rpc.get_accounts(NAMES))
+
+
+def test_accounts_loaded_later_are_not_double_counted(chain):
+    state = AccountState(chain)
+    state.load_accounts(NAMES[:2])
+    chain.rpc.head_block = 30
+    state.load_accounts(NAMES[2:])
+    chain.rpc.head_block = 60
+    state.sync(Blockchain(chain), end_block=50)
+    chain.rpc.head_block = 50
+    assert state_balances(state, NAMES) == \
+        balances(chain.rpc.get_accounts(NAMES))
+
+
+def test_snapshot_round_trip(chain, tmp_path):
+    path = str(tmp_path / "state.npz")
+    state = AccountState(chain)
+    state.load_accounts(NAMES)
+    chain.rpc.head_block = 60
+    state.sync(Blockchain(chain), end_block=30, snapshot_path=path)
+
+    resumed = AccountState(chain).load(path)
+    assert resumed.block_num == 30
+    assert state_balances(resumed, NAMES) == state_balances(state, NAMES)
+    resumed.sync(Blockchain(chain), end_block=50)
+    chain.rpc.head_block = 50
+    assert state_balances(resumed, NAMES) == \
+        balances(chain.rpc.get_accounts(NAMES))
+
+
+def test_batch_is_read_again_when_a_block_is_produced(chain):
+    get_accounts = chain.rpc.get_accounts
+    calls = []
+
+    def racing_get_accounts(names):
+        accounts = get_accounts(names)
+        calls.append(chain.rpc.head_block)
+        if len(calls) == 1:
+            chain.rpc.head_block += 1
+        return accounts
+
+    chain.rpc.get_accounts = racing_get_accounts
+    state = AccountState(chain)
+    state.load_accounts(NAMES)
+    assert calls == [10, 11]
+    assert state.block_num == 11
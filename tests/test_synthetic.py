@@ -0,0 +1,12 @@
+from types import SimpleNamespace
+
+from megaphone.blockchain import Blockchain
+from megaphone.synthetic import SyntheticChain
+
+
+def test_get_all_usernames():
+    source = SyntheticChain(accounts=2500)
+    names = Blockchain(SimpleNamespace(rpc=source)).get_all_usernames()
+    assert len(names) == 2500
+    assert names == sorted(names)
+    assert source.lookup_accounts(names[1000], 2) == names[1000:1002]